@@ -5,14 +5,27 @@ __license__   = 'GPL v3'
 __copyright__ = '2008, Kovid Goyal <kovid at kovidgoyal.net>'
 
 import io
+import os
 from struct import pack
 
+# LZ77 parameters of the PalmDoc format: back-references are encoded in two
+# bytes with an 11 bit distance and a 3 bit length of 3-10 bytes.
+WINDOW = 2047
+MIN_MATCH = 3
+MAX_MATCH = 10
 
-def decompress_doc(data):
-    '''Pure Python PalmDoc decompression.'''
-    if not data:
-        return b''
-    out = io.BytesIO()
+# Starting worker processes only pays off when every worker gets at least this
+# many records to compress
+MIN_RECORDS_PER_WORKER = 32
+
+
+def _decompress_into(data, out):
+    '''
+    Decompress the PalmDoc record data, appending the result to the bytearray
+    out. Back-references cannot reach before the start of the record, bytes
+    they point to outside it are output as NULs.
+    '''
+    start = len(out)
     i = 0
     ldata = len(data)
     while i < ldata:
@@ -20,15 +33,15 @@ def decompress_doc(data):
         i += 1
         if c >= 1 and c <= 8:
             # Copy next c bytes literally
-            out.write(data[i:i+c])
+            out += data[i:i+c]
             i += c
         elif c <= 0x7f:
             # Literal byte
-            out.write(bytes([c]))
+            out.append(c)
         elif c >= 0xc0:
             # Space + (c ^ 0x80)
-            out.write(b' ')
-            out.write(bytes([c ^ 0x80]))
+            out.append(0x20)
+            out.append(c ^ 0x80)
         else:
             # LZ77 distance-length pair
             if i >= ldata:
@@ -37,21 +50,145 @@ def decompress_doc(data):
             i += 1
             distance = (c >> 3) & 0x7ff
             length = (c & 0x07) + 3
-            buf = out.getvalue()
-            pos = len(buf) - distance
-            for j in range(length):
-                if pos + j >= 0 and pos + j < len(buf):
-                    out.write(bytes([buf[pos + j]]))
-                else:
-                    out.write(b'\x00')
-    return out.getvalue()
+            pos = len(out) - distance
+            if distance >= length and pos >= start:
+                out += out[pos:pos+length]
+            else:
+                # Overlapping run, the copied bytes are themselves part of
+                # the run so they have to be copied one at a time
+                for j in range(pos, pos + length):
+                    out.append(out[j] if distance and j >= start else 0)
+
+
+def decompress_doc(data):
+    '''Pure Python PalmDoc decompression.'''
+    if not data:
+        return b''
+    out = bytearray()
+    _decompress_into(data, out)
+    return bytes(out)
+
+
+def decompress_doc_records(records):
+    '''
+    Decompress a sequence of PalmDoc records, returning their concatenation.
+    All records are decoded into a single buffer, so no intermediate bytes
+    objects are created for the individual records.
+    '''
+    out = bytearray()
+    for data in records:
+        _decompress_into(data, out)
+    return bytes(out)
 
 
 def compress_doc(data):
     return py_compress_doc(data) if data else b''
 
 
+def compress_doc_records(records, workers=0):
+    '''
+    Compress a list of records, returning the list of compressed records in
+    the same order. Records are compressed independently in up to workers
+    processes, 0 means one process per CPU. Books too small to benefit are
+    compressed serially, as is everything if the process pool fails.
+    '''
+    records = list(records)
+    if workers < 1:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(records) // MIN_RECORDS_PER_WORKER)
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        chunksize = max(1, len(records) // (workers * 4))
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(compress_doc, records, chunksize=chunksize))
+        except (OSError, BrokenProcessPool):
+            pass
+    return list(map(compress_doc, records))
+
+
 def py_compress_doc(data):
+    '''
+    Pure Python PalmDoc compression.
+
+    Back-references are found with hash chains keyed on the three byte prefix
+    of every position, restricted to the 2047 byte LZ77 window, so each record
+    is compressed in linear time. The output is byte-for-byte identical to that
+    of :func:`reference_compress_doc`: for every position the longest match
+    wins and among equally long matches the closest one is used.
+    '''
+    data = bytes(data)
+    ldata = len(data)
+    out = bytearray()
+    # head maps a three byte prefix to the most recent position it occurs at,
+    # prev links every position to the previous one with the same prefix
+    head = {}
+    prev = [-1] * ldata
+    inserted = 0
+    i = 0
+    while i < ldata:
+        if i > 10 and (ldata - i) > 10:
+            # Only positions whose match cannot overlap i are candidates
+            while inserted <= i - MIN_MATCH:
+                key = data[inserted:inserted+MIN_MATCH]
+                prev[inserted] = head.get(key, -1)
+                head[key] = inserted
+                inserted += 1
+            p = head.get(data[i:i+MIN_MATCH], -1)
+            limit = i - WINDOW
+            best_len = 0
+            best_pos = -1
+            while p >= 0 and p >= limit:
+                # Back-references may not overlap the current position
+                cap = min(i - p, MAX_MATCH)
+                if cap > best_len:
+                    n = MIN_MATCH
+                    while n < cap and data[p+n] == data[i+n]:
+                        n += 1
+                    if n > best_len:
+                        best_len, best_pos = n, p
+                        if n == MAX_MATCH:
+                            break
+                p = prev[p]
+            if best_len:
+                m = i - best_pos
+                code = 0x8000 + ((m << 3) & 0x3ff8) + (best_len - 3)
+                out.append(code >> 8)
+                out.append(code & 0xff)
+                i += best_len
+                continue
+        och = data[i]
+        i += 1
+        if och == 0x20 and (i + 1) < ldata:
+            onch = data[i]
+            if 0x40 <= onch < 0x80:
+                out.append(onch ^ 0x80)
+                i += 1
+                continue
+        if och == 0 or 8 < och < 0x80:
+            out.append(och)
+        else:
+            # Run of up to 8 bytes that must be escaped as binary
+            j = i
+            end = min(ldata, i + 7)
+            while j < end:
+                c = data[j]
+                if c == 0 or 8 < c < 0x80:
+                    break
+                j += 1
+            out.append(j - i + 1)
+            out += data[i-1:j]
+            i = j
+    return bytes(out)
+
+
+def reference_compress_doc(data):
+    '''
+    The original PalmDoc compressor, which searches for back-references with
+    bytes.rindex(). It is quadratic in the record size and is only kept as a
+    reference for tests and benchmarks.
+    '''
     out = io.BytesIO()
     i = 0
     ldata = len(data)
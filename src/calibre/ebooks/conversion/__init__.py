@@ -23,3 +23,15 @@ class ConversionUserFeedBack(Exception):
 # Ensure exception uses fully qualified name as this is used to detect it in
 # the GUI.
 ConversionUserFeedBack.__name__ = 'calibre.ebooks.conversion.ConversionUserFeedBack'
+
+
+class RetryConversion(Exception):
+
+    def __init__(self, msg, **options):
+        ''' Raised by an output plugin when the book it was given can no longer
+        be converted, for example because a worker process died after the book
+        was changed. The conversion is run again from the input file, with the
+        options changed to the values in options, which must avoid the failure.
+        '''
+        Exception.__init__(self, msg)
+        self.options = options
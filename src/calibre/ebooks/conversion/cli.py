@@ -52,7 +52,7 @@ HEURISTIC_OPTIONS = ['markup_chapter_headings',
                       'dehyphenate', 'renumber_headings',
                       'replace_scene_breaks']
 
-DEFAULT_TRUE_OPTIONS = HEURISTIC_OPTIONS + ['remove_fake_margins']
+DEFAULT_TRUE_OPTIONS = HEURISTIC_OPTIONS + ['remove_fake_margins', 'mobi_parallel_joint']
 
 
 def print_help(parser, log):
@@ -173,6 +173,7 @@ def add_pipeline_options(parser, plumber):
                       'line_height', 'minimum_line_height',
                       'linearize_tables', 'transform_html_rules',
                       'extra_css', 'filter_css', 'transform_css_rules', 'expand_css',
+                      'html_parse_workers', 'css_flatten_workers',
                       'smarten_punctuation', 'unsmarten_punctuation',
                       'margin_top', 'margin_left', 'margin_right',
                       'margin_bottom', 'change_justification',
@@ -245,7 +245,7 @@ OPTIONS = {
             'disable_font_rescaling', 'insert_blank_line',
             'remove_paragraph_spacing', 'remove_paragraph_spacing_indent_size',
             'insert_blank_line_size', 'input_encoding', 'filter_css',
-            'expand_css', 'asciiize', 'keep_ligatures', 'linearize_tables',
+            'expand_css', 'html_parse_workers', 'css_flatten_workers', 'asciiize', 'keep_ligatures', 'linearize_tables',
             'transform_css_rules', 'transform_html_rules'),
 
         'metadata': ('prefer_metadata_cover',),
@@ -269,7 +269,7 @@ OPTIONS = {
     },
 
     'output': {
-        'azw3': ('prefer_author_sort', 'toc_title', 'mobi_toc_at_start', 'dont_compress', 'no_inline_toc', 'share_not_sync',),
+        'azw3': ('prefer_author_sort', 'toc_title', 'mobi_toc_at_start', 'dont_compress', 'compression_workers', 'no_inline_toc', 'share_not_sync',),
 
         'docx': (
             'docx_page_size', 'docx_custom_page_size', 'docx_no_cover', 'docx_no_toc',
@@ -279,7 +279,8 @@ OPTIONS = {
         'epub': (
             'dont_split_on_page_breaks', 'flow_size', 'no_default_epub_cover',
             'no_svg_cover', 'epub_inline_toc', 'epub_toc_at_end', 'toc_title',
-            'preserve_cover_aspect_ratio', 'epub_flatten', 'epub_version', 'epub_max_image_size',),
+            'preserve_cover_aspect_ratio', 'epub_flatten', 'epub_version', 'epub_max_image_size',
+            'epub_image_workers', 'epub_compression_level', 'epub_compression_workers',),
 
         'kepub': (
             'dont_split_on_page_breaks', 'flow_size', 'kepub_max_image_size', 'kepub_prefer_justification',
@@ -300,8 +301,8 @@ OPTIONS = {
         'mobi': (
             'prefer_author_sort', 'toc_title', 'mobi_keep_original_images',
             'mobi_ignore_margins', 'mobi_toc_at_start', 'dont_compress',
-            'no_inline_toc', 'share_not_sync', 'personal_doc',
-            'mobi_file_type'),
+            'compression_workers', 'no_inline_toc', 'share_not_sync', 'personal_doc',
+            'mobi_file_type', 'mobi_parallel_joint'),
 
         'pdb': ('format', 'inline_toc', 'pdb_output_encoding'),
 
@@ -8,6 +8,7 @@ __docformat__ = 'restructuredtext en'
 import os
 import re
 import shutil
+from operator import attrgetter
 
 from calibre import CurrentDir
 from calibre.customize.conversion import OptionRecommendation, OutputFormatPlugin
@@ -141,6 +142,25 @@ class EPUBOutput(OutputFormatPlugin):
             help=max_image_size_help
         ),
 
+        OptionRecommendation(name='epub_image_workers', recommended_value=0,
+            help=_('Number of threads used to rescale the images of the book and'
+                ' convert them from CMYK to RGB. The default of 0 uses one thread'
+                ' per CPU core, 1 processes the images one at a time. The output'
+                ' is the same regardless of the number of threads.')
+        ),
+
+        OptionRecommendation(name='epub_compression_level', recommended_value=6,
+            help=_('The compression level used for the files in the EPUB, from 1 (fastest)'
+                ' to 9 (smallest). 0 stores all files uncompressed. Files that do not'
+                ' shrink when compressed, such as most images, fonts and media, are stored.')
+        ),
+
+        OptionRecommendation(name='epub_compression_workers', recommended_value=0,
+            help=_('Number of threads used to compress the files in the EPUB. The'
+                ' default of 0 uses one thread per CPU core, 1 compresses the files'
+                ' one at a time. The output is the same regardless of the number of threads.')
+        ),
+
     }
 
     recommendations = {('pretty_print', True, OptionRecommendation.HIGH)}
@@ -193,6 +213,13 @@ class EPUBOutput(OutputFormatPlugin):
 
     # }}}
 
+    def specialize_options(self, log, opts, input_fmt):
+        # Checked before the conversion starts, rather than when zlib rejects
+        # the level as the EPUB is written
+        if not 0 <= opts.epub_compression_level <= 9:
+            raise ValueError(
+                f'The EPUB compression level must be between 0 and 9, not {opts.epub_compression_level}')
+
     def convert(self, oeb, output_path, input_plugin, opts, log):
         self.log, self.opts, self.oeb = log, opts, oeb
 
@@ -216,7 +243,8 @@ class EPUBOutput(OutputFormatPlugin):
         self.upshift_markup()
 
         from calibre.ebooks.oeb.transforms.rescale import RescaleImages
-        RescaleImages(check_colorspaces=True)(oeb, opts, max_size=self.opts.epub_max_image_size)
+        RescaleImages(check_colorspaces=True, workers=self.opts.epub_image_workers)(
+            oeb, opts, max_size=self.opts.epub_max_image_size)
 
         from calibre.ebooks.oeb.transforms.split import Split
         split = Split(not self.opts.dont_split_on_page_breaks,
@@ -262,15 +290,60 @@ class EPUBOutput(OutputFormatPlugin):
                 if str(x) == uuid:
                     x.content = 'urn:uuid:'+uuid
 
+        metadata_xml = None
+        extra_entries = []
+        if self.is_periodical:
+            if self.opts.output_profile.epub_periodical_format == 'sony':
+                from calibre.ebooks.epub.periodical import sony_metadata
+                metadata_xml, atom_xml = sony_metadata(oeb)
+                extra_entries = [('atom.xml', 'application/atom+xml', atom_xml)]
+        # Font encryption, the EPUB 3 upgrade and container callbacks work on
+        # the files of the book, everything else is zipped straight from the
+        # OEBBook
+        if encrypted_fonts or self.opts.epub_version == '3' or getattr(self, 'container_callback', None):
+            self.write_from_folder(oeb, output_path, input_plugin, uuid, encrypted_fonts, extra_entries, metadata_xml)
+        else:
+            self.write_from_book(oeb, output_path, extra_entries, metadata_xml)
+        if opts.extract_to is not None:
+            from calibre.utils.zipfile import ZipFile
+            if os.path.exists(opts.extract_to):
+                if os.path.isdir(opts.extract_to):
+                    shutil.rmtree(opts.extract_to)
+                else:
+                    os.remove(opts.extract_to)
+            os.mkdir(opts.extract_to)
+            with ZipFile(output_path) as zf:
+                zf.extractall(path=opts.extract_to)
+            self.log.info('Book extracted to:', opts.extract_to)
+
+    def write_from_book(self, oeb, output_path, extra_entries, metadata_xml):
+        from calibre.ebooks.epub import initialize_container, log_compression_stats
+        from calibre.ebooks.oeb.base import NCX_MIME, OPF_MIME, urlunquote, xml2str
+
+        def arcname(href):
+            # The name the OEB output plugin would have given the file
+            return urlunquote(href.encode('utf-8')).decode('utf-8')
+
+        metadata = oeb.to_opf2()
+        opf = metadata[OPF_MIME][0]
+        with initialize_container(output_path, opf, extra_entries=extra_entries,
+                compresslevel=self.opts.epub_compression_level, workers=self.opts.epub_compression_workers) as epub:
+            # The manifest is a set, sort it so that the output is reproducible
+            for item in sorted(oeb.manifest.values(), key=attrgetter('href')):
+                epub.writestr(arcname(item.href), item.bytes_representation)
+            for mime, (href, data) in metadata.items():
+                data = xml2str(data, pretty_print=False)
+                if mime == NCX_MIME:
+                    data = self.condense_ncx_data(data)
+                epub.writestr(arcname(href), data)
+            if metadata_xml is not None:
+                epub.writestr('META-INF/metadata.xml', metadata_xml.encode('utf-8'))
+        log_compression_stats(epub, self.log)
+
+    def write_from_folder(self, oeb, output_path, input_plugin, uuid, encrypted_fonts, extra_entries, metadata_xml):
+        opts, log = self.opts, self.log
         with TemporaryDirectory('_epub_output') as tdir:
             from calibre.customize.ui import plugin_for_output_format
-            metadata_xml = None
-            extra_entries = []
-            if self.is_periodical:
-                if self.opts.output_profile.epub_periodical_format == 'sony':
-                    from calibre.ebooks.epub.periodical import sony_metadata
-                    metadata_xml, atom_xml = sony_metadata(oeb)
-                    extra_entries = [('atom.xml', 'application/atom+xml', atom_xml)]
             oeb_output = plugin_for_output_format('oeb')
             oeb_output.convert(oeb, tdir, input_plugin, opts, log)
             opf = [x for x in os.listdir(tdir) if x.endswith('.opf')][0]
@@ -286,26 +359,17 @@ class EPUBOutput(OutputFormatPlugin):
                 cb(container)
                 encryption = self.end_container(cxpath, encpath)
 
-            from calibre.ebooks.epub import initialize_container
+            from calibre.ebooks.epub import initialize_container, log_compression_stats
             with initialize_container(output_path, os.path.basename(opf),
-                    extra_entries=extra_entries) as epub:
+                    extra_entries=extra_entries, compresslevel=opts.epub_compression_level,
+                    workers=opts.epub_compression_workers) as epub:
                 epub.add_dir(tdir)
                 if encryption is not None:
                     epub.writestr('META-INF/encryption.xml', as_bytes(encryption))
                 if metadata_xml is not None:
                     epub.writestr('META-INF/metadata.xml',
                             metadata_xml.encode('utf-8'))
-            if opts.extract_to is not None:
-                from calibre.utils.zipfile import ZipFile
-                if os.path.exists(opts.extract_to):
-                    if os.path.isdir(opts.extract_to):
-                        shutil.rmtree(opts.extract_to)
-                    else:
-                        os.remove(opts.extract_to)
-                os.mkdir(opts.extract_to)
-                with ZipFile(output_path) as zf:
-                    zf.extractall(path=opts.extract_to)
-                self.log.info('Book extracted to:', opts.extract_to)
+            log_compression_stats(epub, log)
 
     def create_container(self, tdir, opf, encryption):
         from calibre.ebooks.epub import simple_container_xml
@@ -400,17 +464,25 @@ class EPUBOutput(OutputFormatPlugin):
     # }}}
 
     def condense_ncx(self, ncx_path):  # {{{
-        from lxml import etree
         if not self.opts.pretty_print:
-            tree = etree.parse(ncx_path)
-            for tag in tree.getroot().iter(tag=etree.Element):
-                if tag.text:
-                    tag.text = tag.text.strip()
-                if tag.tail:
-                    tag.tail = tag.tail.strip()
-            compressed = etree.tostring(tree.getroot(), encoding='utf-8')
-            with open(ncx_path, 'wb') as f:
+            with open(ncx_path, 'r+b') as f:
+                compressed = self.condense_ncx_data(f.read())
+                f.seek(0), f.truncate()
                 f.write(compressed)
+
+    def condense_ncx_data(self, raw):
+        from lxml import etree
+
+        from calibre.utils.xml_parse import safe_xml_fromstring
+        if self.opts.pretty_print:
+            return raw
+        root = safe_xml_fromstring(raw)
+        for tag in root.iter(tag=etree.Element):
+            if tag.text:
+                tag.text = tag.text.strip()
+            if tag.tail:
+                tag.tail = tag.tail.strip()
+        return etree.tostring(root, encoding='utf-8')
     # }}}
 
     def workaround_ade_quirks(self):  # {{{
@@ -434,8 +506,8 @@ class EPUBOutput(OutputFormatPlugin):
                             f'Removing fragment identifier {frag!r} from TOC as Adobe Digital Editions cannot handle it')
                     node.href = base
 
-        for x in self.oeb.spine:
-            root = x.data
+        for item in self.oeb.spine:
+            root = item.data
             body = XPath('//h:body')(root)
             if body:
                 body = body[0]
@@ -515,7 +587,10 @@ class EPUBOutput(OutputFormatPlugin):
                 tag.set('style', 'text-align:center')
             # ADE can't handle &amp; in an img url
             for tag in XPath('//h:img[@src]')(root):
-                tag.set('src', tag.get('src', '').replace('&', ''))
+                src = tag.get('src', '')
+                if '&' in src:
+                    tag.set('src', src.replace('&', ''))
+                    self.oeb.links.invalidate(item)
 
             # ADE whimpers in fright when it encounters a <td> outside a
             # <table>
@@ -24,25 +24,29 @@ class MOBIInput(InputFormatPlugin):
 
         from calibre.ebooks.mobi.reader.mobi6 import MobiReader
         parse_cache = {}
-        try:
+
+        def read(try_extra_data_fix=False):
             mr = MobiReader(stream, log, options.input_encoding,
-                        options.debug_pipeline)
+                        options.debug_pipeline, try_extra_data_fix=try_extra_data_fix)
             if mr.kf8_type is None:
-                mr.extract_content('.', parse_cache)
+                # The mapped file is not needed once the content is extracted
+                with mr:
+                    mr.extract_content('.', parse_cache)
+            return mr
 
+        try:
+            mr = read()
         except Exception:
-            mr = MobiReader(stream, log, options.input_encoding,
-                        options.debug_pipeline, try_extra_data_fix=True)
-            if mr.kf8_type is None:
-                mr.extract_content('.', parse_cache)
+            mr = read(try_extra_data_fix=True)
 
         if mr.kf8_type is not None:
             log(f'Found KF8 MOBI of type {mr.kf8_type!r}')
             if mr.kf8_type == 'joint':
                 self.mobi_is_joint = True
             from calibre.ebooks.mobi.reader.mobi8 import Mobi8Reader
-            mr = Mobi8Reader(mr, log)
-            opf = os.path.abspath(mr())
+            with mr:
+                mr = Mobi8Reader(mr, log)
+                opf = os.path.abspath(mr())
             self.encrypted_fonts = mr.encrypted_fonts
             self.is_kf8 = True
             return opf
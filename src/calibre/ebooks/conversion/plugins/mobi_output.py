@@ -5,6 +5,8 @@ __license__   = 'GPL v3'
 __copyright__ = '2009, Kovid Goyal <kovid@kovidgoyal.net>'
 __docformat__ = 'restructuredtext en'
 
+import os
+
 from calibre.customize.conversion import OptionRecommendation, OutputFormatPlugin
 
 
@@ -58,6 +60,13 @@ class MOBIOutput(OutputFormatPlugin):
             recommended_value=False, level=OptionRecommendation.LOW,
             help=_('Disable compression of the file contents.')
         ),
+        OptionRecommendation(name='compression_workers',
+            recommended_value=0, level=OptionRecommendation.LOW,
+            help=_('Number of worker processes used to compress the text of '
+                'the book. The default of 0 uses one process per CPU core, 1 '
+                'disables parallel compression. Small books are always '
+                'compressed in a single process.')
+        ),
         OptionRecommendation(name='personal_doc', recommended_value='[PDOC]',
             help=_('Tag for MOBI files to be marked as personal documents.'
                    ' This option has no effect on the conversion. It is used'
@@ -105,6 +114,12 @@ class MOBIOutput(OutputFormatPlugin):
                 'the new KF8 format, or only the new KF8 format. KF8 has '
                 'more features than MOBI 6, but only works with newer Kindles. '
                 'Allowed values: {}').format('old, both, new')),
+        OptionRecommendation(name='mobi_parallel_joint',
+            recommended_value=True, level=OptionRecommendation.LOW,
+            help=_('When creating MOBI files that contain both MOBI 6 and KF8, '
+                'create the KF8 part in a separate process at the same time '
+                'as the MOBI 6 part, if there is more than one CPU core. The '
+                'output is the same either way.')),
 
     }
 
@@ -203,8 +218,12 @@ class MOBIOutput(OutputFormatPlugin):
             from calibre.ebooks.oeb.transforms.split import Split
             Split()(self.oeb, self.opts)
 
-        kf8 = self.create_kf8(resources, for_joint=mobi_type=='both'
-                ) if create_kf8 else None
+        if mobi_type == 'both' and opts.mobi_parallel_joint and (os.cpu_count() or 1) > 1:
+            from calibre.ebooks.mobi.writer8.main import start_joint_kf8_book
+            kf8 = start_joint_kf8_book(self.oeb, self.opts, resources)
+        else:
+            kf8 = self.create_kf8(resources, for_joint=mobi_type=='both'
+                    ) if create_kf8 else None
         if mobi_type == 'new':
             kf8.write(output_path)
             extract_mobi(output_path, opts)
@@ -215,8 +234,9 @@ class MOBIOutput(OutputFormatPlugin):
 
     def create_kf8(self, resources, for_joint=False):
         from calibre.ebooks.mobi.writer8.main import create_kf8_book
+        # Only a joint file needs the markup of the book afterwards
         return create_kf8_book(self.oeb, self.opts, resources,
-                for_joint=for_joint)
+                for_joint=for_joint, preserve_data=for_joint)
 
     def write_mobi(self, input_plugin, output_path, kf8, resources):
         from calibre.customize.ui import plugin_for_input_format
@@ -291,6 +311,13 @@ class AZW3Output(OutputFormatPlugin):
             recommended_value=False, level=OptionRecommendation.LOW,
             help=_('Disable compression of the file contents.')
         ),
+        OptionRecommendation(name='compression_workers',
+            recommended_value=0, level=OptionRecommendation.LOW,
+            help=_('Number of worker processes used to compress the text of '
+                'the book. The default of 0 uses one process per CPU core, 1 '
+                'disables parallel compression. Small books are always '
+                'compressed in a single process.')
+        ),
         OptionRecommendation(name='mobi_toc_at_start',
             recommended_value=False,
             help=_('When adding the Table of Contents to the book, add it at the start of the '
@@ -328,7 +355,7 @@ class AZW3Output(OutputFormatPlugin):
             from calibre.ebooks.oeb.transforms.split import Split
             Split()(self.oeb, self.opts)
 
-        kf8 = create_kf8_book(self.oeb, self.opts, resources, for_joint=False)
+        kf8 = create_kf8_book(self.oeb, self.opts, resources, for_joint=False, preserve_data=False)
 
         kf8.write(output_path)
         extract_mobi(output_path, opts)
@@ -22,6 +22,7 @@ from calibre.customize.ui import (
     run_plugins_on_postprocess,
     run_plugins_on_preprocess,
 )
+from calibre.ebooks.conversion import RetryConversion
 from calibre.ebooks.conversion.archives import ARCHIVE_FMTS, unarchive
 from calibre.ebooks.conversion.preprocess import HTMLPreProcessor
 from calibre.ptempfile import PersistentTemporaryDirectory
@@ -46,6 +47,10 @@ various stages of conversion. The stages are:
     4. processed - This corresponds to the e-book as it is passed to the output
     plugin. Use this folder to debug the output plugin.
 
+The file preprocess_rules.txt lists the time taken and the number of matches
+of every regular expression rule run on the HTML before it was parsed,
+including the search and replace rules.
+
 '''
 
 
@@ -400,6 +405,22 @@ OptionRecommendation(name='expand_css',
                 ' as the Nook cannot handle shorthand CSS.')
         ),
 
+OptionRecommendation(name='html_parse_workers',
+            recommended_value=1, level=OptionRecommendation.LOW,
+            help=_('Number of worker processes used to parse the HTML files '
+                'of the input book. The default of 1 parses them in a single '
+                'process as they are needed, 0 uses one process per CPU core.')
+        ),
+
+OptionRecommendation(name='css_flatten_workers',
+            recommended_value=1, level=OptionRecommendation.LOW,
+            help=_('Number of worker processes used to apply the styles of '
+                'the book to its HTML files. The default of 1 does all the '
+                'work in a single process, 0 uses one process per CPU core. '
+                'The output is the same regardless of the number of '
+                'processes.')
+        ),
+
 OptionRecommendation(name='page_breaks_before',
             recommended_value="//*[name()='h1' or name()='h2']",
             level=OptionRecommendation.LOW,
@@ -1007,6 +1028,15 @@ OptionRecommendation(name='search_replace',
         w = OEBWriter(pretty_print=self.opts.pretty_print)
         w(oeb, out_dir)
 
+    def dump_rule_stats(self, oeb):
+        from calibre.ebooks.conversion.preprocess import format_rule_stats
+        stats = getattr(oeb.html_preprocessor, 'rule_stats', None)
+        if stats:
+            path = os.path.join(self.opts.debug_pipeline, 'preprocess_rules.txt')
+            with open(path, 'wb') as f:
+                f.write(format_rule_stats(stats).encode('utf-8'))
+            self.log('Preprocessing rule timings written to:', path)
+
     def dump_input(self, ret, output_dir):
         out_dir = os.path.join(self.opts.debug_pipeline, 'input')
         if isinstance(ret, (str, bytes)):
@@ -1022,6 +1052,9 @@ OptionRecommendation(name='search_replace',
         '''
         Run the conversion pipeline
         '''
+        from calibre.ebooks.oeb.base import reset_url_cache_stats
+        # The URL cache statistics logged at the end are for this conversion
+        reset_url_cache_stats()
         # Setup baseline option values
         self.setup_options()
         if self.opts.verbose:
@@ -1091,6 +1124,7 @@ OptionRecommendation(name='search_replace',
                 out_dir = os.path.join(self.opts.debug_pipeline, 'parsed')
                 self.dump_oeb(self.oeb, out_dir)
                 self.log('Parsed HTML written to:', out_dir)
+                self.dump_rule_stats(self.oeb)
             self.input_plugin.specialize(self.oeb, self.opts, self.log,
                     self.output_fmt)
 
@@ -1224,6 +1258,9 @@ OptionRecommendation(name='search_replace',
 
         from calibre.ebooks.oeb.transforms.trimmanifest import ManifestTrimmer
 
+        # The transforms above change links in the markup without updating
+        # the link index
+        self.oeb.links.invalidate()
         self.log.info('Cleaning up manifest...')
         trimmer = ManifestTrimmer()
         trimmer(self.oeb, self.opts)
@@ -1241,14 +1278,24 @@ OptionRecommendation(name='search_replace',
         our = CompositeProgressReporter(0.67, 1., self.ui_reporter)
         self.output_plugin.report_progress = our
         our(0., _('Running %s plugin')%self.output_plugin.name)
-        with self.output_plugin:
-            self.output_plugin.convert(self.oeb, self.output, self.input_plugin,
-                self.opts, self.log)
+        try:
+            with self.output_plugin:
+                self.output_plugin.convert(self.oeb, self.output, self.input_plugin,
+                    self.opts, self.log)
+        except RetryConversion as err:
+            self.log.warn(f'{err}, converting the book again')
+            self.oeb.clean_temp_files()
+            # Overrides the options even when the user set them
+            for name, val in err.options.items():
+                self.get_option_by_name(name).recommended_value = val
+            return self.run()
         self.oeb.clean_temp_files()
         self.ui_reporter(1.)
         run_plugins_on_postprocess(self.output, self.output_fmt)
 
         self.log(self.output_fmt.upper(), 'output written to', self.output)
+        from calibre.ebooks.oeb.base import format_url_cache_stats, url_cache_stats
+        self.log.debug('URL cache statistics:\n' + format_url_cache_stats(url_cache_stats()))
         self.flush()
 
 
@@ -1280,6 +1327,7 @@ def create_oebbook(log, path_or_stream, opts, reader=None,
     # Read OEB Book into OEBBook
     log('Parsing all content...')
     oeb.removed_items_to_ignore = removed_items
+    oeb.html_parse_workers = getattr(opts, 'html_parse_workers', 1)
     if reader is None:
         from calibre.ebooks.oeb.reader import OEBReader
         reader = OEBReader
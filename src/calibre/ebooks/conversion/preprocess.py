@@ -7,6 +7,7 @@ __docformat__ = 'restructuredtext en'
 
 import json
 import re
+import time
 from math import ceil
 
 from calibre import as_unicode, entity_regex, xml_replace_entities
@@ -186,6 +187,11 @@ class Dehyphenator:
     retain hyphens.
     '''
 
+    # Runs of word characters in the document, words looked up in the
+    # document only ever consist of word characters or hyphenated words
+    words_pat = re.compile(r'\w+')
+    hyphenated_words_pat = re.compile(r'[\w-]+')
+
     def __init__(self, verbose=0, log=None):
         self.log = log
         self.verbose = verbose
@@ -221,15 +227,15 @@ class Dehyphenator:
         if self.verbose > 2:
             self.log('lookup word is: '+lookupword+', orig is: ' + hyphenated)
         try:
-            searchresult = self.html.find(lookupword.lower())
+            searchresult = self.in_document(lookupword.lower())
         except Exception:
             return hyphenated
         if self.format in {'html_cleanup', 'txt_cleanup'}:
-            if self.html.find(lookupword) != -1 or searchresult != -1:
+            if searchresult or self.in_document(lookupword):
                 if self.verbose > 2:
                     self.log('    Cleanup:returned dehyphenated word: ' + dehyphenated)
                 return dehyphenated
-            elif self.html.find(hyphenated) != -1:
+            elif self.in_document(hyphenated):
                 if self.verbose > 2:
                     self.log('        Cleanup:returned hyphenated word: ' + hyphenated)
                 return hyphenated
@@ -247,7 +253,7 @@ class Dehyphenator:
                 if self.verbose > 2:
                     self.log('too short, returned hyphenated word: ' + hyphenated)
                 return hyphenated
-            if self.html.find(lookupword) != -1 or searchresult != -1:
+            if searchresult or self.in_document(lookupword):
                 if self.verbose > 2:
                     self.log('     returned dehyphenated word: ' + dehyphenated)
                 return dehyphenated
@@ -256,8 +262,38 @@ class Dehyphenator:
                     self.log('          returned hyphenated word: ' + hyphenated)
                 return hyphenated
 
-    def __call__(self, html, format, length=1):
+    def index_document(self, html):
+        ''' Index the distinct words in html, so that in_document() does not
+        have to search the whole document for every hyphenated word. '''
         self.html = html
+        self.words = frozenset(self.words_pat.findall(html))
+        self.vocabulary = '\0'.join(self.words)
+        self.hyphenated_vocabulary = None
+        self.lookups = {}
+
+    def in_document(self, text):
+        ''' Return True if text occurs anywhere in the document, the same as
+        self.html.find(text) != -1. Text made up of word characters can only
+        occur inside a word of the document, so it is looked up in the
+        words, instead of in the whole document. '''
+        ans = self.lookups.get(text)
+        if ans is None:
+            if not text or text in self.words:
+                ans = True
+            elif self.words_pat.fullmatch(text) is not None:
+                ans = text in self.vocabulary
+            elif self.hyphenated_words_pat.fullmatch(text) is not None:
+                if self.hyphenated_vocabulary is None:
+                    self.hyphenated_vocabulary = '\0'.join(
+                        {w for w in self.hyphenated_words_pat.findall(self.html) if '-' in w})
+                ans = text in self.hyphenated_vocabulary
+            else:
+                ans = text in self.html
+            self.lookups[text] = ans
+        return ans
+
+    def __call__(self, html, format, length=1):
+        self.index_document(html)
         self.format = format
         if format == 'html':
             intextmatch = re.compile((
@@ -283,6 +319,7 @@ class Dehyphenator:
                 r'(?P<firstpart>[^\W\-]+)(-|‐)(?P<wraptags>\s+)(?P<secondpart>[\w\d]+)')
 
         html = intextmatch.sub(self.dehyphenate, html)
+        del self.words, self.vocabulary, self.hyphenated_vocabulary, self.lookups
         return html
 
 
@@ -358,6 +395,115 @@ def accent_regex(accent_maps, letter_before=False):
     return pat, sub
 
 
+_regex_special = re.compile(r'[\\.^$*+?{}\[\]|()]').search
+
+
+def is_literal_rule(pattern, replacement):
+    ''' True if pattern matches nothing but its own text and replacement is
+    inserted as is '''
+    text = getattr(pattern, 'pattern', None)
+    return (isinstance(text, str) and bool(text) and isinstance(replacement, str) and '\\' not in replacement and
+            not pattern.flags & (re.IGNORECASE | re.VERBOSE) and _regex_special(text) is None)
+
+
+class RuleSet:
+
+    '''
+    A list of (pattern, replacement) rules that are applied to HTML one after
+    the other, compiled once and reused for every file of a book.
+
+    Rules that search for literal text are run with str.replace(), which is
+    much faster than a regular expression. Runs of consecutive literal rules
+    that start with the same text are fused: a single search for any of them
+    decides whether the file has to be changed at all, which is usually not
+    the case for rules that clean up headers and footers. If it does, the
+    rules of the run are applied in order, so the result is always the same
+    as applying the rules one by one.
+    '''
+
+    # The fewest rules for which a single search is faster than searching for
+    # every rule, the regular expression engine only searches quickly for
+    # alternatives with a common prefix
+    MIN_FUSED_RULES = 4
+
+    def __init__(self, rules, user_patterns=None):
+        # user_patterns maps user supplied rules to the search text they were
+        # compiled from, errors in those rules are logged and ignored
+        user_patterns = user_patterns or {}
+        self.passes = []
+        run = []
+
+        def end_run():
+            if run:
+                literals = tuple((rule[0].pattern, rule[1]) for rule in run)
+                texts = tuple(dict.fromkeys(text for text, replacement in literals))
+                prefilter = None
+                if len(texts) >= self.MIN_FUSED_RULES and len({text[0] for text in texts}) == 1:
+                    prefilter = re.compile('|'.join(map(re.escape, texts)))
+                self.passes.append((prefilter, None, tuple(user_patterns.get(rule, rule[0].pattern) for rule in run),
+                    None, literals))
+                del run[:]
+
+        for rule in rules:
+            if is_literal_rule(rule[0], rule[1]):
+                run.append(rule)
+                continue
+            end_run()
+            pattern, replacement = rule[0], rule[1]
+            user_pattern = user_patterns.get(rule)
+            name = user_pattern or getattr(pattern, 'pattern', None) or repr(pattern)
+            self.passes.append((pattern, replacement, (name,), user_pattern, None))
+        end_run()
+
+    def __call__(self, html, log=None, stats=None):
+        ''' Apply all rules to html. If stats is not None, the time taken and
+        number of matches of every rule are added to it, see
+        :meth:`HTMLPreProcessor.add_rule_stats`. '''
+        for pattern, replacement, names, user_pattern, literals in self.passes:
+            if stats is not None:
+                st = time.perf_counter()
+            if literals is not None:
+                matches = [0] * len(literals)
+                if pattern is None or pattern.search(html) is not None:
+                    for i, (text, replacement) in enumerate(literals):
+                        if stats is not None:
+                            matches[i] = html.count(text)
+                        html = html.replace(text, replacement)
+            else:
+                try:
+                    html, matches = pattern.subn(replacement, html)
+                except Exception as e:
+                    if user_pattern is None:
+                        raise
+                    log.error(
+                        f'User supplied search & replace rule: {user_pattern} -> {replacement} '
+                        f'failed with error: {e}, ignoring.')
+                    continue
+                matches = (matches,)
+            if stats is not None:
+                elapsed = time.perf_counter() - st
+                for name, count in zip(names, matches):
+                    entry = stats.setdefault(name, [0, 0, 0, len(names)])
+                    entry[0] += elapsed
+                    entry[1] += count
+                    entry[2] += 1
+        return html
+
+
+def format_rule_stats(stats):
+    ''' Return a report of the rule statistics recorded by
+    :class:`HTMLPreProcessor`, slowest rules first '''
+    lines = ['  Seconds  Matches  Files  Rule']
+    for name, (elapsed, matches, files, fused) in sorted(stats.items(), key=lambda x: -x[1][0]):
+        if len(name) > 100:
+            name = name[:97] + '...'
+        name = name.replace('\n', '\\n')
+        if fused > 1:
+            name += f' (fused into one pass with {fused - 1} other rules, the time is that of the pass)'
+        lines.append(f'{elapsed:9.3f} {matches:8d} {files:6d}  {name}')
+    return '\n'.join(lines)
+
+
 def html_preprocess_rules():
     ans = getattr(html_preprocess_rules, 'ans', None)
     if ans is None:
@@ -447,6 +593,12 @@ class HTMLPreProcessor:
         self.extra_opts = extra_opts
         self.regex_wizard_callback = regex_wizard_callback
         self.current_href = None
+        # The compiled rules, shared by all files of the book
+        self.user_rules = None
+        self.rule_sets = {}
+        # The time taken and number of matches of every rule, only recorded
+        # when debugging the conversion pipeline
+        self.rule_stats = {} if getattr(extra_opts, 'debug_pipeline', None) else None
 
     def is_baen(self, src):
         return re.compile(r'<meta\s+name="Publisher"\s+content=".*?Baen.*?"',
@@ -458,39 +610,23 @@ class HTMLPreProcessor:
     def is_pdftohtml(self, src):
         return "<!-- created by calibre's pdftohtml -->" in src[:1000]
 
-    def __call__(self, html, remove_special_chars=None,
-            get_preprocess_html=False):
-        if remove_special_chars is not None:
-            html = remove_special_chars.sub('', html)
-        html = html.replace('\0', '')
-        is_pdftohtml = self.is_pdftohtml(html)
-        if self.is_baen(html):
-            rules = []
-        elif self.is_book_designer(html):
-            rules = book_designer_rules()
-        elif is_pdftohtml:
-            rules = pdftohtml_rules()
-        else:
-            rules = []
-
-        start_rules = []
-
-        if not getattr(self.extra_opts, 'keep_ligatures', False):
-            html = _ligpat.sub(lambda m: LIGATURES[m.group()], html)
-
-        user_sr_rules = {}
-        # Function for processing search and replace
+    def get_user_rules(self):
+        ''' The search and replace rules from the sr?_search/sr?_replace and
+        search_replace options, and the search text of each rule '''
+        if self.user_rules is not None:
+            return self.user_rules
+        from calibre.ebooks.conversion.search_replace import compile_regular_expression
+        rules, user_patterns = [], {}
 
         def do_search_replace(search_pattern, replace_txt):
-            from calibre.ebooks.conversion.search_replace import compile_regular_expression
             try:
                 search_re = compile_regular_expression(search_pattern)
                 if not replace_txt:
                     replace_txt = ''
                 rules.insert(0, (search_re, replace_txt))
-                user_sr_rules[(search_re, replace_txt)] = search_pattern
+                user_patterns[(search_re, replace_txt)] = search_pattern
             except Exception as e:
-                self.log.error(f'Failed to parse {search!r} regexp because {as_unicode(e)}')
+                self.log.error(f'Failed to parse {search_pattern!r} regexp because {as_unicode(e)}')
 
         # search / replace using the sr?_search / sr?_replace options
         for i in range(1, 4):
@@ -506,36 +642,86 @@ class HTMLPreProcessor:
             search_replace = json.loads(search_replace)
             for search_pattern, replace_txt in reversed(search_replace):
                 do_search_replace(search_pattern, replace_txt)
+        self.user_rules = rules, user_patterns
+        return self.user_rules
 
-        end_rules = []
-        # delete soft hyphens - moved here so it's executed after header/footer removal
-        if is_pdftohtml:
-            # unwrap/delete soft hyphens
-            end_rules.append((re.compile(
-                r'[­](</p>\s*<p>\s*)+\s*(?=[\[a-z\d])'), lambda match: ''))
-            # unwrap/delete soft hyphens with formatting
-            end_rules.append((re.compile(
-                r'[­]\s*(</(i|u|b)>)+(</p>\s*<p>\s*)+\s*(<(i|u|b)>)+\s*(?=[\[a-z\d])'), lambda match: ''))
-
-        length = -1
-        if getattr(self.extra_opts, 'unwrap_factor', 0.0) > 0.01:
-            docanalysis = DocAnalysis('pdf', html)
-            length = docanalysis.line_length(getattr(self.extra_opts, 'unwrap_factor'))
-            if length:
+    def rule_set(self, rules, is_pdftohtml=False, length=-1):
+        '''
+        Return the :class:`RuleSet` for a file. 'start' is for the rules that
+        are run on all files before the regex wizard sees them. Otherwise
+        rules is the kind of file: 'baen', 'book_designer', 'pdftohtml' or
+        None, followed by the user supplied rules and the rules to unwrap
+        lines of the given length.
+        '''
+        key = rules, is_pdftohtml, length
+        ans = self.rule_sets.get(key)
+        if ans is not None:
+            return ans
+        if rules == 'start':
+            ans = RuleSet(html_preprocess_rules())
+        else:
+            user_rules, user_patterns = self.get_user_rules()
+            rules = user_rules + {'book_designer': book_designer_rules, 'pdftohtml': pdftohtml_rules}.get(
+                rules, list)()
+            # delete soft hyphens - moved here so it's executed after header/footer removal
+            if is_pdftohtml:
+                # unwrap/delete soft hyphens
+                rules.append((re.compile(
+                    r'[­](</p>\s*<p>\s*)+\s*(?=[\[a-z\d])'), lambda match: ''))
+                # unwrap/delete soft hyphens with formatting
+                rules.append((re.compile(
+                    r'[­]\s*(</(i|u|b)>)+(</p>\s*<p>\s*)+\s*(<(i|u|b)>)+\s*(?=[\[a-z\d])'), lambda match: ''))
+            if length > 0:
                 # print('The pdf line length returned is ' + str(length))
                 # unwrap em/en dashes
-                end_rules.append((re.compile(
+                rules.append((re.compile(
                     r'(?<=.{%i}[–—])\s*<p>\s*(?=[\[a-z\d])' % length), lambda match: ''))  # noqa: UP031
-                end_rules.append(
+                rules.append(
                     # Un wrap using punctuation
                     (re.compile((
                         r'(?<=.{%i}([a-zäëïöüàèìòùáćéíĺóŕńśúýâêîôûçąężıãõñæøþðßěľščťžňďřů,:)\\IAß]'  # noqa: UP031
                         r'|(?<!\&\w{4});))\s*(?P<ital></(i|b|u)>)?\s*(</p>\s*<p>\s*)+\s*(?=(<(i|b|u)>)?'
                         r'\s*[\w\d$(])') % length, re.UNICODE), wrap_lines),
                 )
+            ans = RuleSet(rules, user_patterns)
+        self.rule_sets[key] = ans
+        return ans
+
+    def add_rule_stats(self, stats):
+        ''' Add rule statistics recorded in another process. Every entry
+        maps the name of a rule to [seconds, matches, number of files, number
+        of rules fused into the same pass]. '''
+        if self.rule_stats is not None:
+            for name, (elapsed, matches, files, fused) in stats.items():
+                entry = self.rule_stats.setdefault(name, [0, 0, 0, fused])
+                entry[0] += elapsed
+                entry[1] += matches
+                entry[2] += files
 
-        for rule in html_preprocess_rules() + start_rules:
-            html = rule[0].sub(rule[1], html)
+    def __call__(self, html, remove_special_chars=None,
+            get_preprocess_html=False):
+        if remove_special_chars is not None:
+            html = remove_special_chars.sub('', html)
+        html = html.replace('\0', '')
+        is_pdftohtml = self.is_pdftohtml(html)
+        if self.is_baen(html):
+            rules = 'baen'
+        elif self.is_book_designer(html):
+            rules = 'book_designer'
+        elif is_pdftohtml:
+            rules = 'pdftohtml'
+        else:
+            rules = None
+
+        if not getattr(self.extra_opts, 'keep_ligatures', False):
+            html = _ligpat.sub(lambda m: LIGATURES[m.group()], html)
+
+        length = -1
+        if getattr(self.extra_opts, 'unwrap_factor', 0.0) > 0.01:
+            docanalysis = DocAnalysis('pdf', html)
+            length = docanalysis.line_length(getattr(self.extra_opts, 'unwrap_factor'))
+
+        html = self.rule_set('start')(html, self.log, self.rule_stats)
 
         if self.regex_wizard_callback is not None:
             self.regex_wizard_callback(self.current_href, html)
@@ -561,16 +747,7 @@ class HTMLPreProcessor:
 
         # dump(html, 'pre-preprocess')
 
-        for rule in rules + end_rules:
-            try:
-                html = rule[0].sub(rule[1], html)
-            except Exception as e:
-                if rule in user_sr_rules:
-                    self.log.error(
-                        f'User supplied search & replace rule: {user_sr_rules[rule]} -> {rule[1]} '
-                        f'failed with error: {e}, ignoring.')
-                else:
-                    raise
+        html = self.rule_set(rules, is_pdftohtml, length)(html, self.log, self.rule_stats)
 
         if is_pdftohtml and length > -1:
             # Dehyphenate
@@ -402,7 +402,10 @@ class Rule:
         return self.xpath_selector(root)
 
     def css(self, root):
-        return tuple(Select(root)(self.css_selector))
+        # Testing every tag is cheaper than building the maps Select uses to
+        # find all matches, for a single selector
+        matches = Select(root).matcher(self.css_selector)
+        return tuple(filter(matches, root.iter('*')))
 
     def __call__(self, root):
         changed = False
@@ -506,9 +506,9 @@ def get_metadata(stream):
         if size < 4*1024*1024:
             with TemporaryDirectory('_mobi_meta_reader') as tdir:
                 with CurrentDir(tdir):
-                    mr = MobiReader(stream, log)
-                    parse_cache = {}
-                    mr.extract_content(tdir, parse_cache)
+                    with MobiReader(stream, log) as mr:
+                        parse_cache = {}
+                        mr.extract_content(tdir, parse_cache)
                     if mr.embedded_mi is not None:
                         mi = mr.embedded_mi
     if hasattr(mh.exth, 'cover_offset'):
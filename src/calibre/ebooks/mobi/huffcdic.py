@@ -14,8 +14,20 @@ import struct
 
 from calibre.ebooks.mobi import MobiError
 
+# Codes of up to this many bits are decoded with a single table lookup, longer
+# codes fall back to searching the mincode table
+LOOKUP_BITS = 12
+
 
 class Reader:
+    '''
+    Table driven Huff/cdic decoder. The HUFF tables are turned into a lookup
+    table indexed by the next LOOKUP_BITS bits of the input, that gives the
+    length of the code and the dictionary entry it refers to. Before the first
+    record is decoded, the dictionary entries that are themselves compressed
+    are expanded and a second table is built that maps the next LOOKUP_BITS
+    bits to all the codes that fit in them and the text they decode to.
+    '''
 
     def __init__(self):
         self.q = struct.Struct(b'>Q').unpack_from
@@ -41,6 +53,177 @@ class Reader:
         for codelen, maxcode in enumerate((0,) + dict2[1::2]):
             self.maxcode += (((maxcode + 1) << (32 - codelen)) - 1, )
 
+        # (code length, dictionary index) for every value of the leading
+        # LOOKUP_BITS bits, None when the code is longer than that
+        shift = 32 - LOOKUP_BITS
+        self.lookup = tuple(self.decode_code(prefix << shift, LOOKUP_BITS) for prefix in range(1 << LOOKUP_BITS))
+
+        # The raw dictionary entries and their expansions, None for entries
+        # that have not been expanded yet
+        self.dictionary = []
+        self.phrases = []
+        self.table = None
+
+    def decode_code(self, code, max_codelen=32):
+        '''
+        Return the length and dictionary index of the code at the start of the
+        32 bit integer code, or None if it is longer than max_codelen.
+        '''
+        codelen, term, maxcode = self.dict1[code >> 24]
+        if not term:
+            try:
+                while code < self.mincode[codelen]:
+                    codelen += 1
+            except IndexError:
+                return None
+            maxcode = self.maxcode[codelen]
+        if codelen > max_codelen:
+            return None
+        return codelen, (maxcode - code) >> (32 - codelen)
+
+    def load_cdic(self, cdic):
+        if cdic[0:8] != b'CDIC\x00\x00\x00\x10':
+            raise MobiError('Invalid CDIC header')
+        phrases, bits = struct.unpack_from(b'>LL', cdic, 8)
+        n = min(1<<bits, phrases-len(self.dictionary))
+        h = struct.Struct(b'>H').unpack_from
+
+        def getslice(off):
+            blen, = h(cdic, 16+off)
+            slice = bytes(cdic[18+off:18+off+(blen&0x7fff)])
+            return (slice, blen&0x8000)
+        entries = tuple(map(getslice, struct.unpack_from(b'>%dH' % n, cdic, 16)))
+        self.dictionary += entries
+        self.phrases += (slice if flag else None for slice, flag in entries)
+        self.table = None
+
+    def decode(self, data):
+        ' Return the list of dictionary indices encoded in data, one code at a time '
+        q, lookup, decode_code = self.q, self.lookup, self.decode_code
+        shift = 32 - LOOKUP_BITS
+
+        bitsleft = len(data) * 8
+        data = bytes(data) + b'\x00\x00\x00\x00\x00\x00\x00\x00'
+        pos = 0
+        x, = q(data, pos)
+        n = 32
+
+        ans = []
+        append = ans.append
+        while True:
+            if n <= 0:
+                pos += 4
+                x, = q(data, pos)
+                n += 32
+            code = (x >> n) & 0xffffffff
+            entry = lookup[code >> shift] or decode_code(code)
+            if entry is None:
+                raise MobiError('Invalid Huffman code')
+            codelen, r = entry
+            n -= codelen
+            bitsleft -= codelen
+            if bitsleft < 0:
+                break
+            append(r)
+        return ans
+
+    def expand(self, r):
+        '''
+        Expand the compressed dictionary entry r and the compressed entries it
+        refers to, without recursion.
+        '''
+        phrases, dictionary = self.phrases, self.dictionary
+        stack = [(r, self.decode(dictionary[r][0]))]
+        expanding = {r}
+        while stack:
+            idx, parts = stack[-1]
+            missing = next((p for p in parts if phrases[p] is None), None)
+            if missing is None:
+                phrases[idx] = b''.join([phrases[p] for p in parts])
+                expanding.discard(idx)
+                del stack[-1]
+            elif missing in expanding:
+                raise MobiError('Huff/cdic dictionary entry refers to itself')
+            else:
+                expanding.add(missing)
+                stack.append((missing, self.decode(dictionary[missing][0])))
+        return phrases[r]
+
+    def build_tables(self):
+        phrases, lookup = self.phrases, self.lookup
+        for r, phrase in enumerate(phrases):
+            if phrase is None:
+                try:
+                    self.expand(r)
+                except (MobiError, IndexError):
+                    # Broken entries are only an error if they are used
+                    pass
+        # (number of bits, text) for the codes that fit in every value of the
+        # leading LOOKUP_BITS bits, None when the first code does not fit
+        table = []
+        mask = (1 << LOOKUP_BITS) - 1
+        for prefix in range(1 << LOOKUP_BITS):
+            bits, parts = 0, []
+            while bits < LOOKUP_BITS:
+                entry = lookup[(prefix << bits) & mask]
+                if entry is None or entry[0] > LOOKUP_BITS - bits or phrases[entry[1]] is None:
+                    break
+                bits += entry[0]
+                parts.append(phrases[entry[1]])
+            table.append((bits, b''.join(parts)) if parts else None)
+        self.table = tuple(table)
+
+    def unpack(self, data):
+        if self.table is None:
+            self.build_tables()
+        q, table, lookup, phrases, decode_code = self.q, self.table, self.lookup, self.phrases, self.decode_code
+        shift = 32 - LOOKUP_BITS
+        mask = (1 << LOOKUP_BITS) - 1
+
+        bitsleft = len(data) * 8
+        data = bytes(data) + b'\x00\x00\x00\x00\x00\x00\x00\x00'
+        pos = 0
+        x, = q(data, pos)
+        n = 32
+
+        ans = []
+        append = ans.append
+        while True:
+            if n <= 0:
+                pos += 4
+                x, = q(data, pos)
+                n += 32
+            entry = table[(x >> (n + shift)) & mask]
+            if entry is not None and entry[0] <= bitsleft:
+                bits, phrase = entry
+            else:
+                # A long code, a broken dictionary entry or the last codes of
+                # the record, decode a single code
+                code = (x >> n) & 0xffffffff
+                entry = lookup[code >> shift] or decode_code(code)
+                if entry is None:
+                    raise MobiError('Invalid Huffman code')
+                bits, r = entry
+                if bits > bitsleft:
+                    break
+                phrase = phrases[r]
+                if phrase is None:
+                    phrase = self.expand(r)
+            n -= bits
+            bitsleft -= bits
+            append(phrase)
+        return b''.join(ans)
+
+
+class ReferenceReader(Reader):
+    '''
+    The original decoder, which reads every code bit by bit and expands
+    dictionary entries recursively. It is only kept as a reference for tests
+    and benchmarks.
+    '''
+
+    def load_huff(self, huff):
+        Reader.load_huff(self, huff)
         self.dictionary = []
 
     def load_cdic(self, cdic):
@@ -60,7 +243,7 @@ class Reader:
         q = self.q
 
         bitsleft = len(data) * 8
-        data += b'\x00\x00\x00\x00\x00\x00\x00\x00'
+        data = bytes(data) + b'\x00\x00\x00\x00\x00\x00\x00\x00'
         pos = 0
         x, = q(data, pos)
         n = 32
@@ -96,8 +279,8 @@ class Reader:
 
 class HuffReader:
 
-    def __init__(self, huffs):
-        self.reader = Reader()
+    def __init__(self, huffs, reader_class=Reader):
+        self.reader = reader_class()
         self.reader.load_huff(huffs[0])
         for cdic in huffs[1:]:
             self.reader.load_cdic(cdic)
@@ -32,7 +32,7 @@ def uniq(vals):
 class EXTHHeader:  # {{{
 
     def __init__(self, raw, codec, title):
-        self.doctype = raw[:4]
+        self.doctype = bytes(raw[:4])
         self.length, self.num_items = struct.unpack('>LL', raw[4:12])
         raw = raw[12:]
         pos = 0
@@ -50,7 +50,7 @@ class EXTHHeader:  # {{{
         while left > 0:
             left -= 1
             idx, size = struct.unpack('>LL', raw[pos:pos + 8])
-            content = raw[pos + 8:pos + size]
+            content = bytes(raw[pos + 8:pos + size])
             pos += size
             if idx >= 100 and idx < 200:
                 self.process_metadata(idx, content, codec)
@@ -192,7 +192,8 @@ class BookHeader:
 
     def __init__(self, raw, ident, user_encoding, log, try_extra_data_fix=False):
         self.log = log
-        self.compression_type = raw[:2]
+        # raw may be a memoryview of the record, copy the fields that are kept
+        self.compression_type = bytes(raw[:2])
         self.records, self.records_size = struct.unpack('>HH', raw[8:12])
         self.encryption_type, = struct.unpack('>H', raw[12:14])
         if ident == b'TEXTREAD':
@@ -209,7 +210,7 @@ class BookHeader:
             self.mobi_version = 1
         else:
             self.ancient = False
-            self.doctype = raw[16:20]
+            self.doctype = bytes(raw[16:20])
             self.length, self.type, self.codepage, self.unique_id, \
                 self.version = struct.unpack('>LLLLL', raw[20:40])
 
@@ -238,7 +239,7 @@ class BookHeader:
 
             toff, tlen = struct.unpack('>II', raw[0x54:0x5c])
             tend = toff + tlen
-            self.title = raw[toff:tend] if tend < len(raw) else _('Unknown')
+            self.title = bytes(raw[toff:tend]) if tend < len(raw) else _('Unknown')
             langcode  = struct.unpack('!L', raw[0x5C:0x60])[0]
             langid    = langcode & 0xFF
             sublangid = (langcode >> 10) & 0xFF
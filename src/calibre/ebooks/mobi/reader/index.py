@@ -260,14 +260,16 @@ def get_tag_section_start(data, indx_header):
 def read_index(sections, idx, codec):
     table, cncx = OrderedDict(), CNCX([], codec)
 
-    data = sections[idx][0]
+    # The records may be memoryviews of the book, index records are small so
+    # they are parsed as bytes
+    data = bytes(sections[idx][0])
 
     indx_header = parse_indx_header(data)
     indx_count = indx_header['count']
 
     if indx_header['ncncx'] > 0:
         off = idx + indx_count + 1
-        cncx_records = [x[0] for x in sections[off:off+indx_header['ncncx']]]
+        cncx_records = [bytes(x[0]) for x in sections[off:off+indx_header['ncncx']]]
         cncx = CNCX(cncx_records, codec)
 
     tag_section_start = get_tag_section_start(data, indx_header)
@@ -275,7 +277,7 @@ def read_index(sections, idx, codec):
 
     for i in range(idx + 1, idx + 1 + indx_count):
         # Index record
-        data = sections[i][0]
+        data = bytes(sections[i][0])
         parse_index_record(table, data, control_byte_count, tags, codec,
                 indx_header['ordt_map'])
     return table, cncx
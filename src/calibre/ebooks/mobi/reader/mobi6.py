@@ -6,6 +6,7 @@ __copyright__ = '2012, Kovid Goyal <kovid@kovidgoyal.net>'
 __docformat__ = 'restructuredtext en'
 
 import io
+import mmap
 import os
 import re
 import shutil
@@ -17,7 +18,7 @@ from lxml import etree, html
 from calibre import guess_type, replace_entities, xml_replace_entities
 from calibre.ebooks import DRMError, unit_convert
 from calibre.ebooks.chardet import strip_encoding_declarations
-from calibre.ebooks.compression.palmdoc import decompress_doc
+from calibre.ebooks.compression.palmdoc import decompress_doc_records
 from calibre.ebooks.metadata import MetaInformation
 from calibre.ebooks.metadata.opf2 import OPF, OPFCreator
 from calibre.ebooks.metadata.toc import TOC
@@ -44,7 +45,34 @@ class KFXError(ValueError):
         ).format('https://www.mobileread.com/forums/showthread.php?t=283371'))
 
 
+def map_stream(stream):
+    '''
+    Return the contents of stream as an object supporting the buffer protocol.
+    Files on disk are memory mapped rather than read, so that slicing a
+    memoryview of them does not copy any data. A mapping has to be closed
+    once no memoryviews of it remain, see :meth:`MobiReader.close`.
+    '''
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+    else:
+        try:
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            pass
+    return stream.read()
+
+
 class MobiReader:
+    '''
+    Read a MOBI file. Files on disk are memory mapped and :attr:`sections`
+    are memoryviews of the mapping, which are valid until :meth:`close` is
+    called. Close the reader, or use it as a context manager, once the
+    content has been extracted, as the mapping otherwise stays open until
+    the reader is garbage collected, and reading a mapped file that is
+    truncated meanwhile crashes the process.
+    '''
     PAGE_BREAK_PAT = re.compile(
         r'<\s*/{0,1}\s*mbp:pagebreak((?:\s+[^/>]*){0,1})/{0,1}\s*>\s*(?:<\s*/{0,1}\s*mbp:pagebreak\s*/{0,1}\s*>)*',
         re.IGNORECASE)
@@ -80,16 +108,20 @@ class MobiReader:
         if hasattr(filename_or_stream, 'read'):
             stream = filename_or_stream
             stream.seek(0)
+            self._stream = None
         else:
-            stream = open(filename_or_stream, 'rb')
+            stream = self._stream = open(filename_or_stream, 'rb')
 
-        raw = stream.read()
-        if raw.startswith(b'TPZ'):
+        # The sections are memoryview slices of the mapped file, consumers
+        # copy only the parts they need as bytes
+        self._mapping = map_stream(stream)
+        raw = memoryview(self._mapping)
+        if raw[:3] == b'TPZ':
             raise TopazError(_('This is an Amazon Topaz book. It cannot be processed.'))
-        if raw.startswith(b'\xeaDRMION\xee'):
+        if raw[:8] == b'\xeaDRMION\xee':
             raise KFXError()
 
-        self.header   = raw[0:72]
+        self.header   = bytes(raw[0:72])
         self.name     = self.header[:32].replace(b'\x00', b'')
         self.num_sections, = struct.unpack('>H', raw[76:78])
 
@@ -152,6 +184,32 @@ class MobiReader:
                 except Exception:
                     self.book_header = bh
 
+    def close(self):
+        '''
+        Release the sections and close the mapped file. The sections cannot
+        be used afterwards, but everything extracted from them can.
+        '''
+        for section, header in self.sections:
+            section.release()
+        self.sections = []
+        mapping, self._mapping = self._mapping, None
+        if isinstance(mapping, mmap.mmap):
+            try:
+                mapping.close()
+            except BufferError:
+                # Views of the sections are still in use elsewhere, the
+                # mapping is closed when they are garbage collected
+                pass
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def check_for_drm(self):
         if self.book_header.encryption_type != 0:
             try:
@@ -763,7 +821,9 @@ class MobiReader:
         def sizeof_trailing_entry(ptr, psize):
             bitpos, result = 0, 0
             while True:
-                v = ord(ptr[psize-1:psize])
+                if psize < 1:
+                    raise IndexError('Trailing entry outside the record')
+                v = ptr[psize-1]
                 result |= (v & 0x7F) << bitpos
                 bitpos += 7
                 psize -= 1
@@ -784,8 +844,10 @@ class MobiReader:
         if self.book_header.extra_flags & 1:
             off = size - num - 1
             try:
-                num += (ord(data[off:off+1]) & 0x3) + 1
-            except TypeError:
+                if off < 0:
+                    raise IndexError('Multibyte entry outside the record')
+                num += (data[off] & 0x3) + 1
+            except IndexError:
                 self.log.warn('Invalid sizeof trailing entries')
                 num += 1
         return num
@@ -816,17 +878,18 @@ class MobiReader:
             processed_records += list(range(self.book_header.huff_offset,
                 self.book_header.huff_offset + self.book_header.huff_number))
             huff = HuffReader(huffs)
-            unpack = huff.unpack
+
+            def unpack(sections):
+                return b''.join(map(huff.unpack, sections))
 
         elif self.book_header.compression_type == b'\x00\x02':
-            unpack = decompress_doc
+            unpack = decompress_doc_records
 
         elif self.book_header.compression_type == b'\x00\x01':
-            def unpack(x):
-                return x
+            unpack = b''.join
         else:
             raise MobiError(f'Unknown compression algorithm: {self.book_header.compression_type!r}')
-        self.mobi_html = b''.join(map(unpack, text_sections))
+        self.mobi_html = unpack(text_sections)
         if self.mobi_html.endswith(b'#'):
             self.mobi_html = self.mobi_html[:-1]
 
@@ -911,7 +974,7 @@ class MobiReader:
                 imgfmt = 'jpg'
             if imgfmt == 'gif':
                 try:
-                    data = gif_data_to_png_data(data)
+                    data = gif_data_to_png_data(bytes(data))
                     imgfmt = 'png'
                 except AnimatedGIF:
                     pass
@@ -925,7 +988,7 @@ class MobiReader:
                     f.write(data)
             else:
                 try:
-                    save_cover_data_to(data, path, minify_to=(10000, 10000))
+                    save_cover_data_to(bytes(data), path, minify_to=(10000, 10000))
                 except Exception:
                     continue
             self.image_names.append(os.path.basename(path))
@@ -8,6 +8,7 @@ __docformat__ = 'restructuredtext en'
 import os
 import re
 import struct
+from bisect import bisect_left, bisect_right
 from collections import namedtuple
 from itertools import repeat
 from urllib.parse import urldefrag
@@ -190,46 +191,28 @@ class Mobi8Reader:
         self.parts = []
         self.partinfo = []
         divptr = 0
-        baseptr = 0
         for skelnum, skelname, divcnt, skelpos, skellen in self.files:
-            baseptr = skelpos + skellen
-            skeleton = text[skelpos:baseptr]
-            inspos_warned = False
-            for i in range(divcnt):
-                insertpos, idtext, filenum, seqnum, startpos, length = \
-                                    self.elems[divptr]
-                if i == 0:
-                    aidtext = idtext[12:-2]
-                    filename = f'part{filenum:04}.html'
-                part = text[baseptr:baseptr + length]
-                insertpos = insertpos - skelpos
-                head = skeleton[:insertpos]
-                tail = skeleton[insertpos:]
-                if (tail.find(b'>') < tail.find(b'<') or head.rfind(b'>') <
-                    head.rfind(b'<')):
-                    # There is an incomplete tag in either the head or tail.
-                    # This can happen for some badly formed KF8 files, see for
-                    # example, https://bugs.launchpad.net/bugs/1082669
-                    if not inspos_warned:
-                        self.log.warn(
-                            f'The div table for {skelname} has incorrect insert '
-                            'positions. Calculating manually.')
-                        inspos_warned = True
-                    bp, ep = locate_beg_end_of_tag(skeleton, aidtext if
-                        isinstance(aidtext, bytes) else aidtext.encode('utf-8'))
-                    if bp != ep:
-                        insertpos = ep + 1 + startpos
-
-                skeleton = skeleton[0:insertpos] + part + skeleton[insertpos:]
-                baseptr = baseptr + length
-                divptr += 1
-            self.parts.append(skeleton)
-            if divcnt < 1:
+            elems = [self.elems[divptr + i] for i in range(divcnt)]
+            divptr += divcnt
+            if elems:
+                aidtext = elems[0].toc_text[12:-2]
+                filename = f'part{elems[0].file_number:04}.html'
+            else:
                 # Empty file
                 aidtext = str(uuid4())
                 filename = aidtext + '.html'
+            baseptr = skelpos + skellen
+            self.parts.append(self.assemble_skeleton(skelname, text[skelpos:baseptr], text, baseptr, skelpos, elems, aidtext))
+            baseptr += sum(elem.length for elem in elems)
             self.partinfo.append(Part(skelnum, 'text', filename, skelpos,
                 baseptr, aidtext))
+        # The parts are normally in order and do not overlap, so the part
+        # containing a position can be found by bisection
+        self.part_starts = [part.start for part in self.partinfo]
+        if any(part.start > part.end for part in self.partinfo) or any(
+                a.end > b.start for a, b in zip(self.partinfo, self.partinfo[1:])):
+            self.part_starts = None
+        self.anchor_tables = {}
 
         # The primary css style sheet is typically stored next followed by any
         # snippets of code that were previously inlined in the
@@ -291,12 +274,86 @@ class Mobi8Reader:
             self.flows[j] = flowpart
             self.flowinfo.append(FlowInfo(typ, format, dir, fname))
 
+    def assemble_skeleton(self, skelname, skeleton, text, baseptr, skelpos, elems, aidtext):
+        ''' Insert the parts of a file, which start at baseptr in text, into
+        its skeleton. The insert positions in the div table are positions in
+        the skeleton with all preceding parts inserted, so when they are in
+        order, as they are in well formed files, the file is assembled in a
+        single pass. Otherwise fall back to :meth:`assemble_skeleton_slowly`. '''
+        pieces = []
+        # The length of the assembled file up to the end of the last inserted
+        # part and the position in the skeleton of the text after that part
+        done, skelptr, partptr = 0, 0, baseptr
+        # The positions of the last > and < in the assembled file so far
+        last_gt = last_lt = -1
+        for insertpos, idtext, filenum, seqnum, startpos, length in elems:
+            insertpos -= skelpos
+            if insertpos < done or insertpos - done > len(skeleton) - skelptr:
+                return self.assemble_skeleton_slowly(skelname, skeleton, text, baseptr, skelpos, elems, aidtext)
+            q = skelptr + insertpos - done
+            # Check for an incomplete tag in the head or tail, as in
+            # assemble_skeleton_slowly(), without building them
+            gt, lt = skeleton.find(b'>', q), skeleton.find(b'<', q)
+            tail_gt, tail_lt = (gt - q if gt > -1 else -1), (lt - q if lt > -1 else -1)
+            gt, lt = skeleton.rfind(b'>', skelptr, q), skeleton.rfind(b'<', skelptr, q)
+            if gt > -1:
+                last_gt = done + gt - skelptr
+            if lt > -1:
+                last_lt = done + lt - skelptr
+            if tail_gt < tail_lt or last_gt < last_lt:
+                return self.assemble_skeleton_slowly(skelname, skeleton, text, baseptr, skelpos, elems, aidtext)
+            part = text[partptr:partptr + length]
+            pieces.append(skeleton[skelptr:q])
+            pieces.append(part)
+            done += q - skelptr
+            gt, lt = part.rfind(b'>'), part.rfind(b'<')
+            if gt > -1:
+                last_gt = done + gt
+            if lt > -1:
+                last_lt = done + lt
+            done += len(part)
+            skelptr = q
+            partptr += length
+        pieces.append(skeleton[skelptr:])
+        return b''.join(pieces)
+
+    def assemble_skeleton_slowly(self, skelname, skeleton, text, baseptr, skelpos, elems, aidtext):
+        inspos_warned = False
+        for insertpos, idtext, filenum, seqnum, startpos, length in elems:
+            part = text[baseptr:baseptr + length]
+            insertpos = insertpos - skelpos
+            head = skeleton[:insertpos]
+            tail = skeleton[insertpos:]
+            if (tail.find(b'>') < tail.find(b'<') or head.rfind(b'>') <
+                head.rfind(b'<')):
+                # There is an incomplete tag in either the head or tail.
+                # This can happen for some badly formed KF8 files, see for
+                # example, https://bugs.launchpad.net/bugs/1082669
+                if not inspos_warned:
+                    self.log.warn(
+                        f'The div table for {skelname} has incorrect insert '
+                        'positions. Calculating manually.')
+                    inspos_warned = True
+                bp, ep = locate_beg_end_of_tag(skeleton, aidtext if
+                    isinstance(aidtext, bytes) else aidtext.encode('utf-8'))
+                if bp != ep:
+                    insertpos = ep + 1 + startpos
+
+            skeleton = skeleton[0:insertpos] + part + skeleton[insertpos:]
+            baseptr = baseptr + length
+        return skeleton
+
     def get_file_info(self, pos):
         ''' Get information about the part (file) that exists at pos in
         the raw markup '''
-        for part in self.partinfo:
-            if pos >= part.start and pos < part.end:
-                return part
+        if self.part_starts is None:
+            for part in self.partinfo:
+                if pos >= part.start and pos < part.end:
+                    return part
+        else:
+            i = bisect_right(self.part_starts, pos) - 1
+            if i > -1 and pos < self.partinfo[i].end:
+                return self.partinfo[i]
         return Part(*repeat(None, len(Part._fields)))
 
     def get_id_tag_by_pos_fid(self, posfid, offset):
@@ -328,21 +385,67 @@ class Mobi8Reader:
         # else not in a tag need to search the preceding tag
         if plt == npos or pgt < plt:
             npos = pgt + 1
-        textblock = textblock[0:npos]
-        for tag in reverse_tag_iter(textblock):
-            m = self.id_re.match(tag) or self.name_re.match(tag)
-            if m is not None:
-                return m.group(1)
+        # The last tag before npos, as reverse_tag_iter() would find it. The
+        # tags before it are the same as for the whole part, so they are
+        # looked up in its anchor table.
+        pgt = textblock.rfind(b'>', 0, npos)
+        plt = textblock.rfind(b'<', 0, pgt) if pgt > -1 else -1
+        if plt == -1:
+            # No tag found, link to start of file
+            return b''
+        anchor = self.match_anchor(textblock, plt, pgt + 1)
+        if anchor is None:
+            positions, anchors = self.anchor_table(fi.num)
+            i = bisect_left(positions, plt) - 1
+            if i < 0:
+                return b''
+            anchor = anchors[i]
+        val, is_aid = anchor
+        if is_aid:
             # For some files, kindlegen apparently creates links to tags
             # without HTML anchors, using the AID instead. See
             # See https://www.mobileread.com/forums/showthread.php?t=259557
-            m = self.aid_re.match(tag)
-            if m is not None:
-                self.linked_aids.add(m.group(1).decode('utf-8'))
-                return m.group(1) + b'-' + self.aid_anchor_suffix
-
-        # No tag found, link to start of file
-        return b''
+            self.linked_aids.add(val.decode('utf-8'))
+            return val + b'-' + self.aid_anchor_suffix
+        return val
+
+    def match_anchor(self, block, start, end):
+        ''' Return (value, is_aid) for the anchor of the tag at block[start:end]
+        or None if it has no id, name or aid attribute '''
+        m = self.id_re.match(block, start, end) or self.name_re.match(block, start, end)
+        if m is not None:
+            return m.group(1), False
+        m = self.aid_re.match(block, start, end)
+        if m is not None:
+            return m.group(1), True
+
+    def anchor_table(self, num):
+        ''' The positions of the tags with anchors in the part num, in the
+        order of the part, with their anchors, for the tags as found by
+        reverse_tag_iter() from the end of the part. '''
+        try:
+            return self.anchor_tables[num]
+        except KeyError:
+            pass
+        block = self.parts[num]
+        positions, anchors = [], []
+        end = len(block)
+        while True:
+            pgt = block.rfind(b'>', 0, end)
+            if pgt == -1:
+                break
+            plt = block.rfind(b'<', 0, pgt)
+            if plt == -1:
+                break
+            anchor = self.match_anchor(block, plt, pgt + 1)
+            if anchor is not None:
+                positions.append(plt)
+                anchors.append(anchor)
+            end = plt
+        positions.reverse()
+        anchors.reverse()
+        self.anchor_tables[num] = ans = positions, anchors
+        return ans
 
     def create_guide(self):
         guide = Guide()
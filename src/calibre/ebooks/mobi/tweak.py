@@ -25,11 +25,10 @@ class BadFormat(ValueError):
 
 
 def do_explode(path, dest):
-    with open(path, 'rb') as stream:
-        mr = MobiReader(stream, default_log, None, None)
+    with open(path, 'rb') as stream, MobiReader(stream, default_log, None, None) as mobi6_reader:
 
         with CurrentDir(dest):
-            mr = Mobi8Reader(mr, default_log)
+            mr = Mobi8Reader(mobi6_reader, default_log)
             opf = os.path.abspath(mr())
             try:
                 os.remove('debug-raw.html')
@@ -15,6 +15,7 @@ from io import BytesIO
 from tinycss.color3 import parse_color_string
 
 from calibre.ebooks import normalize
+from calibre.utils.image_cache import cached_image_transform
 from calibre.utils.img import image_from_data, image_to_data, png_data_to_gif_data, resize_image, save_cover_data_to, scale_image
 from calibre.utils.imghdr import what
 from polyglot.builtins import as_bytes
@@ -159,6 +160,7 @@ def test_decint(num):
             raise ValueError(f'Failed for num {num}, forward={d!r}: {num, sz!r} != {decint(raw, forward=d)!r}')
 
 
+@cached_image_transform('mobi-rescale')
 def rescale_image(data, maxsizeb=IMAGE_MAX_SIZE, dimen=None):
     '''
     Convert image setting all transparent pixels to white and changing format
@@ -416,6 +418,7 @@ def to_base(num, base=32, min_num_digits=None):
     return ''.join(ans)
 
 
+@cached_image_transform('mobify')
 def mobify_image(data):
     'Convert PNG images to GIF as the idiotic Kindle cannot display some PNG'
     fmt = what(None, data)
@@ -586,6 +589,19 @@ def create_text_record(text):
     return data, overlap
 
 
+def create_text_records(text):
+    '''
+    Split the byte string text into Palmdoc records. Returns a list of
+    (data, overlap) pairs, see :func:`create_text_record`.
+    '''
+    text_length = len(text)
+    text = BytesIO(text)
+    records = []
+    while text.tell() < text_length:
+        records.append(create_text_record(text))
+    return records
+
+
 class CNCX:  # {{{
 
     '''
@@ -11,9 +11,9 @@ import time
 from struct import pack
 
 from calibre.ebooks import normalize
-from calibre.ebooks.compression.palmdoc import compress_doc
+from calibre.ebooks.compression.palmdoc import compress_doc_records
 from calibre.ebooks.mobi.langcodes import iana2mobi
-from calibre.ebooks.mobi.utils import RECORD_SIZE, align_block, create_text_record, detect_periodical, encint, encode_trailing_data
+from calibre.ebooks.mobi.utils import RECORD_SIZE, align_block, create_text_records, detect_periodical, encint, encode_trailing_data
 from calibre.ebooks.mobi.writer2 import PALMDOC, UNCOMPRESSED
 from calibre.ebooks.mobi.writer2.indexer import Indexer
 from calibre.ebooks.mobi.writer2.serializer import Serializer
@@ -37,12 +37,15 @@ def fcis(text_length):
 class MobiWriter:
 
     def __init__(self, opts, resources, kf8, write_page_breaks_after_item=True):
+        # kf8 is the KF8Book of a joint file, or a function that returns it
+        # when it is being created in another process
         self.opts = opts
         self.resources = resources
         self.kf8 = kf8
         self.for_joint = kf8 is not None
         self.write_page_breaks_after_item = write_page_breaks_after_item
         self.compression = UNCOMPRESSED if opts.dont_compress else PALMDOC
+        self.compression_workers = getattr(opts, 'compression_workers', 0)
         self.prefer_author_sort = opts.prefer_author_sort
         self.last_text_record_idx = 1
 
@@ -72,6 +75,8 @@ class MobiWriter:
         self.stream = stream
         self.records = [None]
         self.generate_content()
+        if callable(self.kf8):
+            self.kf8 = self.kf8()
         self.generate_joint_record0() if self.for_joint else self.generate_record0()
         self.write_header()
         self.write_content()
@@ -160,24 +165,22 @@ class MobiWriter:
                 write_page_breaks_after_item=self.write_page_breaks_after_item)
         text = self.serializer()
         self.text_length = len(text)
-        text = io.BytesIO(text)
-        nrecords = 0
+        text_records = create_text_records(text)
+        nrecords = len(text_records)
         records_size = 0
 
+        datas = [data for data, overlap in text_records]
         if self.compression != UNCOMPRESSED:
             self.oeb.logger.info('  Compressing markup content...')
-
-        while text.tell() < self.text_length:
-            data, overlap = create_text_record(text)
             if self.compression == PALMDOC:
-                data = compress_doc(data)
+                datas = compress_doc_records(datas, self.compression_workers)
 
+        for data, (_, overlap) in zip(datas, text_records):
             data += overlap
             data += pack(b'>B', len(overlap))
 
             self.records.append(data)
             records_size += len(data)
-            nrecords += 1
 
         self.last_text_record_idx = nrecords
         self.first_non_text_record_idx = nrecords + 1
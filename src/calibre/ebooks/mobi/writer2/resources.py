@@ -14,12 +14,22 @@ from calibre.ebooks.mobi import MAX_THUMB_DIMEN, MAX_THUMB_SIZE
 from calibre.ebooks.mobi.utils import mobify_image, rescale_image, write_font_record
 from calibre.ebooks.oeb.base import OEB_RASTER_IMAGES
 from calibre.ptempfile import PersistentTemporaryFile
-from calibre.utils.imghdr import what
+from calibre.utils.image_cache import cached_image_transform
+from calibre.utils.imghdr import probe, what
 
 PLACEHOLDER_GIF = b'GIF89a\x01\x00\x01\x00\xf0\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00!\xfe calibre-placeholder-gif-for-azw3\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'  # noqa: E501
 
 
 def process_jpegs_for_amazon(data: bytes) -> bytes:
+    fmt, width = probe(data)[:2]
+    if fmt not in (None, 'jpeg') and width > -1:
+        # Only JPEG images are changed, there is no need to open the others
+        return data
+    return _process_jpegs_for_amazon(data)
+
+
+@cached_image_transform('amazon-jpeg')
+def _process_jpegs_for_amazon(data: bytes) -> bytes:
     img = Image.open(BytesIO(data))
     if img.format == 'JPEG':
         # Amazon's MOBI renderer can't render JPEG images without JFIF metadata
@@ -39,6 +49,18 @@ def process_jpegs_for_amazon(data: bytes) -> bytes:
     return data
 
 
+@cached_image_transform('webp-to-png')
+def webp_to_png(data: bytes) -> bytes | None:
+    from calibre.utils.img import image_and_format_from_data, image_to_data
+    fmt = what(None, data)
+    if fmt is not None and fmt != 'webp':
+        # Not a WebP image, despite its media type, no need to decode it
+        return None
+    img, fmt = image_and_format_from_data(data)
+    if fmt == 'webp':
+        return image_to_data(img, fmt='PNG')
+
+
 class Resources:
 
     def __init__(self, oeb, opts, is_periodical, add_fonts=False,
@@ -151,11 +173,10 @@ class Resources:
                     self.has_fonts = True
 
     def convert_webp(self, item):
-        from calibre.utils.img import image_and_format_from_data, image_to_data
-        img, fmt = image_and_format_from_data(item.data)
-        if fmt == 'webp' and not img.isNull():
+        data = webp_to_png(item.data)
+        if data is not None:
             self.log.info(f'Converting WebP image {item.href} to PNG')
-            item.data = image_to_data(img, fmt='PNG')
+            item.data = data
             item.media_type = 'image/png'
 
     def add_extra_images(self):
@@ -5,11 +5,9 @@ __license__   = 'GPL v3'
 __copyright__ = '2012, Kovid Goyal <kovid@kovidgoyal.net>'
 __docformat__ = 'restructuredtext en'
 
-import copy
 import logging
 from collections import defaultdict, namedtuple
 from functools import partial
-from io import BytesIO
 from struct import pack
 
 import css_parser
@@ -17,8 +15,8 @@ from css_parser.css import CSSRule
 from lxml import etree
 
 from calibre import force_unicode, isbytestring
-from calibre.ebooks.compression.palmdoc import compress_doc
-from calibre.ebooks.mobi.utils import create_text_record, is_guide_ref_start, to_base
+from calibre.ebooks.compression.palmdoc import compress_doc_records
+from calibre.ebooks.mobi.utils import create_text_records, is_guide_ref_start, to_base
 from calibre.ebooks.mobi.writer8.index import ChunkIndex, GuideIndex, NCXIndex, NonLinearNCXIndex, SkelIndex
 from calibre.ebooks.mobi.writer8.mobi import KF8Book
 from calibre.ebooks.mobi.writer8.skeleton import Chunker, aid_able_tags, to_href
@@ -37,24 +35,25 @@ to_ref = partial(to_base, base=32, min_num_digits=4)
 
 class KF8Writer:
 
-    def __init__(self, oeb, opts, resources):
+    def __init__(self, oeb, opts, resources, toc_adder=None, preserve_data=True):
         self.oeb, self.opts, self.log = oeb, opts, oeb.log
         try:
             self.compress = not self.opts.dont_compress
         except Exception:
             self.compress = True
+        self.compression_workers = getattr(self.opts, 'compression_workers', 0)
         self.has_tbs = False
         self.log.info('Creating KF8 output')
 
         # Create an inline ToC if one does not already exist
-        self.toc_adder = TOCAdder(oeb, opts)
+        self.toc_adder = toc_adder or TOCAdder(oeb, opts)
         self.used_images = set()
         self.resources = resources
         self.flows = [None]  # First flow item is reserved for the text
         self.records = [None]  # Placeholder for zeroth record
 
         self.log('\tGenerating KF8 markup...')
-        self.dup_data()
+        self.dup_data(preserve_data)
         self.cleanup_markup()
         self.replace_resource_links()
         self.extract_css_into_flows()
@@ -62,8 +61,8 @@ class KF8Writer:
         self.replace_internal_links_with_placeholders()
         self.insert_aid_attributes()
         self.chunk_it_up()
-        # Dump the cloned data as it is no longer needed
-        del self._data_cache
+        # The markup is no longer needed, restore it for MOBI 6
+        self.restore_data()
         self.create_text_records()
         self.log('\tCreating indices...')
         self.create_fdst_records()
@@ -72,25 +71,39 @@ class KF8Writer:
         # We do not want to use this ToC for MOBI 6, so remove it
         self.toc_adder.remove_generated_toc()
 
-    def dup_data(self):
-        ''' Duplicate data so that any changes we make to markup/CSS only
-        affect KF8 output and not MOBI 6 output '''
+    def dup_data(self, preserve_data=True):
+        ''' Make sure that any changes we make to markup/CSS only affect KF8
+        output and not MOBI 6 output. Stylesheets are replaced by private
+        copies. The markup is changed in place, after taking a snapshot of
+        every document the first time it is used, and restored from the
+        snapshots by restore_data(). Snapshots are not needed when nothing
+        uses the book afterwards, or when it is a private copy, as in a
+        forked process. '''
         self._data_cache = {}
+        self._snapshots = {} if preserve_data else None
         # Suppress css_parser logging output as it is duplicated anyway earlier
         # in the pipeline
         css_parser.log.setLevel(logging.CRITICAL)
         for item in self.oeb.manifest:
-            if item.media_type in XML_DOCS:
-                self._data_cache[item.href] = copy.deepcopy(item.data)
-            elif item.media_type in OEB_STYLES:
-                # I can't figure out how to make an efficient copy of the
-                # in-memory CSSStylesheet, as deepcopy doesn't work (raises an
-                # exception)
-                self._data_cache[item.href] = css_parser.parseString(
-                        item.data.cssText, validate=False)
+            if item.media_type in OEB_STYLES:
+                # There is no efficient way to copy an in-memory
+                # CSSStylesheet, as deepcopy doesn't work (raises an
+                # exception), so reparse it
+                self._data_cache[item.href] = item.snapshot().materialize()
 
     def data(self, item):
-        return self._data_cache.get(item.href, item.data)
+        ans = self._data_cache.get(item.href)
+        if ans is None:
+            if self._snapshots is not None and item.href not in self._snapshots and item.media_type in XML_DOCS:
+                self._snapshots[item.href] = item.snapshot()
+            ans = item.data
+        return ans
+
+    def restore_data(self):
+        if self._snapshots:
+            for snapshot in self._snapshots.values():
+                snapshot.restore()
+        del self._data_cache, self._snapshots
 
     def cleanup_markup(self):
         for item in self.oeb.spine:
@@ -334,26 +347,22 @@ class KF8Writer:
                 in self.flows]
         text = b''.join(self.flows)
         self.text_length = len(text)
-        text = BytesIO(text)
-        nrecords = 0
+        text_records = create_text_records(text)
+        nrecords = len(text_records)
         records_size = 0
-        self.uncompressed_record_lengths = []
+        self.uncompressed_record_lengths = [len(data) for data, overlap in text_records]
 
+        datas = [data for data, overlap in text_records]
         if self.compress:
             self.oeb.logger.info('\tCompressing markup...')
+            datas = compress_doc_records(datas, self.compression_workers)
 
-        while text.tell() < self.text_length:
-            data, overlap = create_text_record(text)
-            self.uncompressed_record_lengths.append(len(data))
-            if self.compress:
-                data = compress_doc(data)
-
+        for data, (_, overlap) in zip(datas, text_records):
             data += overlap
             data += pack(b'>B', len(overlap))
 
             self.records.append(data)
             records_size += len(data)
-            nrecords += 1
 
         self.last_text_record_idx = nrecords
         self.first_non_text_record_idx = nrecords + 1
@@ -490,6 +499,71 @@ class KF8Writer:
             self.guide_records = GuideIndex(self.guide_table)()
 
 
-def create_kf8_book(oeb, opts, resources, for_joint=False):
-    writer = KF8Writer(oeb, opts, resources)
+def create_kf8_book(oeb, opts, resources, for_joint=False, preserve_data=True):
+    writer = KF8Writer(oeb, opts, resources, preserve_data=preserve_data)
     return KF8Book(writer, for_joint=for_joint)
+
+
+_kf8_args = None
+
+
+def _init_kf8_worker(*args):
+    global _kf8_args
+    _kf8_args = args
+
+
+def _create_joint_kf8_book():
+    oeb, opts, resources, toc_adder = _kf8_args
+    writer = KF8Writer(oeb, opts, resources, toc_adder=toc_adder, preserve_data=False)
+    book = KF8Book(writer, for_joint=True)
+    # Restored from the main process, where record0 is generated
+    book.metadata = book.opts = None
+    return book
+
+
+def start_joint_kf8_book(oeb, opts, resources):
+    '''
+    Start creating the KF8 book for a joint MOBI file in a forked process, so
+    that the MOBI 6 book can be created from the same OEBBook at the same
+    time. The forked process has its own copy of the book, so there is no
+    need to preserve its markup. Returns a
+    function that waits for the process and returns the KF8Book. If no
+    process can be started, the KF8Book is created here, as
+    create_kf8_book() does. The MOBI 6 book changes the book while the
+    process runs, so if the process dies or its KF8Book cannot be
+    transferred, the conversion is run again without a process.
+    '''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    from pickle import PicklingError
+
+    from calibre.ebooks.conversion import RetryConversion
+
+    # The inline ToC changes the guide and spine of the book, so it is
+    # generated before forking, as the MOBI 6 book must see the same changes
+    # as when the KF8 book is created first
+    toc_adder = TOCAdder(oeb, opts)
+    try:
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise OSError('fork is not supported')
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_kf8_worker, initargs=(oeb, opts, resources, toc_adder))
+        future = executor.submit(_create_joint_kf8_book)
+    except OSError as err:
+        oeb.log.warn(f'Failed to start a process for the KF8 book ({err}), creating it before the MOBI 6 book')
+        book = KF8Book(KF8Writer(oeb, opts, resources, toc_adder=toc_adder), for_joint=True)
+        return lambda: book
+    # We do not want to use this ToC for MOBI 6, so remove it
+    toc_adder.remove_generated_toc()
+
+    def result():
+        try:
+            book = future.result()
+        except (BrokenProcessPool, PicklingError) as err:
+            raise RetryConversion(f'The process creating the KF8 book failed ({err})', mobi_parallel_joint=False) from err
+        finally:
+            executor.shutdown()
+        book.metadata, book.opts = oeb.metadata, opts
+        return book
+    return result
@@ -11,8 +11,8 @@ import numbers
 import os
 import re
 import sys
-from collections import defaultdict
-from functools import lru_cache
+from collections import defaultdict, namedtuple
+from functools import lru_cache, wraps
 from itertools import count
 from operator import attrgetter
 from urllib.parse import urldefrag, urljoin, urlparse, urlunparse
@@ -461,8 +461,42 @@ URL_SAFE      = frozenset(USAFE)
 URL_SAFE_BYTES = frozenset(USAFE.encode('ascii'))
 URL_UNSAFE = [ASCII_CHARS - URL_SAFE, UNIBYTE_CHARS - URL_SAFE_BYTES]
 del USAFE
+# The URL functions below are called for every link in a book, many times
+# over, with the same arguments, so their results are memoised. Long URLs,
+# such as data: URLs, are not worth keeping.
+URL_CACHE_SIZE = 1 << 16
+URL_CACHE_MAX_LENGTH = 1024
+url_caches = []
+
+
+def memoize_url_function(func):
+    cache = {}
+    stats = [0, 0]  # calls, hits
+
+    @wraps(func)
+    def memoized(*args):
+        stats[0] += 1
+        href = args[-1]
+        if not isinstance(href, (str, bytes)) or len(href) > URL_CACHE_MAX_LENGTH:
+            return func(*args)
+        try:
+            ans = cache[args]
+        except KeyError:
+            pass
+        else:
+            stats[1] += 1
+            return ans
+        if len(cache) >= URL_CACHE_SIZE:
+            cache.clear()
+        cache[args] = ans = func(*args)
+        return ans
 
+    memoized.cache, memoized.stats = cache, stats
+    url_caches.append(memoized)
+    return memoized
 
+
+@memoize_url_function
 def urlquote(href):
     ''' Quote URL-unsafe characters, allowing IRI-safe characters.
     That is, this function returns valid IRIs not valid URIs. In particular,
@@ -480,6 +514,7 @@ def urlquote(href):
     return join.join(result)
 
 
+@memoize_url_function
 def urlnormalize(href):
     '''Convert a URL into normalized form, with all and only URL-unsafe
     characters URL quoted.
@@ -892,6 +927,159 @@ class Metadata:
         return elem
 
 
+class DataSnapshot:
+    '''A snapshot of the parsed data of a manifest item, taken with
+    :meth:`Manifest.Item.snapshot`.
+
+    Parsed data is only kept in serialized form, as XML bytes or CSS text,
+    which takes much less memory than a copy of the parsed data. It is parsed
+    again only when it is needed: use :meth:`materialize` to get a private
+    copy of the data that can be changed freely, or change the data of the
+    item in place and call :meth:`restore` afterwards.
+    '''
+
+    __slots__ = ('item', 'kind', 'raw')
+
+    def __init__(self, item):
+        self.item = item
+        data = item.data
+        if isinstance(data, etree._Element):
+            self.kind, self.raw = 'xml', etree.tostring(data, encoding='utf-8')
+        elif hasattr(data, 'cssText'):
+            self.kind, self.raw = 'css', data.cssText
+        else:
+            self.kind, self.raw = None, data
+
+    def materialize(self):
+        '''Return a new copy of the data in the snapshot.'''
+        if self.kind == 'xml':
+            return safe_xml_fromstring(self.raw, recover=False)
+        if self.kind == 'css':
+            import css_parser
+            return css_parser.parseString(self.raw, validate=False)
+        return self.raw
+
+    def restore(self):
+        '''Discard any changes made to the data of the item since the
+        snapshot was taken. The snapshot cannot be used afterwards.
+
+        The root element or stylesheet of the item is kept, with its contents
+        replaced, so references to it stay valid. References to the elements
+        or rules inside it do not, they must be looked up again.'''
+        item, data = self.item, self.item.data
+        if self.kind == 'xml' and isinstance(data, etree._Element):
+            root = self.materialize()
+            data.clear()
+            data.tag = root.tag
+            data.attrib.update(root.attrib)
+            data.text, data.tail = root.text, root.tail
+            data.extend(root)
+        elif self.kind == 'css' and hasattr(data, 'cssText'):
+            data.cssText = self.raw
+        else:
+            item._data = self.materialize()
+        item.oeb.links.invalidate(item)
+        self.item = self.raw = None
+
+
+Link = namedtuple('Link', 'href fragment elem')
+
+
+class LinkIndex:
+    '''The links between the files of a book, available as
+    :attr:`OEBBook.links`.
+
+    Maps every manifest item to the links in it to other files of the book,
+    as :class:`Link` tuples of the book-absolute href, the fragment and the
+    element containing the link (None for stylesheets), and every href to the
+    items that link to it. Links to other sites are not indexed.
+
+    The links of an item are found the first time they are needed and are
+    forgotten when the item is removed from the manifest or its data is
+    replaced. Code that changes the links in the data of an item in place
+    must either do so with :meth:`rewrite_links` or call :meth:`invalidate`.
+    '''
+
+    def __init__(self, oeb):
+        self.oeb = oeb
+        self.outgoing = {}
+        self.incoming = defaultdict(set)
+
+    def links_from(self, item):
+        '''Return the :class:`Link` tuples for the links in :param:`item`,
+        in document order.'''
+        try:
+            return self.outgoing[item]
+        except KeyError:
+            pass
+        self.outgoing[item] = ans = tuple(self._find_links(item))
+        for link in ans:
+            self.incoming[link.href].add(item)
+        return ans
+
+    def referrers(self, href):
+        '''Return the set of manifest items that link to the book-absolute
+        :param:`href`, which must not have a fragment.'''
+        for item in self.oeb.manifest.items:
+            if item not in self.outgoing:
+                self.links_from(item)
+        return set(self.incoming.get(href, ()))
+
+    def invalidate(self, item=None):
+        '''Forget the links of :param:`item`, or of all items if it is None,
+        so that they are found again when next needed.'''
+        if item is None:
+            self.outgoing.clear()
+            self.incoming.clear()
+            return
+        for link in self.outgoing.pop(item, ()):
+            referrers = self.incoming.get(link.href)
+            if referrers is not None:
+                referrers.discard(item)
+                if not referrers:
+                    del self.incoming[link.href]
+
+    def rewrite_links(self, item, link_repl_func):
+        '''Replace every link in the data of :param:`item` with the result of
+        calling :param:`link_repl_func` on it, as for :func:`rewrite_links`,
+        and keep the index up to date.'''
+        data = item.data
+        if etree.iselement(data):
+            rewrite_links(data, link_repl_func)
+        elif hasattr(data, 'cssText'):
+            import css_parser
+            css_parser.replaceUrls(data, link_repl_func)
+        self.invalidate(item)
+
+    def _find_links(self, item):
+        mt = item.media_type
+        if mt in OEB_DOCS or mt[-4:] in ('/xml', '+xml'):
+            data = item.data
+            if not etree.iselement(data):
+                return
+            links = ((elem, url) for elem, attrib, url, pos in iterlinks(data))
+        elif mt in OEB_STYLES:
+            import css_parser
+            try:
+                links = [(None, url) for url in css_parser.getUrls(item.data)]
+            except Exception:
+                return
+        else:
+            return
+        for elem, url in links:
+            if isinstance(url, bytes):
+                url = url.decode('utf-8')
+            path, frag = urldefrag(url.strip())
+            try:
+                href = item.abshref(urlnormalize(path)) if path else item.href
+                if urlparse(href).scheme:
+                    continue
+            except Exception:
+                self.oeb.log.debug(f'Skipping invalid href: {url!r} in {item.href}')
+                continue
+            yield Link(href, frag, elem)
+
+
 class Manifest:
     '''Collection of files composing an OEB data model book.
 
@@ -1069,13 +1257,22 @@ class Manifest:
         @data.setter
         def data(self, value):
             self._data = value
+            self.oeb.links.invalidate(self)
 
         @data.deleter
         def data(self):
             self._data = None
+            self.oeb.links.invalidate(self)
 
         def reparse_css(self):
             self._data = self._parse_css(str(self))
+            self.oeb.links.invalidate(self)
+
+        def snapshot(self):
+            '''Return a :class:`DataSnapshot` of the current data of this
+            item, so that a writer can change the data and restore it
+            afterwards, or get its own private copy of it.'''
+            return DataSnapshot(self)
 
         def unload_data_from_memory(self, memory=None):
             if isinstance(self._data, bytes):
@@ -1145,28 +1342,7 @@ class Manifest:
             '''Convert the URL provided in :param:`href` from a reference
             relative to this manifest item to a book-absolute reference.
             '''
-            try:
-                purl = urlparse(href)
-            except ValueError:
-                return href
-            scheme = purl.scheme
-            if scheme and scheme != 'file':
-                return href
-            purl = list(purl)
-            purl[0] = ''
-            href = urlunparse(purl)
-            path, frag = urldefrag(href)
-            if not path:
-                if frag:
-                    return '#'.join((self.href, frag))
-                else:
-                    return self.href
-            if '/' not in self.href:
-                return href
-            dirname = os.path.dirname(self.href)
-            href = os.path.join(dirname, href)
-            href = os.path.normpath(href).replace('\\', '/')
-            return href
+            return abs_href(self.href, href)
 
     def __init__(self, oeb):
         self.oeb = oeb
@@ -1199,6 +1375,7 @@ class Manifest:
         if item.href in self.hrefs:
             del self.hrefs[item.href]
         self.items.remove(item)
+        self.oeb.links.invalidate(item)
         if item in self.oeb.spine:
             self.oeb.spine.remove(item)
 
@@ -1207,6 +1384,7 @@ class Manifest:
             item = self.ids[item]
         del self.ids[item.id]
         self.items.remove(item)
+        self.oeb.links.invalidate(item)
 
     def generate(self, id=None, href=None):
         '''Generate a new unique identifier and/or internal path for use in
@@ -1798,6 +1976,8 @@ class OEBBook:
         :attr:`toc`: Hierarchical table of contents.
         :attr:`pages`: List of "pages," such as indexed to a print edition of
             the same text.
+        :attr:`links`: A :class:`LinkIndex` of the links between the files
+            of the book.
         '''
         _css_log_handler.log = logger
         self.encoding = encoding
@@ -1815,6 +1995,7 @@ class OEBBook:
         self.guide = Guide(self)
         self.toc = TOC()
         self.pages = PageList()
+        self.links = LinkIndex(self)
         self.auto_generated_toc = True
         self._temp_files = []
 
@@ -1991,6 +2172,7 @@ class OEBBook:
         return results
 
 
+@memoize_url_function
 def rel_href(base_href, href):
     '''Convert the URL provided in :param:`href` to a URL relative to the URL
     in :param:`base_href`  '''
@@ -2023,3 +2205,62 @@ def rel_href(base_href, href):
     if frag:
         relhref = '#'.join((relhref, frag))
     return relhref
+
+
+@memoize_url_function
+def abs_href(base_href, href):
+    '''Convert the URL provided in :param:`href` from a URL relative to the
+    URL in :param:`base_href` to a book-absolute URL.  '''
+    try:
+        purl = urlparse(href)
+    except ValueError:
+        return href
+    scheme = purl.scheme
+    if scheme and scheme != 'file':
+        return href
+    purl = list(purl)
+    purl[0] = ''
+    href = urlunparse(purl)
+    path, frag = urldefrag(href)
+    if not path:
+        if frag:
+            return '#'.join((base_href, frag))
+        else:
+            return base_href
+    if '/' not in base_href:
+        return href
+    dirname = os.path.dirname(base_href)
+    href = os.path.join(dirname, href)
+    href = os.path.normpath(href).replace('\\', '/')
+    return href
+
+
+def url_cache_stats():
+    '''Return a dict mapping the names of the memoised URL functions to the
+    number of calls to them and the number of those calls that were answered
+    from their caches.'''
+    return {func.__name__: tuple(func.stats) for func in url_caches}
+
+
+def reset_url_cache_stats():
+    '''Start counting the calls to the memoised URL functions from zero, for
+    instance at the start of a conversion, so that the statistics are for that
+    conversion only. The caches are kept.'''
+    for func in url_caches:
+        func.stats[:] = [0, 0]
+
+
+def format_url_cache_stats(stats):
+    lines = []
+    for name, (calls, hits) in stats.items():
+        rate = 100 * hits / calls if calls else 0
+        lines.append(f'{name}: {calls} calls, {rate:.1f}% cache hits')
+    return '\n'.join(lines)
+
+
+def clear_url_caches():
+    '''Empty the caches of the memoised URL functions, for instance after
+    renaming files, when the results for the old names are no longer
+    needed.'''
+    for func in url_caches:
+        func.cache.clear()
@@ -1469,11 +1469,10 @@ class InvalidMobi(InvalidBook):
 def do_explode(path, dest):
     from calibre.ebooks.mobi.reader.mobi6 import MobiReader
     from calibre.ebooks.mobi.reader.mobi8 import Mobi8Reader
-    with open(path, 'rb') as stream:
-        mr = MobiReader(stream, default_log, None, None)
+    with open(path, 'rb') as stream, MobiReader(stream, default_log, None, None) as mobi6_reader:
 
         with CurrentDir(dest):
-            mr = Mobi8Reader(mr, default_log, for_tweak=True)
+            mr = Mobi8Reader(mobi6_reader, default_log, for_tweak=True)
             opf = os.path.abspath(mr())
             obfuscated_fonts = mr.encrypted_fonts
 
@@ -11,9 +11,10 @@ import io
 import os
 import re
 import sys
+import time
 import uuid
 from collections import defaultdict
-from urllib.parse import urldefrag, urlparse
+from urllib.parse import urldefrag
 
 from lxml import etree
 
@@ -43,7 +44,6 @@ from calibre.ebooks.oeb.base import (
     OEBError,
     XPath,
     barename,
-    iterlinks,
     namespace,
     urlnormalize,
     xml2text,
@@ -58,6 +58,31 @@ from polyglot.urllib import unquote
 
 __all__ = ['OEBReader']
 
+_parse_items = ()
+
+
+def _init_parse_worker(items):
+    global _parse_items
+    _parse_items = items
+
+
+def _parse_document(idx):
+    # Runs in a worker process, returns the serialized tree, the time taken
+    # to parse it and the statistics of the preprocessing rules run on it, or
+    # None if the document has to be parsed lazily instead
+    item = _parse_items[idx]
+    stats = getattr(item.oeb.html_preprocessor, 'rule_stats', None)
+    if stats:
+        stats.clear()
+    st = time.monotonic()
+    try:
+        root = item.data
+    except Exception:
+        return None, 0, None
+    if not hasattr(root, 'xpath'):
+        return None, 0, None
+    return etree.tostring(root, encoding='utf-8'), time.monotonic() - st, stats
+
 
 class OEBReader:
     '''Read an OEBPS 1.x or OPF/OPS 2.0 file collection.'''
@@ -204,8 +229,52 @@ class OEBReader:
                     self.oeb.manifest.remove(item)
         return bad
 
+    def _manifest_preparse(self):
+        '''
+        Decode, preprocess and parse all HTML documents in the manifest in
+        worker processes, instead of one after the other when their data is
+        first accessed. Documents that fail to parse in a worker, or if the
+        workers cannot be used at all, are left to be parsed lazily as usual,
+        which also takes care of reporting any errors.
+        '''
+        import multiprocessing
+        workers = getattr(self.oeb, 'html_parse_workers', 1)
+        if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            return
+        if getattr(self.oeb.html_preprocessor, 'regex_wizard_callback', None) is not None:
+            return
+        items = [item for item in self.oeb.manifest.values() if item.media_type in OEB_DOCS and (
+            item._data is None or isinstance(item._data, (str, bytes)))]
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(items))
+        if workers < 2:
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        st = time.monotonic()
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_parse_worker, initargs=(items,)) as executor:
+                results = list(executor.map(_parse_document, range(len(items))))
+        except (OSError, BrokenProcessPool) as err:
+            self.logger.warn(f'Parsing HTML in parallel failed ({err}), parsing it in a single process')
+            return
+        parsed = 0
+        for item, (raw, elapsed, stats) in zip(items, results):
+            if raw is None:
+                continue
+            try:
+                item._data = safe_xml_fromstring(raw)
+            except Exception:
+                continue
+            parsed += 1
+            if stats:
+                self.oeb.html_preprocessor.add_rule_stats(stats)
+            self.logger.debug(f'Parsed {item.href} in {elapsed:.3f} seconds')
+        self.logger.info(f'Parsed {parsed} of {len(items)} HTML files in {time.monotonic() - st:.2f} seconds using {workers} processes')
+
     def _manifest_add_missing(self, invalid):
-        import css_parser
         manifest = self.oeb.manifest
         known = set(manifest.hrefs)
         unchecked = set(manifest.values())
@@ -226,34 +295,9 @@ class OEBReader:
                 if data is None:
                     continue
 
-                if (item.media_type in OEB_DOCS or item.media_type[-4:] in ('/xml', '+xml')):
-                    hrefs = [r[2] for r in iterlinks(data)]
-                    for href in hrefs:
-                        if isinstance(href, bytes):
-                            href = href.decode('utf-8')
-                        href, _ = urldefrag(href)
-                        if not href:
-                            continue
-                        try:
-                            href = item.abshref(urlnormalize(href))
-                            scheme = urlparse(href).scheme
-                        except Exception:
-                            self.oeb.log.exception(
-                                f'Skipping invalid href: {href!r}')
-                            continue
-                        if not scheme and href not in known:
-                            new.add(href)
-                elif item.media_type in OEB_STYLES:
-                    try:
-                        urls = list(css_parser.getUrls(data))
-                    except Exception:
-                        urls = []
-                    for url in urls:
-                        href, _ = urldefrag(url)
-                        href = item.abshref(urlnormalize(href))
-                        scheme = urlparse(href).scheme
-                        if not scheme and href not in known:
-                            new.add(href)
+                for link in self.oeb.links.links_from(item):
+                    if link.href not in known:
+                        new.add(link.href)
             unchecked.clear()
             warned = set()
             for href in new:
@@ -306,6 +350,7 @@ class OEBReader:
                 self.logger.warn(f'Duplicate manifest id {id!r}')
                 id, href = manifest.generate(id, href)
             manifest.add(id, href, media_type, fallback)
+        self._manifest_preparse()
         invalid = self._manifest_prune_invalid()
         self._manifest_add_missing(invalid)
 
@@ -9,8 +9,11 @@ import copy
 import logging
 import numbers
 import os
+import posixpath
 import re
 import unicodedata
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
 from operator import itemgetter
 from weakref import WeakKeyDictionary
 from xml.dom import SyntaxErr as CSSSyntaxError
@@ -19,7 +22,9 @@ from css_parser import CSSParser, parseString, parseStyle, profiles, replaceUrls
 from css_parser import log as css_parser_log
 from css_parser import profile as cssprofiles
 from css_parser.css import CSSFontFaceRule, CSSPageRule, CSSStyleRule, cssproperties
-from css_selectors import INAPPROPRIATE_PSEUDO_CLASSES, Select, SelectorError
+from css_selectors import INAPPROPRIATE_PSEUDO_CLASSES, Select, SelectorError, parse
+from css_selectors.parser import Attrib, Class, CombinedSelector, Element, Function, Hash, Negation, Pseudo, ascii_lower
+from lxml import etree
 from tinycss.media3 import CSSMedia3Parser
 
 from calibre import as_unicode, force_unicode
@@ -66,6 +71,7 @@ FONT_SIZE_NAMES = {
 
 ALLOWED_MEDIA_TYPES = frozenset({'screen', 'all', 'aural', 'amzn-kf8'})
 IGNORED_MEDIA_FEATURES = frozenset('width min-width max-width height min-height max-height device-width min-device-width max-device-width device-height min-device-height max-device-height aspect-ratio min-aspect-ratio max-aspect-ratio device-aspect-ratio min-device-aspect-ratio max-device-aspect-ratio color min-color max-color color-index min-color-index max-color-index monochrome min-monochrome max-monochrome -webkit-min-device-pixel-ratio resolution min-resolution max-resolution scan grid'.split())  # noqa: E501
+pseudo_pat = re.compile(':{{1,2}}({})'.format('|'.join(INAPPROPRIATE_PSEUDO_CLASSES)), re.I)
 
 
 def media_ok(raw):
@@ -135,10 +141,163 @@ def cleanup_epub_prefixed_properties(style: dict[str, str]) -> None:
                 style[key] = val
 
 
+def rightmost_key(parsed):
+    '''
+    Return the (kind, key) an element must have to match the parsed selector,
+    taken from its rightmost compound selector. kind is one of 'ids',
+    'classes' or 'tags', or None if any element can match.
+    '''
+    if len(parsed) != 1:
+        return None, None
+    node = parsed[0].parsed_tree
+    if isinstance(node, CombinedSelector):
+        node = node.subselector
+    ans = None, None
+    while node is not None:
+        if isinstance(node, Hash):
+            ans = 'ids', ascii_lower(node.id)
+        elif isinstance(node, Class):
+            if ans[0] != 'ids':
+                ans = 'classes', ascii_lower(node.class_name)
+        elif isinstance(node, Pseudo) and node.ident == 'root':
+            # :root matches the root element regardless of the rest of the
+            # compound selector
+            return None, None
+        elif isinstance(node, Element):
+            if ans[0] is None and node.element and node.element != '*':
+                ans = 'tags', ascii_lower(node.element)
+            break
+        elif not isinstance(node, (Attrib, Function, Negation, Pseudo)):
+            return None, None
+        node = node.selector
+    return ans
+
+
+@lru_cache(maxsize=4096)
+def index_selector(text):
+    '''
+    Parse the selector text, returning (parsed, kind, key) where kind and key
+    are as for :func:`rightmost_key`. parsed is None if the selector is
+    invalid.
+    '''
+    try:
+        parsed = parse(text)
+        # Selectors that are only rejected when matched must be matched
+        # against every document so that the error is always reported
+        tuple(Select(etree.Element('html'), ignore_inappropriate_pseudo_classes=True).iterparsedselectors(parsed))
+    except SelectorError:
+        return None, None, None
+    return (parsed,) + rightmost_key(parsed)
+
+
+class RuleIndex:
+
+    '''
+    Index of flattened rules keyed on the rightmost compound selector of each
+    rule, like the rule hash used by browsers. Rules keyed on an id, class or
+    tag name that does not occur in a document cannot match anything in it and
+    are skipped. Selectors are parsed once here, instead of once per document.
+    '''
+
+    def __init__(self, rules):
+        self.parsed = []
+        self.ids, self.classes, self.tags = defaultdict(list), defaultdict(list), defaultdict(list)
+        self.universal = []
+        self.has_first_letter = False
+        for i, (_, _, _, text, _) in enumerate(rules):
+            fl = pseudo_pat.search(text)
+            if fl is not None and fl.group(1) == 'first-letter':
+                self.has_first_letter = True
+            parsed, kind, key = index_selector(text)
+            self.parsed.append(parsed)
+            if kind is None:
+                self.universal.append(i)
+            else:
+                getattr(self, kind)[key].append(i)
+
+    def rules_for(self, select):
+        ' The set of indices of the rules that can match something in the tree of select '
+        ans = set(self.universal)
+        for kind, key_map in (('ids', select.id_map), ('classes', select.class_map), ('tags', select.element_map)):
+            buckets = getattr(self, kind)
+            if buckets:
+                for key, elems in key_map.items():
+                    if elems and key in buckets:
+                        ans.update(buckets[key])
+        return ans
+
+
+class BoundedCache(OrderedDict):
+
+    ''' A mapping that evicts its least recently used entries when it holds more than max_size of them, counting hits and misses '''
+
+    def __init__(self, max_size):
+        super().__init__()
+        self.max_size = max_size
+        self.hits = self.misses = 0
+
+    def lookup(self, key):
+        try:
+            ans = self[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.move_to_end(key)
+        return ans
+
+    def store(self, key, val):
+        self[key] = val
+        if len(self) > self.max_size:
+            self.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return f'{self.hits}/{total} hits ({100 * self.hits / max(total, 1):.0f}%)'
+
+
+class StyleCache:
+
+    '''
+    Caches shared by all the Stylizers of an OEBBook: parsed inline
+    stylesheets keyed on their contents and flattened declaration blocks keyed
+    on their declarations. Reusing the parsed stylesheets also means that
+    documents with identical inline styles share a single StylizerRules.
+    '''
+
+    def __init__(self, max_sheets=256, max_styles=4096):
+        self.sheets = BoundedCache(max_sheets)
+        self.styles = BoundedCache(max_styles)
+
+    def report(self, log):
+        log.info(f'CSS cache: stylesheets: {self.sheets.hit_rate()}, declaration blocks: {self.styles.hit_rate()}')
+
+    def counts(self):
+        ' The hits and misses of the caches, as a tuple for :meth:`add_counts` '
+        return self.sheets.hits, self.sheets.misses, self.styles.hits, self.styles.misses
+
+    def add_counts(self, counts):
+        ' Add the hits and misses of a copy of this cache, made in a worker process '
+        self.sheets.hits += counts[0]
+        self.sheets.misses += counts[1]
+        self.styles.hits += counts[2]
+        self.styles.misses += counts[3]
+
+
+def style_cache(oeb):
+    ''' Return the :class:`StyleCache` of oeb, creating it if needed '''
+    if not hasattr(oeb, 'style_cache'):
+        oeb.style_cache = StyleCache()
+    return oeb.style_cache
+
+
 class StylizerRules:
 
-    def __init__(self, opts, profile, stylesheets):
+    def __init__(self, opts, profile, stylesheets, style_cache=None):
         self.opts, self.profile, self.stylesheets = opts, profile, stylesheets
+        self.style_cache = None if style_cache is None else style_cache.styles
+        if self.style_cache is not None:
+            self.style_key = (opts.change_justification, profile.fbase, tuple(sorted(profile.fnames.items())))
 
         index = 0
         self.rules = []
@@ -156,6 +315,13 @@ class StylizerRules:
                     self.rules.extend(self.flatten_rule(rule, href, index, is_user_agent_sheet=sheet_index==0))
                     index = index + 1
         self.rules.sort(key=itemgetter(0))  # sort by specificity
+        self._rule_index = None
+
+    @property
+    def rule_index(self):
+        if self._rule_index is None:
+            self._rule_index = RuleIndex(self.rules)
+        return self._rule_index
 
     def flatten_rule(self, rule, href, index, is_user_agent_sheet=False):
         results = []
@@ -179,6 +345,20 @@ class StylizerRules:
         return results
 
     def flatten_style(self, cssstyle):
+        if self.style_cache is None:
+            return self._flatten_style(cssstyle)
+        key = self.style_key + tuple((prop.name, prop.value, prop.priority) for prop in cssstyle)
+        cached = self.style_cache.lookup(key)
+        if cached is None:
+            cached = self._flatten_style(cssstyle)
+            self.style_cache.store(key, cached)
+        # Return a copy as callers are free to modify the returned style
+        style = style_map()
+        style.update(cached)
+        style.important_properties.update(cached.important_properties)
+        return style
+
+    def _flatten_style(self, cssstyle):
         style = style_map()
         for prop in cssstyle:
             name = prop.name
@@ -229,6 +409,9 @@ class StylizerRules:
 
 class Stylizer:
     STYLESHEETS = WeakKeyDictionary()
+    # How rules are matched against documents, either 'indexed' to only match
+    # the rules found by the RuleIndex or 'select' to match every rule
+    rule_engine = 'indexed'
 
     def __init__(self, tree, path, oeb, opts, profile=None,
             extra_css='', user_css='', base_css=''):
@@ -264,6 +447,7 @@ class Stylizer:
 
         parser = CSSParser(fetcher=self._fetch_css_file,
                 log=logging.getLogger('calibre.css'))
+        cache = style_cache(oeb)
         for elem in style_tags:
             if (elem.tag in (XHTML('style'), SVG('style')) and elem.get('type', CSS_MIME) in OEB_STYLES and media_ok(elem.get('media'))):
                 text = elem.text or ''
@@ -275,12 +459,23 @@ class Stylizer:
                     if t:
                         text += '\n\n' + force_unicode(t, 'utf-8')
                 if text:
-                    text = oeb.css_preprocessor(text)
-                    # We handle @import rules separately
-                    parser.setFetcher(lambda x: ('utf-8', b''))
-                    stylesheet = parser.parseString(text, href=cssname,
-                            validate=False)
-                    parser.setFetcher(self._fetch_css_file)
+                    # The parsed sheet has its URLs resolved relative to the
+                    # document, so documents in the same folder with the same
+                    # <style> contents can share it
+                    key = 'style', posixpath.dirname(item.href), text
+                    stylesheet = cache.sheets.lookup(key)
+                    if stylesheet is None:
+                        text = oeb.css_preprocessor(text)
+                        # We handle @import rules separately
+                        parser.setFetcher(lambda x: ('utf-8', b''))
+                        stylesheet = parser.parseString(text, href=cssname,
+                                validate=False)
+                        parser.setFetcher(self._fetch_css_file)
+                        # Make links to resources absolute, since these rules will
+                        # be folded into a stylesheet at the root
+                        replaceUrls(stylesheet, item.abshref,
+                                ignoreImportRules=True)
+                        cache.sheets.store(key, stylesheet)
                     for rule in stylesheet.cssRules:
                         if rule.type == rule.IMPORT_RULE:
                             ihref = item.abshref(rule.href)
@@ -295,10 +490,6 @@ class Stylizer:
                                 self.logger.warn(f'CSS @import of non-CSS file {rule.href!r}')
                                 continue
                             stylesheets.append(sitem.data)
-                    # Make links to resources absolute, since these rules will
-                    # be folded into a stylesheet at the root
-                    replaceUrls(stylesheet, item.abshref,
-                            ignoreImportRules=True)
                     stylesheets.append(stylesheet)
             elif (elem.tag == XHTML('link') and elem.get('href') and elem.get(
                     'rel', 'stylesheet').lower() == 'stylesheet' and elem.get(
@@ -320,9 +511,12 @@ class Stylizer:
         for w, x in csses.items():
             if x:
                 try:
-                    text = x
-                    stylesheet = parser.parseString(text, href=cssname,
-                            validate=False)
+                    key = w, x
+                    stylesheet = cache.sheets.lookup(key)
+                    if stylesheet is None:
+                        stylesheet = parser.parseString(x, href=cssname,
+                                validate=False)
+                        cache.sheets.store(key, stylesheet)
                     stylesheets.append(stylesheet)
                 except Exception:
                     self.logger.exception(f'Failed to parse {w}, ignoring.')
@@ -333,28 +527,40 @@ class Stylizer:
         # and generating them again if opts, profile or stylesheets are different
         if (not hasattr(self.oeb, 'stylizer_rules')) \
             or not self.oeb.stylizer_rules.same_rules(self.opts, self.profile, stylesheets):
-            self.oeb.stylizer_rules = StylizerRules(self.opts, self.profile, stylesheets)
+            self.oeb.stylizer_rules = StylizerRules(self.opts, self.profile, stylesheets, cache)
         self.rules = self.oeb.stylizer_rules.rules
         self.page_rule = self.oeb.stylizer_rules.page_rule
         self.font_face_rules = self.oeb.stylizer_rules.font_face_rules
         self.flatten_style = self.oeb.stylizer_rules.flatten_style
 
         self._styles = {}
-        pseudo_pat = re.compile(':{{1,2}}({})'.format('|'.join(INAPPROPRIATE_PSEUDO_CLASSES)), re.I)
         select = Select(tree, ignore_inappropriate_pseudo_classes=True)
-
-        for _, _, cssdict, text, _ in self.rules:
+        fake_first_letter = getattr(self.oeb, 'plumber_output_format', '').lower() in {'mobi', 'docx'}
+        active_rules = parsed_selectors = None
+        if self.rule_engine == 'indexed':
+            rule_index = self.oeb.stylizer_rules.rule_index
+            # Faking first-letter changes the tree while rules are being
+            # matched, so use every rule in that case
+            if not (fake_first_letter and rule_index.has_first_letter):
+                active_rules = rule_index.rules_for(select)
+                parsed_selectors = rule_index.parsed
+
+        for i, (_, _, cssdict, text, _) in enumerate(self.rules):
+            if active_rules is not None and i not in active_rules:
+                continue
             fl = pseudo_pat.search(text)
             try:
-                matches = tuple(select(text))
+                if parsed_selectors is None or parsed_selectors[i] is None:
+                    matches = tuple(select(text))
+                else:
+                    matches = tuple(select.iterparsedselectors(parsed_selectors[i]))
             except SelectorError as err:
                 self.logger.error(f'Ignoring CSS rule with invalid selector: {text!r} ({as_unicode(err)})')
                 continue
 
             if fl is not None:
                 fl = fl.group(1)
-                if fl == 'first-letter' and getattr(self.oeb,
-                        'plumber_output_format', '').lower() in {'mobi', 'docx'}:
+                if fl == 'first-letter' and fake_first_letter:
                     # Fake first-letter
                     for elem in matches:
                         for x in elem.iter('*'):
@@ -8,9 +8,7 @@ __docformat__ = 'restructuredtext en'
 import posixpath
 from urllib.parse import urldefrag, urlparse
 
-from lxml import etree
-
-from calibre.ebooks.oeb.base import rewrite_links, urlnormalize
+from calibre.ebooks.oeb.base import clear_url_caches, urlnormalize
 
 
 class RenameFiles:  # {{{
@@ -25,17 +23,18 @@ class RenameFiles:  # {{{
         self.renamed_items_map = renamed_items_map
 
     def __call__(self, oeb, opts):
-        import css_parser
         self.log = oeb.logger
         self.opts = opts
         self.oeb = oeb
 
-        for item in oeb.manifest.items:
+        # Only the files that link to renamed files and the renamed files
+        # themselves, whose relative links may have changed, are rewritten
+        items = {oeb.manifest.hrefs[href] for href in self.rename_map.values() if href in oeb.manifest.hrefs}
+        for href in self.rename_map:
+            items |= oeb.links.referrers(href)
+        for item in items:
             self.current_item = item
-            if etree.iselement(item.data):
-                rewrite_links(self.current_item.data, self.url_replacer)
-            elif hasattr(item.data, 'cssText'):
-                css_parser.replaceUrls(item.data, self.url_replacer)
+            oeb.links.rewrite_links(item, self.url_replacer)
 
         if self.oeb.guide:
             for ref in self.oeb.guide.values():
@@ -51,6 +50,9 @@ class RenameFiles:  # {{{
         if self.oeb.toc:
             self.fix_toc_entry(self.oeb.toc)
 
+        # The URLs relative to the old names will not be needed again
+        clear_url_caches()
+
     def fix_toc_entry(self, toc):
         if toc.href:
             href = urlnormalize(toc.href)
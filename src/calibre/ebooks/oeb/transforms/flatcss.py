@@ -9,6 +9,7 @@ __copyright__ = '2008, Marshall T. Vandegrift <llasram@gmail.com>'
 import math
 import numbers
 import operator
+import os
 import re
 from collections import defaultdict
 from xml.dom import SyntaxErr
@@ -20,12 +21,16 @@ from lxml import etree
 from calibre import guess_type
 from calibre.ebooks import unit_convert
 from calibre.ebooks.oeb.base import CSS_MIME, OEB_STYLES, SVG, SVG_NS, XHTML, XHTML_NS, XPath, barename, css_text, namespace
-from calibre.ebooks.oeb.stylizer import Stylizer
+from calibre.ebooks.oeb.stylizer import Stylizer, style_cache
 from calibre.utils.filenames import ascii_filename, ascii_text
 from calibre.utils.icu import numeric_sort_key
+from calibre.utils.xml_parse import safe_xml_fromstring
 
 COLLAPSE = re.compile(r'[ \t\r\n\v]+')
 STRIPNUM = re.compile(r'[-0-9]+$')
+# Marks the nodes whose classes are assigned by the parent process when
+# flattening in parallel
+FLAT_MARKER = 'data-calibre-flat-css'
 
 
 def asfloat(value, default):
@@ -132,6 +137,43 @@ class EmbedFontsCSSRules:
         return self.href
 
 
+class FlattenedStylizer:
+
+    '''
+    The parts of a :class:`Stylizer` that are still needed once its document
+    has been flattened in a worker process.
+    '''
+
+    def __init__(self, profile, page_rule, font_face_css, body_font_size):
+        self.profile, self.page_rule, self.body_font_size = profile, page_rule, body_font_size
+        self.font_face_rules = list(css_parser.parseString(font_face_css, validate=False).cssRules) if font_face_css else []
+
+
+_worker_flattener = None
+
+
+def _init_flatten_worker(flattener):
+    global _worker_flattener
+    _worker_flattener = flattener
+
+
+def _with_cache_counts(func, *args):
+    # Returns the result of func along with the hits and misses of the style
+    # cache of the worker while it ran, for the main process to report
+    cache = style_cache(_worker_flattener.oeb)
+    before = cache.counts()
+    ans = func(*args)
+    return ans, tuple(a - b for a, b in zip(cache.counts(), before))
+
+
+def _baseline_document(idx):
+    return _with_cache_counts(_worker_flattener.baseline_document, idx)
+
+
+def _flatten_document(idx, sbase):
+    return _with_cache_counts(_worker_flattener.flatten_document, idx, sbase)
+
+
 class CSSFlattener:
 
     def __init__(self, fbase=None, fkey=None, lineh=None, unfloat=False,
@@ -148,6 +190,9 @@ class CSSFlattener:
         self.untable = untable
         self.specializer = specializer
         self.page_break_on_body = page_break_on_body
+        # In worker processes, the classes each node needs are recorded here
+        # instead of being assigned, see record_classes()
+        self.class_records = None
 
     @classmethod
     def config(cls, cfg):
@@ -198,10 +243,15 @@ class CSSFlattener:
         # like the AZW3 output inline ToC.
         self.oeb.store_embed_font_rules = EmbedFontsCSSRules(self.body_font_family,
                 self.embed_font_rules)
-        self.stylize_spine()
-        self.sbase = self.baseline_spine() if self.fbase else None
-        self.fmap = FontMapper(self.sbase, self.fbase, self.fkey)
-        self.flatten_spine()
+        workers = self.flatten_workers()
+        if workers > 1:
+            self.parallel_flatten_spine(workers)
+        else:
+            self.stylize_spine()
+            style_cache(self.oeb).report(self.oeb.log)
+            self.sbase = self.baseline_spine() if self.fbase else None
+            self.fmap = FontMapper(self.sbase, self.fbase, self.fkey)
+            self.flatten_spine()
         if epub3_nav is not None:
             self.opts.epub3_nav_parsed = epub3_nav.data
 
@@ -278,36 +328,38 @@ class CSSFlattener:
 
         return body_font_family, efi
 
+    def prepare_body(self, item):
+        html = item.data
+        body = html.find(XHTML('body'))
+        if 'style' in html.attrib:
+            b = body.attrib.get('style', '')
+            body.set('style', html.get('style') + ';' + b)
+            del html.attrib['style']
+        bs = body.get('style', '').split(';')
+        bs.append('margin-top: 0pt')
+        bs.append('margin-bottom: 0pt')
+        if float(self.context.margin_left) >= 0:
+            bs.append(f'margin-left : {float(self.context.margin_left):g}pt')
+        if float(self.context.margin_right) >= 0:
+            bs.append(f'margin-right : {float(self.context.margin_right):g}pt')
+        bs.extend(['padding-left: 0pt', 'padding-right: 0pt'])
+        if self.page_break_on_body:
+            bs.extend(['page-break-before: always'])
+        if self.context.change_justification != 'original':
+            bs.append('text-align: '+ self.context.change_justification)
+        if self.body_font_family:
+            bs.append('font-family: '+self.body_font_family)
+        body.set('style', '; '.join(bs))
+
+    def create_stylizer(self, item):
+        return Stylizer(item.data, item.href, self.oeb, self.context, self.context.source,
+                user_css=self.context.extra_css, extra_css='')
+
     def stylize_spine(self):
         self.stylizers = {}
-        profile = self.context.source
-        css = ''
         for item in self.items:
-            html = item.data
-            body = html.find(XHTML('body'))
-            if 'style' in html.attrib:
-                b = body.attrib.get('style', '')
-                body.set('style', html.get('style') + ';' + b)
-                del html.attrib['style']
-            bs = body.get('style', '').split(';')
-            bs.append('margin-top: 0pt')
-            bs.append('margin-bottom: 0pt')
-            if float(self.context.margin_left) >= 0:
-                bs.append(f'margin-left : {float(self.context.margin_left):g}pt')
-            if float(self.context.margin_right) >= 0:
-                bs.append(f'margin-right : {float(self.context.margin_right):g}pt')
-            bs.extend(['padding-left: 0pt', 'padding-right: 0pt'])
-            if self.page_break_on_body:
-                bs.extend(['page-break-before: always'])
-            if self.context.change_justification != 'original':
-                bs.append('text-align: '+ self.context.change_justification)
-            if self.body_font_family:
-                bs.append('font-family: '+self.body_font_family)
-            body.set('style', '; '.join(bs))
-            stylizer = Stylizer(html, item.href, self.oeb, self.context, profile,
-                    user_css=self.context.extra_css,
-                    extra_css=css)
-            self.stylizers[item] = stylizer
+            self.prepare_body(item)
+            self.stylizers[item] = self.create_stylizer(item)
 
     def baseline_node(self, node, stylizer, sizes, csize):
         csize = stylizer.style(node)['font-size']
@@ -318,14 +370,17 @@ class CSSFlattener:
             if child.tail:
                 sizes[csize] += len(COLLAPSE.sub(' ', child.tail))
 
+    def baseline_item(self, item, stylizer, sizes):
+        body = item.data.find(XHTML('body'))
+        self.baseline_node(body, stylizer, sizes, self.context.source.fbase)
+
     def baseline_spine(self):
         sizes = defaultdict(float)
         for item in self.items:
-            html = item.data
-            stylizer = self.stylizers[item]
-            body = html.find(XHTML('body'))
-            fsize = self.context.source.fbase
-            self.baseline_node(body, stylizer, sizes, fsize)
+            self.baseline_item(item, self.stylizers[item], sizes)
+        return self.source_base_font_size(sizes)
+
+    def source_base_font_size(self, sizes):
         try:
             sbase = max(list(sizes.items()), key=operator.itemgetter(1))[0]
         except Exception:
@@ -530,8 +585,7 @@ class CSSFlattener:
 
         pseudo_classes = style.pseudo_classes(self.filter_css)
         if cssdict or pseudo_classes:
-            keep_classes = set()
-
+            klass = css = None
             if cssdict:
                 items = sorted(cssdict.items())
                 css = ';\n'.join(f'{key}: {val}' for key, val in items)
@@ -541,35 +595,14 @@ class CSSFlattener:
                 # name with different case, both cases will apply, leading
                 # to incorrect results.
                 klass = ascii_text(STRIPNUM.sub('', classes_list[0])).lower().strip().replace(' ', '_')
-                if css in styles:
-                    match = styles[css]
-                else:
-                    match = klass + str(names[klass] or '')
-                    styles[css] = match
-                    names[klass] += 1
-                node.attrib['class'] = match
-                keep_classes.add(match)
-
+            pseudo_css = []
             for psel, cssdict in pseudo_classes.items():
                 items = sorted(cssdict.items())
-                css = ';\n'.join(f'{key}: {val}' for key, val in items)
-                pstyles = pseudo_styles[psel]
-                if css in pstyles:
-                    match = pstyles[css]
-                else:
-                    # We have to use a different class for each psel as
-                    # otherwise you can have incorrect styles for a situation
-                    # like: a:hover { color: red } a:link { color: blue } a.x:hover { color: green }
-                    # If the pcalibre class for a:hover and a:link is the same,
-                    # then the class attribute for a.x tags will contain both
-                    # that class and the class for a.x:hover, which is wrong.
-                    klass = 'pcalibre'
-                    match = klass + str(names[klass] or '')
-                    pstyles[css] = match
-                    names[klass] += 1
-                keep_classes.add(match)
-                node.attrib['class'] = ' '.join(keep_classes)
-
+                pseudo_css.append((psel, ';\n'.join(f'{key}: {val}' for key, val in items)))
+            if self.class_records is None:
+                self.assign_classes(node, klass, css, pseudo_css, names, styles, pseudo_styles)
+            else:
+                self.record_classes(node, klass, css, pseudo_css)
         elif 'class' in node.attrib:
             del node.attrib['class']
         if 'style' in node.attrib:
@@ -578,6 +611,45 @@ class CSSFlattener:
             for child in node:
                 self.flatten_node(child, stylizer, names, styles, pseudo_styles, psize, item_id)
 
+    def assign_classes(self, node, klass, css, pseudo_css, names, styles, pseudo_styles):
+        # A dict rather than a set so that the order of the classes does not
+        # depend on string hashing, which differs between processes
+        keep_classes = {}
+        if css is not None:
+            if css in styles:
+                match = styles[css]
+            else:
+                match = klass + str(names[klass] or '')
+                styles[css] = match
+                names[klass] += 1
+            node.attrib['class'] = match
+            keep_classes[match] = True
+
+        for psel, css in pseudo_css:
+            pstyles = pseudo_styles[psel]
+            if css in pstyles:
+                match = pstyles[css]
+            else:
+                # We have to use a different class for each psel as
+                # otherwise you can have incorrect styles for a situation
+                # like: a:hover { color: red } a:link { color: blue } a.x:hover { color: green }
+                # If the pcalibre class for a:hover and a:link is the same,
+                # then the class attribute for a.x tags will contain both
+                # that class and the class for a.x:hover, which is wrong.
+                klass = 'pcalibre'
+                match = klass + str(names[klass] or '')
+                pstyles[css] = match
+                names[klass] += 1
+            keep_classes[match] = True
+            node.attrib['class'] = ' '.join(keep_classes)
+
+    def record_classes(self, node, klass, css, pseudo_css):
+        # Used in place of assign_classes in worker processes, class names
+        # depend on every document before this one, so they are assigned when
+        # the results are merged, in spine order
+        node.set(FLAT_MARKER, str(len(self.class_records)))
+        self.class_records.append((klass, css, pseudo_css))
+
     def flatten_head(self, item, href, global_href):
         html = item.data
         head = html.find(XHTML('head'))
@@ -675,17 +747,116 @@ class CSSFlattener:
                 ans[item] = gc_map[css]
         return ans
 
+    def flatten_item(self, item, stylizer, names, styles, pseudo_styles):
+        html = item.data
+        if self.specializer is not None:
+            self.specializer(item, stylizer)
+        fsize = self.context.dest.fbase
+        self.flatten_node(html, stylizer, names, styles, pseudo_styles, fsize, item.id, recurse=False)
+        self.flatten_node(html.find(XHTML('body')), stylizer, names, styles, pseudo_styles, fsize, item.id)
+
     def flatten_spine(self):
         names = defaultdict(int)
         styles, pseudo_styles = {}, defaultdict(dict)
         for item in self.items:
-            html = item.data
-            stylizer = self.stylizers[item]
-            if self.specializer is not None:
-                self.specializer(item, stylizer)
-            fsize = self.context.dest.fbase
-            self.flatten_node(html, stylizer, names, styles, pseudo_styles, fsize, item.id, recurse=False)
-            self.flatten_node(html.find(XHTML('body')), stylizer, names, styles, pseudo_styles, fsize, item.id)
+            self.flatten_item(item, self.stylizers[item], names, styles, pseudo_styles)
+        self.write_flattened_css(styles, pseudo_styles)
+
+    def flatten_workers(self):
+        import multiprocessing
+        workers = getattr(self.opts, 'css_flatten_workers', 1)
+        if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            return 1
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        return min(workers, len(self.items))
+
+    def parallel_flatten_spine(self, workers):
+        '''
+        Stylize and flatten the documents in worker processes. The workers are
+        forked after the bodies have been prepared and the rules of the book
+        built, so they share both instead of having to unpickle them. Each worker sends back its
+        flattened document, with the classes each node needs recorded rather
+        than assigned, and the class names are then handed out in spine order,
+        exactly as :meth:`flatten_spine` would, so the output does not depend
+        on the number of workers.
+        '''
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        for item in self.items:
+            self.prepare_body(item)
+        # Stylizing the first document builds the rules shared by the whole
+        # book, before the workers are forked so that they inherit them
+        first = self.items[0]
+        self.stylizers = {first: self.create_stylizer(first)}
+        indices = range(len(self.items))
+        cache = style_cache(self.oeb)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_flatten_worker, initargs=(self,)) as executor:
+                self.sbase = None
+                if self.fbase:
+                    sizes = defaultdict(float)
+                    for doc_sizes, counts in executor.map(_baseline_document, indices):
+                        cache.add_counts(counts)
+                        for size, count in doc_sizes:
+                            sizes[size] += count
+                    self.sbase = self.source_base_font_size(sizes)
+                results = list(executor.map(_flatten_document, indices, [self.sbase] * len(indices)))
+        except (OSError, BrokenProcessPool) as err:
+            self.oeb.log.warning(f'Flattening CSS in parallel failed ({err}), falling back to a single process')
+            self.stylizers = {item: self.stylizer_for(item) for item in self.items}
+            cache.report(self.oeb.log)
+            self.sbase = self.baseline_spine() if self.fbase else None
+            self.fmap = FontMapper(self.sbase, self.fbase, self.fkey)
+            self.flatten_spine()
+            return
+        self.fmap = FontMapper(self.sbase, self.fbase, self.fkey)
+
+        self.stylizers = {}
+        names = defaultdict(int)
+        styles, pseudo_styles = {}, defaultdict(dict)
+        profile = self.context.source
+        for item, ((raw, records, page_rule, font_face_css, body_font_size), counts) in zip(self.items, results):
+            cache.add_counts(counts)
+            html = safe_xml_fromstring(raw)
+            for node in html.iter(etree.Element):
+                idx = node.attrib.pop(FLAT_MARKER, None)
+                if idx is not None:
+                    self.assign_classes(node, *records[int(idx)], names, styles, pseudo_styles)
+            item.data = html
+            self.stylizers[item] = FlattenedStylizer(profile, page_rule, font_face_css, body_font_size)
+        cache.report(self.oeb.log)
+        self.write_flattened_css(styles, pseudo_styles)
+
+    def stylizer_for(self, item):
+        stylizer = self.stylizers.get(item)
+        if stylizer is None:
+            stylizer = self.stylizers[item] = self.create_stylizer(item)
+        return stylizer
+
+    def baseline_document(self, idx):
+        # Runs in a worker process
+        item = self.items[idx]
+        sizes = defaultdict(float)
+        self.baseline_item(item, self.stylizer_for(item), sizes)
+        return list(sizes.items())
+
+    def flatten_document(self, idx, sbase):
+        # Runs in a worker process
+        self.sbase = sbase
+        self.fmap = FontMapper(sbase, self.fbase, self.fkey)
+        item = self.items[idx]
+        stylizer = self.stylizer_for(item)
+        records = self.class_records = []
+        self.flatten_item(item, stylizer, None, None, None)
+        self.class_records = None
+        font_face_css = '\n\n'.join(css_text(r) for r in stylizer.font_face_rules)
+        return (etree.tostring(item.data, encoding='utf-8'), records, dict(stylizer.page_rule),
+                font_face_css, stylizer.body_font_size)
+
+    def write_flattened_css(self, styles, pseudo_styles):
         items = sorted(((key, val) for (val, key) in styles.items()), key=lambda x: numeric_sort_key(x[0]))
         # :hover must come after link and :active must come after :hover
         psels = sorted(pseudo_styles, key=lambda x:
@@ -702,5 +873,4 @@ class CSSFlattener:
         href = self.replace_css(css)
         global_css = self.collect_global_css()
         for item in self.items:
-            stylizer = self.stylizers[item]
             self.flatten_head(item, href, global_css[item])
@@ -5,24 +5,95 @@ __license__   = 'GPL v3'
 __copyright__ = '2009, Kovid Goyal <kovid@kovidgoyal.net>'
 __docformat__ = 'restructuredtext en'
 
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from calibre import fit_image
+from calibre.utils.image_cache import cached_image_transform
+from calibre.utils.imghdr import probe
+
+FAILURES = {
+    'convert': 'Failed to convert image {} from CMYK to RGB',
+    'rescale': 'Failed to rescale image: {}',
+}
+
+
+@cached_image_transform('rescale', cacheable=lambda ans: not any(note[0] in FAILURES for note in ans[1]))
+def rescale_image(raw, ext, page_width, page_height, check_colorspaces=False):
+    '''
+    Convert the image raw from CMYK to RGB if needed and scale it to fit the
+    page. Can be run in a worker thread, so instead of logging, returns notes
+    on what was done along with the new image data, or None if it is
+    unchanged. The notes are ('cmyk',), ('scale', width, height, new_width,
+    new_height) and (failure, traceback) for the keys of FAILURES.
+    '''
+    import traceback
+    from io import BytesIO
+
+    from PIL import Image
+
+    notes = []
+    try:
+        img = Image.open(BytesIO(raw))
+    except Exception:
+        return None, notes
+    width, height = img.size
+
+    try:
+        if check_colorspaces and img.mode == 'CMYK':
+            notes.append(('cmyk',))
+            img = img.convert('RGB')
+    except Exception:
+        notes.append(('convert', traceback.format_exc()))
+
+    scaled, new_width, new_height = fit_image(width, height, page_width, page_height)
+    if scaled:
+        new_width = max(1, new_width)
+        new_height = max(1, new_height)
+        notes.append(('scale', width, height, new_width, new_height))
+        try:
+            img = img.resize((new_width, new_height))
+        except Exception:
+            notes.append(('rescale', traceback.format_exc()))
+            return None, notes
+        buf = BytesIO()
+        try:
+            img.save(buf, ext)
+        except Exception:
+            notes.append(('rescale', traceback.format_exc()))
+        else:
+            return buf.getvalue(), notes
+    return None, notes
+
+
+def needs_rescale(raw, page_width, page_height, check_colorspaces=False):
+    '''
+    Whether rescale_image() could change the image raw, found from its
+    headers, without decoding it. True when the headers cannot be read.
+    '''
+    fmt, width, height, colorspace = probe(raw)
+    if fmt not in ('jpeg', 'png', 'gif', 'webp') or width < 0 or colorspace is None:
+        return True
+    if check_colorspaces and colorspace == 'cmyk':
+        return True
+    return fit_image(width, height, page_width, page_height)[0]
 
 
 class RescaleImages:
     'Rescale all images to fit inside given screen size'
 
-    def __init__(self, check_colorspaces=False):
+    def __init__(self, check_colorspaces=False, workers=1):
         self.check_colorspaces = check_colorspaces
+        # The number of threads used to process images, 0 for one per CPU
+        # core. Pillow releases the GIL while decoding, resizing and encoding.
+        self.workers = workers
 
     def __call__(self, oeb, opts, max_size: str = 'profile'):
         self.oeb, self.opts, self.log = oeb, opts, oeb.log
         self.rescale(max_size)
 
     def rescale(self, max_size: str = 'profile'):
-        from io import BytesIO
-
-        from PIL import Image
-
         is_image_collection = getattr(self.opts, 'is_image_collection', False)
 
         if is_image_collection:
@@ -49,48 +120,53 @@ class RescaleImages:
                 page_height = no_scale_size
             if page_height <= 0:
                 page_height = no_scale_size
-        for item in self.oeb.manifest:
-            if item.media_type.startswith('image'):
-                ext = item.media_type.split('/')[-1].upper()
-                if ext == 'JPG':
-                    ext = 'JPEG'
-                if ext not in ('PNG', 'JPEG', 'GIF'):
-                    ext = 'JPEG'
-
-                raw = item.data
-                if hasattr(raw, 'xpath') or not raw:
-                    # Probably an svg image
-                    continue
-                try:
-                    img = Image.open(BytesIO(raw))
-                except Exception:
-                    continue
-                width, height = img.size
-
-                try:
-                    if self.check_colorspaces and img.mode == 'CMYK':
-                        self.log.warn(
-                            f'The image {item.href} is in the CMYK colorspace, converting it '
-                            'to RGB as Adobe Digital Editions cannot display CMYK')
-                        img = img.convert('RGB')
-                except Exception:
-                    self.log.exception(f'Failed to convert image {item.href} from CMYK to RGB')
-
-                scaled, new_width, new_height = fit_image(width, height, page_width, page_height)
-                if scaled:
-                    new_width = max(1, new_width)
-                    new_height = max(1, new_height)
-                    self.log(f'Rescaling image from {width}x{height} to {new_width}x{new_height}', item.href)
-                    try:
-                        img = img.resize((new_width, new_height))
-                    except Exception:
-                        self.log.exception(f'Failed to rescale image: {item.href}')
+
+        def jobs():
+            for item in self.oeb.manifest:
+                if item.media_type.startswith('image'):
+                    ext = item.media_type.split('/')[-1].upper()
+                    if ext == 'JPG':
+                        ext = 'JPEG'
+                    if ext not in ('PNG', 'JPEG', 'GIF'):
+                        ext = 'JPEG'
+
+                    raw = item.data
+                    if hasattr(raw, 'xpath') or not raw:
+                        # Probably an svg image
+                        continue
+                    if not needs_rescale(raw, page_width, page_height, self.check_colorspaces):
                         continue
-                    buf = BytesIO()
-                    try:
-                        img.save(buf, ext)
-                    except Exception:
-                        self.log.exception(f'Failed to rescale image: {item.href}')
-                    else:
-                        item.data = buf.getvalue()
-                        item.unload_data_from_memory()
+                    yield item, (raw, ext, page_width, page_height, self.check_colorspaces)
+
+        workers = self.workers if self.workers > 0 else (os.cpu_count() or 1)
+        if workers == 1:
+            for item, args in jobs():
+                self.apply_result(item, *rescale_image(*args))
+            return
+        # Results are written back in manifest order, as soon as they and all
+        # the ones before them are done, and at most a few images per worker
+        # are held in memory at a time
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for item, args in jobs():
+                pending.append((item, executor.submit(rescale_image, *args)))
+                while pending and (len(pending) > 2 * workers or pending[0][1].done()):
+                    item, future = pending.popleft()
+                    self.apply_result(item, *future.result())
+            for item, future in pending:
+                self.apply_result(item, *future.result())
+
+    def apply_result(self, item, data, notes):
+        for kind, *values in notes:
+            if kind == 'cmyk':
+                self.log.warn(
+                    f'The image {item.href} is in the CMYK colorspace, converting it '
+                    'to RGB as Adobe Digital Editions cannot display CMYK')
+            elif kind == 'scale':
+                self.log('Rescaling image from {}x{} to {}x{}'.format(*values), item.href)
+            else:
+                self.log.error(FAILURES[kind].format(item.href))
+                self.log.debug(values[0])
+        if data is not None:
+            item.data = data
+            item.unload_data_from_memory()
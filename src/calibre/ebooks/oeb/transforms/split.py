@@ -15,6 +15,8 @@ import os
 import re
 from collections import OrderedDict
 from contextlib import suppress
+from itertools import accumulate
+from xml.parsers import expat
 
 from css_selectors import Select, SelectorError
 from lxml import etree
@@ -22,9 +24,9 @@ from lxml.etree import XPath as _XPath
 
 from calibre import as_unicode, force_unicode
 from calibre.ebooks.epub import rules
-from calibre.ebooks.oeb.base import OEB_STYLES, XHTML, rewrite_links, urldefrag, urlnormalize
+from calibre.ebooks.oeb.base import OEB_DOCS, OEB_STYLES, XHTML, Manifest, rewrite_links, urldefrag, urlnormalize
 from calibre.ebooks.oeb.base import XPNSMAP as NAMESPACES
-from calibre.ebooks.oeb.polish.split import do_split
+from calibre.ebooks.oeb.polish.split import adjust_split_point, do_split
 from polyglot.urllib import unquote
 
 XPath = functools.partial(_XPath, namespaces=NAMESPACES)
@@ -38,14 +40,156 @@ def tostring(root):
 
 class SplitError(ValueError):
 
-    def __init__(self, path, root):
-        size = len(tostring(root))/1024.
+    def __init__(self, path, root, size=None):
+        size = (len(tostring(root)) if size is None else size)/1024.
         ValueError.__init__(self,
             _('Could not find reasonable point at which to split: '
                 '%(path)s Sub-tree size: %(size)d KB')%{
                             'path': path, 'size': size})
 
 
+def has_text(text):
+    # The same as is_page_empty(), since \s matches what isspace() does
+    return bool(text) and not text.isspace()
+
+
+class SizeIndex:
+    '''
+    The byte offsets of all nodes in the serialization of the tree rooted at
+    ``root``, used to calculate the sizes of the two trees created by
+    splitting it before an element, and whether they are empty, without
+    splitting or serializing anything. Raises ValueError if the tree cannot
+    be indexed.
+    '''
+
+    def __init__(self, root):
+        bodies = root.xpath('//h:body', namespaces=NAMESPACES)
+        if len(bodies) != 1 or bodies[0].getparent() is not root:
+            raise ValueError('The tree does not have a single <body>')
+        self.root, self.body = root, bodies[0]
+        self.raw = tostring(root)
+        self.nodes = list(root.iter())
+        self.positions = {node: i for i, node in enumerate(self.nodes)}
+        # The offsets of the start of each node, of the end tag of each
+        # element and the position after the last descendant of each node
+        self.starts, self.end_tags, self.subtree_ends = [], [], []
+        self.shifts = []
+        self.xpath_cache = {}
+
+        parser, stack = expat.ParserCreate(), []
+
+        def start_element(name, attrs):
+            stack.append(len(self.starts))
+            leaf()
+
+        def end_element(name):
+            i = stack.pop()
+            self.end_tags[i] = parser.CurrentByteIndex
+            self.subtree_ends[i] = len(self.starts)
+
+        def leaf(*args):
+            self.starts.append(parser.CurrentByteIndex)
+            self.end_tags.append(None)
+            self.subtree_ends.append(len(self.starts))
+
+        parser.StartElementHandler, parser.EndElementHandler = start_element, end_element
+        parser.CommentHandler = parser.ProcessingInstructionHandler = leaf
+        try:
+            parser.Parse(self.raw, True)
+        except expat.ExpatError as err:
+            raise ValueError(f'Cannot index the serialized tree: {err}')
+        if len(self.starts) != len(self.nodes) or any(node.tag is etree.Entity for node in self.nodes):
+            raise ValueError('The serialized tree does not match the tree')
+
+        # Which nodes have text that is not whitespace and which are images
+        # or SVG, as used by is_page_empty()
+        texts, tails, media = [], [], []
+        img = XHTML('img')
+        for node in self.nodes:
+            tag = node.tag
+            if isinstance(tag, str):
+                texts.append(has_text(node.text))
+                media.append((tag == img and node.get('style', '') != 'display:none') or tag.rpartition('}')[2] == 'svg')
+            else:
+                texts.append(False)
+                media.append(False)
+            tails.append(has_text(node.tail))
+        self.tails, self.media = tails, media
+        # Prefix sums, so the counts for a range of nodes are a subtraction
+        self.texts_before = list(accumulate(map(int.__add__, texts, tails), initial=0))
+        self.media_before = list(accumulate(media, initial=0))
+
+    @property
+    def size(self):
+        return len(self.raw) + sum(delta for pos, delta in self.shifts)
+
+    def offset(self, pos):
+        return pos + sum(delta for start, delta in self.shifts if start < pos)
+
+    def start_tag_end(self, i):
+        return self.offset(self.raw.index(b'>', self.starts[i]) + 1)
+
+    def xpath(self, path):
+        ans = self.xpath_cache.get(path)
+        if ans is None:
+            ans = self.xpath_cache[path] = self.root.xpath(path, namespaces=NAMESPACES)
+        return ans
+
+    def set(self, elem, name, value):
+        ' Set an attribute on elem, updating the offsets of everything after its start tag '
+        def attr_size(value):
+            return 0 if value is None else len(tostring(etree.Element('x', {name: value}))) - len(b'<x/>')
+        delta = attr_size(value) - attr_size(elem.get(name))
+        elem.set(name, value)
+        if delta:
+            self.shifts.append((self.starts[self.positions[elem]], delta))
+
+    def split_sizes(self, split_point):
+        '''
+        Return the sizes of the trees created by splitting before
+        ``split_point`` with :func:`do_split` and whether each of them is
+        empty, or None if they cannot be calculated. ``split_point`` must
+        already have been adjusted with :func:`adjust_split_point`.
+        '''
+        body, positions, starts = self.body, self.positions, self.starts
+        chain, node = [], split_point
+        while node is not body:
+            parent = node.getparent()
+            if parent is None:
+                return None
+            chain.append((node, parent))
+            node = parent
+        if not chain or (body.text is None and body[0] is split_point):
+            # The split point is not in the body or the first tree would
+            # have an empty, self closing, <body>
+            return None
+
+        before = after = self.size
+        for child, parent in chain:
+            c, p = positions[child], positions[parent]
+            # The first tree loses everything from the split point, except the
+            # tails of its ancestors, the second tree everything before it,
+            # except the ancestors, whose text is replaced by a newline
+            end_tag = self.offset(self.end_tags[p])
+            if child is split_point:
+                before -= end_tag - self.offset(starts[c])
+            else:
+                sibling = child.getnext()
+                if sibling is not None:
+                    before -= end_tag - self.offset(starts[positions[sibling]])
+            after -= self.offset(starts[c]) - self.start_tag_end(p) - 1
+
+        i, b = positions[split_point], positions[body]
+        body_end, num = self.subtree_ends[b], len(self.nodes)
+        ancestors = [positions[parent] for child, parent in chain[:-1]]
+        texts, media = self.texts_before, self.media_before
+        before_empty = texts[i] - texts[b] == 0 and media[i] + media[num] - media[body_end] == 0
+        after_empty = (
+            self.tails[b] + texts[body_end] - texts[i] + sum(self.tails[a] for a in ancestors) == 0 and
+            media[b + 1] + media[num] - media[i] + sum(self.media[a] for a in ancestors) == 0)
+        return (before, after), (before_empty, after_empty)
+
+
 class Split:
 
     def __init__(self, split_on_page_breaks=True, page_breaks_xpath=None,
@@ -171,19 +315,22 @@ class Split:
         '''
         Fix references to the split files in other content files.
         '''
-        seen = set()
-        for item in self.oeb.manifest:
-            if etree.iselement(item.data):
-                self.current_item = item
-                rewrite_links(item.data, self.rewrite_links)
-                seen.add(item.data)
-        if self.existing_nav is not None and self.existing_nav not in seen:
-            seen.add(self.existing_nav)
-            from calibre.ebooks.oeb.base import rel_href
+        if not self.map:
+            return
+        links = self.oeb.links
+        items = set()
+        for href in self.map:
+            items |= links.referrers(href)
+        for item in items:
+            self.current_item = item
+            links.rewrite_links(item, self.rewrite_links)
+        if self.existing_nav is not None and all(
+                item.data is not self.existing_nav for item in self.oeb.manifest if item.media_type in OEB_DOCS):
             class FakeManifestItem:
                 href = self.nav_href
-                def abshref(self): return self.href
-                def relhref(self, href): return rel_href(self.href, href)
+                abshref = Manifest.Item.abshref
+                relhref = Manifest.Item.relhref
+            self.current_item = FakeManifestItem()
             rewrite_links(self.existing_nav, self.rewrite_links)
 
     def rewrite_links(self, url):
@@ -367,21 +514,40 @@ class FlowSplitter:
                 i = p.index(pre)
                 p[i:i+1] = new_pres
 
-        split_point, before = self.find_split_point(root)
-        if split_point is None:
-            raise SplitError(self.item.href, root)
-        self.log.debug('\t\t\tSplit point:', split_point.tag, tree.getpath(split_point))
-
-        trees = self.do_split(tree, split_point, before)
-        sizes = [len(tostring(t.getroot())) for t in trees]
-        if min(sizes) < 5*1024:
+        size_index, indexed = None, False
+        while True:
+            split_point, before = self.find_split_point(root, size_index)
+            if split_point is None:
+                raise SplitError(self.item.href, root, size=None if size_index is None else size_index.size)
+            self.log.debug('\t\t\tSplit point:', split_point.tag, tree.getpath(split_point))
+
+            trees, predicted = None, None
+            if before and size_index is not None:
+                split_point = adjust_split_point(split_point, self.log)
+                predicted = size_index.split_sizes(split_point)
+            if predicted is None:
+                trees = self.do_split(tree, split_point, before)
+                sizes, empty = [len(tostring(t.getroot())) for t in trees], (None, None)
+            else:
+                sizes, empty = predicted
+            if min(sizes) >= 5*1024:
+                break
             self.log.debug('\t\t\tSplit tree too small')
-            self.split_to_size(tree)
-            return
+            if not indexed:
+                # Splitting and serializing the whole tree for every split
+                # point that is tried is quadratic, so once the first one has
+                # failed, calculate the sizes from an index instead
+                indexed = True
+                try:
+                    size_index = SizeIndex(root)
+                except ValueError as err:
+                    self.log.debug(f'\t\t\tNot using a size index: {as_unicode(err)}')
+        if trees is None:
+            trees = self.do_split(tree, split_point, before)
 
-        for t, size in zip(trees, sizes):
+        for t, size, is_empty in zip(trees, sizes, empty):
             r = t.getroot()
-            if self.is_page_empty(r):
+            if self.is_page_empty(r) if is_empty is None else is_empty:
                 continue
             elif size <= self.max_flow_size:
                 self.split_trees.append(t)
@@ -392,7 +558,7 @@ class FlowSplitter:
                         f'\t\t\tSplit tree still too large: {size/1024.0} KB')
                 self.split_to_size(t)
 
-    def find_split_point(self, root):
+    def find_split_point(self, root, size_index=None):
         '''
         Find the tag at which to split the tree rooted at `root`.
         Search order is:
@@ -405,6 +571,8 @@ class FlowSplitter:
             * <li> tags
 
         We try to split in the "middle" of the file (as defined by tag counts.
+        If ``size_index`` is given, the candidates are cached in it and the
+        split point attribute is set through it.
         '''
         def pick_elem(elems):
             if elems:
@@ -412,7 +580,10 @@ class FlowSplitter:
                         '1']
                 if elems:
                     i = int(len(elems)//2)
-                    elems[i].set(SPLIT_POINT_ATTR, '1')
+                    if size_index is None:
+                        elems[i].set(SPLIT_POINT_ATTR, '1')
+                    else:
+                        size_index.set(elems[i], SPLIT_POINT_ATTR, '1')
                     return elems[i]
 
         for path in (
@@ -425,7 +596,7 @@ class FlowSplitter:
                      '//h:br',
                      '//h:li',
                      ):
-            elems = root.xpath(path, namespaces=NAMESPACES)
+            elems = root.xpath(path, namespaces=NAMESPACES) if size_index is None else size_index.xpath(path)
             elem = pick_elem(elems)
             if elem is not None:
                 try:
@@ -8,8 +8,6 @@ __copyright__ = '2008, Marshall T. Vandegrift <llasram@gmail.com>'
 
 from urllib.parse import urldefrag
 
-from calibre.ebooks.oeb.base import CSS_MIME, OEB_DOCS, iterlinks, urlnormalize
-
 
 class ManifestTrimmer:
 
@@ -22,7 +20,6 @@ class ManifestTrimmer:
         return cls()
 
     def __call__(self, oeb, context):
-        import css_parser
         oeb.logger.info('Trimming unused files from manifest...')
         self.opts = context
         used = set()
@@ -43,28 +40,10 @@ class ManifestTrimmer:
         while unchecked:
             new = set()
             for item in unchecked:
-                if (item.media_type in OEB_DOCS or
-                    item.media_type[-4:] in ('/xml', '+xml')) and \
-                   item.data is not None:
-                    hrefs = [r[2] for r in iterlinks(item.data)]
-                    for href in hrefs:
-                        if isinstance(href, bytes):
-                            href = href.decode('utf-8')
-                        try:
-                            href = item.abshref(urlnormalize(href))
-                        except Exception:
-                            continue
-                        if href in oeb.manifest.hrefs:
-                            found = oeb.manifest.hrefs[href]
-                            if found not in used:
-                                new.add(found)
-                elif item.media_type == CSS_MIME:
-                    for href in css_parser.getUrls(item.data):
-                        href = item.abshref(urlnormalize(href))
-                        if href in oeb.manifest.hrefs:
-                            found = oeb.manifest.hrefs[href]
-                            if found not in used:
-                                new.add(found)
+                for link in oeb.links.links_from(item):
+                    found = oeb.manifest.hrefs.get(link.href)
+                    if found is not None and found not in used:
+                        new.add(found)
             used.update(new)
             unchecked = new
         for item in oeb.manifest.values():
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+'''
+An on-disk cache of the results of transforming images, so that converting
+the same book again, or to another format, does not redo the work. Entries
+are addressed by the hash of the image data, the name of the transformation
+and its parameters. The least recently used entries are removed when the
+cache grows beyond its maximum size.
+
+The maximum size, in MB, is set with the CALIBRE_IMAGE_CACHE_SIZE environment
+variable, a size of 0 disables the cache.
+'''
+
+import hashlib
+import os
+import tempfile
+from contextlib import suppress
+from functools import wraps
+from threading import Lock
+
+from calibre.constants import cache_dir
+from calibre.utils.serialize import msgpack_dumps, msgpack_loads
+
+# Change this when a transformation changes, to ignore the entries created by
+# the previous version
+CACHE_VERSION = 2
+DEFAULT_MAX_SIZE = 256  # MB
+
+
+class ImageCache:
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE * 1024 * 1024):
+        self.path, self.max_size = path, max_size
+        self.lock = Lock()
+        self.current_size = None
+        self.hits = self.misses = 0
+
+    def key(self, data, operation, *params):
+        from PIL import __version__ as pillow_version
+        h = hashlib.sha256(data)
+        h.update(msgpack_dumps((CACHE_VERSION, pillow_version, operation, params)))
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        ' Return the cached value as a tuple of one item, or None if there is no entry for key '
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            # The modification times record the order in which entries were
+            # used, for eviction
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            ans = msgpack_loads(raw)
+        except Exception:
+            self.misses += 1
+            with suppress(OSError):
+                os.remove(path)
+            return None
+        self.hits += 1
+        return (ans,)
+
+    def set(self, key, value):
+        raw = msgpack_dumps(value)
+        path = self.entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written to a temporary file and renamed, so that other threads or
+            # processes never see a partial entry
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='tmp-', delete=False) as f:
+                f.write(raw)
+            os.replace(f.name, path)
+        except OSError:
+            with suppress(OSError, NameError):
+                os.remove(f.name)
+            return
+        with self.lock:
+            if self.current_size is None:
+                self.current_size = self.disk_size()
+            else:
+                self.current_size += len(raw)
+            if self.current_size > self.max_size:
+                self.evict()
+
+    def entries(self):
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                with suppress(OSError):
+                    yield path, os.stat(path)
+
+    def disk_size(self):
+        return sum(st.st_size for path, st in self.entries())
+
+    def evict(self):
+        ' Remove the least recently used entries, until the cache is down to three quarters of its maximum size '
+        entries = sorted(self.entries(), key=lambda x: x[1].st_mtime)
+        size = sum(st.st_size for path, st in entries)
+        target = self.max_size * 3 // 4
+        for path, st in entries:
+            if size <= target:
+                break
+            with suppress(OSError):
+                os.remove(path)
+                size -= st.st_size
+        self.current_size = size
+
+    def clear(self):
+        for path, st in tuple(self.entries()):
+            with suppress(OSError):
+                os.remove(path)
+        self.current_size = 0
+
+
+_image_cache = None
+
+
+def image_cache():
+    ' The cache shared by all conversions, or None if it is disabled '
+    global _image_cache
+    if _image_cache is None:
+        try:
+            max_size = float(os.environ.get('CALIBRE_IMAGE_CACHE_SIZE', DEFAULT_MAX_SIZE))
+        except ValueError:
+            max_size = DEFAULT_MAX_SIZE
+        _image_cache = ImageCache(os.path.join(cache_dir(), 'image-transforms'), int(max_size * 1024 * 1024)) if max_size > 0 else False
+    return _image_cache or None
+
+
+def cached_image_transform(operation, cacheable=lambda result: True):
+    '''
+    Cache the results of the decorated function, whose first argument is the
+    image data and whose other arguments are its parameters, under the name
+    operation. Exceptions are not cached and neither are results for which
+    cacheable() returns False. When the function returns the image data
+    itself, only that fact is cached, not a second copy of the image.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(data, *args, **kwargs):
+            cache = image_cache()
+            if cache is None or not isinstance(data, bytes):
+                return func(data, *args, **kwargs)
+            key = cache.key(data, operation, args, sorted(kwargs.items()))
+            ans = cache.get(key)
+            if ans is not None:
+                # Entries are (True,) for unchanged images and (False, result)
+                # otherwise
+                entry = ans[0]
+                return data if entry[0] else entry[1]
+            ans = func(data, *args, **kwargs)
+            if cacheable(ans):
+                cache.set(key, (True,) if ans is data else (False, ans))
+            return ans
+        return wrapper
+    return decorator
@@ -39,6 +39,15 @@ def identify(src):
     ''' Recognize file format and sizes. Returns format, width, height. width
     and height will be -1 if not found and fmt will be None if the image is not
     recognized. '''
+    return probe(src)[:3]
+
+
+def probe(src):
+    ''' Recognize file format, sizes and colorspace, reading only the headers
+    of the image, not decoding it. Returns format, width, height, colorspace.
+    The colorspace is one of gray, rgb, cmyk or palette, as for the mode Pillow
+    would open the image in, ignoring transparency. It is only found for JPEG,
+    PNG, GIF and WebP images and is None otherwise. '''
     needs_close = False
 
     if isinstance(src, str):
@@ -49,21 +58,27 @@ def identify(src):
     else:
         stream = src
     try:
-        return _identify(stream)
+        return _probe(stream)
     finally:
         if needs_close:
             stream.close()
 
 
-def _identify(stream):
+JPEG_COLORSPACES = {1: 'gray', 3: 'rgb', 4: 'cmyk'}
+# See the IHDR chunk in https://www.w3.org/TR/png/
+PNG_COLORSPACES = {0: 'gray', 2: 'rgb', 3: 'palette', 4: 'gray', 6: 'rgb'}
+
+
+def _probe(stream):
     width = height = -1
+    colorspace = None
 
     pos = stream.tell()
     head = stream.read(HSIZE)
     stream.seek(pos)
     fmt = what(None, head)
 
-    if fmt in {'jpeg', 'gif', 'png', 'jpeg2000'}:
+    if fmt in {'jpeg', 'gif', 'png', 'jpeg2000', 'webp'}:
         size = len(head)
         if fmt == 'png':
             # PNG
@@ -71,29 +86,55 @@ def _identify(stream):
             try:
                 width, height = unpack(b'>LL', s)
             except error:
-                return fmt, width, height
+                return fmt, width, height, colorspace
+            if size >= 26 and head[12:16] == b'IHDR':
+                colorspace = PNG_COLORSPACES.get(head[25])
         elif fmt == 'jpeg':
             # JPEG
             pos = stream.tell()
             try:
-                height, width = jpeg_dimensions(stream)
+                height, width, components = jpeg_frame_header(stream)
             except Exception:
-                return fmt, width, height
+                return fmt, width, height, colorspace
             finally:
                 stream.seek(pos)
+            colorspace = JPEG_COLORSPACES.get(components)
         elif fmt == 'gif':
             # GIF
             try:
                 width, height = unpack(b'<HH', head[6:10])
             except error:
-                return fmt, width, height
+                return fmt, width, height, colorspace
+            colorspace = 'palette'
+        elif fmt == 'webp':
+            # WebP, see https://developers.google.com/speed/webp/docs/riff_container
+            chunk = head[12:16]
+            try:
+                if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+                    # Lossy, the sizes have two bits of upscaling flags
+                    width, height = (x & 0x3fff for x in unpack(b'<HH', head[26:30]))
+                elif chunk == b'VP8L' and head[20] == 0x2f:
+                    # Lossless, the sizes minus one in 14 bits each
+                    bits = unpack(b'<L', head[21:25])[0]
+                    width, height = (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+                elif chunk == b'VP8X':
+                    # Extended, the canvas sizes minus one in 24 bits each
+                    if size < 30:
+                        return fmt, width, height, colorspace
+                    width = int.from_bytes(head[24:27], 'little') + 1
+                    height = int.from_bytes(head[27:30], 'little') + 1
+                else:
+                    return fmt, width, height, colorspace
+            except (error, IndexError):
+                return fmt, width, height, colorspace
+            colorspace = 'rgb'
         elif size >= 56 and fmt == 'jpeg2000':
             # JPEG2000
             try:
                 height, width = unpack(b'>LL', head[48:56])
             except error:
-                return fmt, width, height
-    return fmt, width, height
+                return fmt, width, height, colorspace
+    return fmt, width, height, colorspace
 
 # ---------------------------------#
 # Subroutines per image file type #
@@ -122,6 +163,11 @@ def jpeg(h):
 
 
 def jpeg_dimensions(stream):
+    return jpeg_frame_header(stream)[:2]
+
+
+def jpeg_frame_header(stream):
+    # Returns the height, width and number of color components of the image
     # A JPEG marker is two bytes of the form 0xff x where 0 < x < 0xff
     # See section B.1.1.2 of https://www.w3.org/Graphics/JPEG/itu-t81.pdf
     # We read the dimensions from the first SOFn section we come across
@@ -149,11 +195,11 @@ def jpeg_dimensions(stream):
         if 0xc0 <= q <= 0xcf and q not in {0xc4, 0xcc}:
             # SOFn marker
             stream.seek(3, os.SEEK_CUR)
-            return unpack(b'>HH', read(4))
+            return unpack(b'>HHB', read(5))
         elif 0xd8 <= q <= 0xda:
             break  # start of image, end of image, start of scan, no point
         elif q == 0:
-            return -1, -1  # Corrupted JPEG
+            return -1, -1, 0  # Corrupted JPEG
         elif q == 0x01 or 0xd0 <= q <= 0xd7:
             # Standalone marker
             continue
@@ -163,7 +209,7 @@ def jpeg_dimensions(stream):
             stream.seek(size - 2, os.SEEK_CUR)
         # standalone marker, keep going
 
-    return -1, -1
+    return -1, -1, 0
 
 
 @test
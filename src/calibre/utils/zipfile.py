@@ -67,6 +67,8 @@ class LargeZipFile(Exception):
 error = BadZipfile      # The exception raised by this module
 
 ZIP64_LIMIT = (1 << 31) - 1
+# Upper bound on the compressed data held in memory by the parallel writer
+PARALLEL_MEMORY_LIMIT = 64 * 1024 * 1024
 ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
 ZIP_MAX_COMMENT = (1 << 16) - 1
 
@@ -76,6 +78,18 @@ ZIP_DEFLATED = 8
 # Other ZIP compression methods not supported
 # For a list see: http://www.winzip.com/wz54.htm
 
+# Files that do not shrink when deflated and are stored without trying when
+# store_incompressible is set. Images are not included, PNG, JPEG and GIF files
+# often still deflate usefully, they are stored only if MAX_DEFLATE_RATIO is
+# not met.
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    'woff2', 'mp3', 'm4a', 'aac', 'ogg', 'oga', 'opus', 'mp4', 'm4v', 'webm', 'ogv',
+    'zip', 'gz', 'bz2', 'xz', 'epub', 'docx', 'odt',
+))
+# When store_incompressible is set, members that deflate to more than this
+# fraction of their size are stored instead
+MAX_DEFLATE_RATIO = 0.98
+
 # Below are some formats and associated data for reading/writing headers using
 # the struct module.  The names and structures of headers/records are those used
 # in the PKWARE description of the ZIP file format:
@@ -324,6 +338,7 @@ class ZipInfo:
         '_raw_time',
         'comment',
         'compress_size',
+        'compress_time',
         'compress_type',
         'create_system',
         'create_version',
@@ -379,6 +394,7 @@ class ZipInfo:
         self.internal_attr = 0          # Internal attributes
         self.external_attr = 0          # External file attributes
         self.file_offset   = 0
+        self.compress_time = 0          # Seconds spent compressing the file
         # Other attributes are set by class ZipFile:
         # header_offset         Byte offset to the file header
         # CRC                   CRC-32 of the uncompressed file
@@ -754,6 +770,52 @@ class ZipExtFile(io.BufferedIOBase):
         return raw
 
 
+# These compress a single file for the parallel writer and for
+# store_incompressible. zlib releases the GIL so they can run on a thread pool.
+# They return (compress type, CRC, file size, compressed size, data, seconds).
+# With max_ratio, data that does not deflate to less than max_ratio of its size
+# is stored instead.
+
+def _compress_bytes(byts, compress_type, level, max_ratio=None):
+    st = time.perf_counter()
+    crc = crc32(byts) & 0xffffffff
+    file_size = len(byts)
+    data = byts
+    if compress_type == ZIP_DEFLATED:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = co.compress(byts) + co.flush()
+        if max_ratio is not None and len(data) >= max_ratio * file_size:
+            compress_type, data = ZIP_STORED, byts
+    return compress_type, crc, file_size, len(data), data, time.perf_counter() - st
+
+
+def _compress_file(filename, compress_type, level, spill_size, max_ratio=None):
+    # Compressed data larger than spill_size is spooled to a temporary file
+    st = time.perf_counter()
+    out = SpooledTemporaryFile(max_size=spill_size)
+    crc = file_size = 0
+    co = zlib.compressobj(level, zlib.DEFLATED, -15) if compress_type == ZIP_DEFLATED else None
+    with open(filename, 'rb') as fp:
+        while True:
+            buf = fp.read(1024 * 1024)
+            if not buf:
+                break
+            file_size += len(buf)
+            crc = crc32(buf, crc) & 0xffffffff
+            out.write(co.compress(buf) if co else buf)
+        if co:
+            out.write(co.flush())
+            if max_ratio is not None and out.tell() >= max_ratio * file_size:
+                compress_type = ZIP_STORED
+                out.seek(0)
+                out.truncate()
+                fp.seek(0)
+                shutil.copyfileobj(fp, out)
+    compress_size = out.tell()
+    out.seek(0)
+    return compress_type, crc, file_size, compress_size, out, time.perf_counter() - st
+
+
 class ZipFile:
     ''' Class with methods to open, read, write, close, list and update zip files.
 
@@ -766,12 +828,26 @@ class ZipFile:
     allowZip64: if True ZipFile will create files with ZIP64 extensions when
                 needed, otherwise it will raise an exception when this would
                 be necessary.
+    workers: The number of threads used to compress the files added with
+             write(), writestr() and add_dir(). With more than one, files
+             are compressed in parallel and appended to the archive in the
+             order they were added, 0 means one thread per CPU.
+    memory_limit: The maximum number of bytes of compressed data the
+                  parallel writer keeps in memory, larger files are spooled
+                  to temporary files.
+    compresslevel: The zlib compression level used for deflated files, from
+                   1 (fastest) to 9 (smallest). 0 stores all files.
+    store_incompressible: If True, files with the extensions in
+                          INCOMPRESSIBLE_EXTENSIONS and files that barely
+                          shrink when deflated are stored instead.
 
     '''
 
     fp = None                   # Set here since __del__ checks it
+    _pending = ()
 
-    def __init__(self, file, mode='r', compression=ZIP_DEFLATED, allowZip64=True):
+    def __init__(self, file, mode='r', compression=ZIP_DEFLATED, allowZip64=True, workers=1, memory_limit=PARALLEL_MEMORY_LIMIT,
+                 compresslevel=zlib.Z_DEFAULT_COMPRESSION, store_incompressible=False):
         '''Open the ZIP file with mode read "r", write "w" or append "a".'''
         if mode not in ('r', 'w', 'a'):
             raise RuntimeError(f'ZipFile() requires mode "r", "w", or "a" not {mode}')
@@ -788,6 +864,15 @@ class ZipFile:
         self.mode = key = mode.replace('b', '')[0]
         self.pwd = None
         self.comment = b''
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        self.workers, self.memory_limit = workers, memory_limit
+        self.compresslevel, self.store_incompressible = compresslevel, store_incompressible
+        self._executor = None
+        # Files being compressed in parallel, in the order they were added, as
+        # (zinfo, future, number of bytes they hold in memory)
+        self._pending = []
+        self._pending_size = 0
 
         # Check if we were passed a file-like object
         if isinstance(file, (str, bytes)):
@@ -952,6 +1037,7 @@ class ZipFile:
     def replace(self, filename, arcname=None, compress_type=None):
         '''Delete arcname, and put the bytes from filename into the
         archive under the name arcname.'''
+        self.flush_pending()
         deleteName = arcname
         if deleteName is None:
             deleteName = filename
@@ -967,6 +1053,7 @@ class ZipFile:
     def delete(self, name):
         '''Delete the file from the archive. If it appears multiple
         times only the first instance will be deleted.'''
+        self.flush_pending()
         for i in range(len(self.filelist)):
             if self.filelist[i].filename == name:
                 if self.debug:
@@ -1003,6 +1090,7 @@ class ZipFile:
 
     def namelist(self):
         '''Return a list of file names in the archive.'''
+        self.flush_pending()
         l = []
         for data in self.filelist:
             l.append(data.filename)
@@ -1011,10 +1099,12 @@ class ZipFile:
     def infolist(self):
         '''Return a list of class ZipInfo instances for files in the
         archive.'''
+        self.flush_pending()
         return self.filelist
 
     def printdir(self):
         '''Print a table of contents for the zip file.'''
+        self.flush_pending()
         print(f"{'File Name':<46} {'Modified    ':>19} {'Size':>12}")
         for zinfo in self.filelist:
             date = (f'{zinfo.date_time[0]}-{zinfo.date_time[1]:02}-{zinfo.date_time[2]:02} '
@@ -1036,6 +1126,7 @@ class ZipFile:
 
     def getinfo(self, name):
         '''Return the instance of ZipInfo given 'name'.'''
+        self.flush_pending()
         info = self.NameToInfo.get(name)
         if info is None:
             raise KeyError(
@@ -1064,6 +1155,7 @@ class ZipFile:
         if not self.fp:
             raise RuntimeError(
                   'Attempt to read ZIP archive that was already closed')
+        self.flush_pending()
 
         # Make sure we have an info object
         if isinstance(name, ZipInfo):
@@ -1280,6 +1372,64 @@ class ZipFile:
             if not self._allowZip64:
                 raise LargeZipFile('Zipfile size would require ZIP64 extensions')
 
+    def _compress_type_for(self, zinfo):
+        if zinfo.compress_type == ZIP_DEFLATED and (self.compresslevel == 0 or (
+                self.store_incompressible and zinfo.filename.rpartition('.')[-1].lower() in INCOMPRESSIBLE_EXTENSIONS)):
+            return ZIP_STORED
+        return zinfo.compress_type
+
+    def _submit(self, zinfo, size, func, *args):
+        '''Compress a file on the thread pool, size is an upper bound on the
+        memory it needs until it is written to the archive. Without a thread
+        pool the file is compressed and written immediately.'''
+        if self.mode not in ('w', 'a'):
+            raise RuntimeError('write() requires mode "w" or "a"')
+        if self.workers < 2:
+            self.flush_pending()
+            self._write_member(zinfo, func(*args))
+            return
+        while self._pending and self._pending_size + size > self.memory_limit:
+            self._write_next_pending()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ZipFile-')
+        self._pending.append((zinfo, self._executor.submit(func, *args), size))
+        self._pending_size += size
+
+    def _write_next_pending(self):
+        zinfo, future, size = self._pending.pop(0)
+        self._pending_size -= size
+        self._write_member(zinfo, future.result())
+
+    def _write_member(self, zinfo, result):
+        zinfo.compress_type, zinfo.CRC, zinfo.file_size, zinfo.compress_size, data, zinfo.compress_time = result
+        zinfo.header_offset = self.fp.tell()    # Start of header bytes
+        self._writecheck(zinfo)
+        self._didModify = True
+        self.fp.write(zinfo.FileHeader())
+        if isinstance(data, bytes):
+            self.fp.write(data)
+        else:
+            with data:
+                shutil.copyfileobj(data, self.fp)
+        if zinfo.flag_bits & 0x08:
+            # Write CRC and file sizes after the file data
+            self.fp.write(struct.pack('<LLL', zinfo.CRC, zinfo.compress_size,
+                  zinfo.file_size))
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
+
+    def flush_pending(self):
+        '''Wait for the files being compressed in parallel and append them to
+        the archive. Called automatically before anything that needs the
+        archive to be complete.'''
+        try:
+            while self._pending:
+                self._write_next_pending()
+        finally:
+            for zinfo, future, size in self._pending:
+                future.cancel()
+            self._pending, self._pending_size = [], 0
+
     def write(self, filename, arcname=None, compress_type=None):
         '''Put the bytes from filename into the archive under the name
         arcname.'''
@@ -1310,8 +1460,16 @@ class ZipFile:
         else:
             zinfo.compress_type = compress_type
 
+        zinfo.compress_type = self._compress_type_for(zinfo)
+
         zinfo.file_size = st.st_size
         zinfo.flag_bits = 0x00
+        if (self.workers > 1 or self.store_incompressible) and not isdir:
+            spill_size = max(self.memory_limit // (2 * self.workers), 1)
+            self._submit(zinfo, min(st.st_size, spill_size), _compress_file, filename, zinfo.compress_type,
+                         self.compresslevel, spill_size, MAX_DEFLATE_RATIO if self.store_incompressible else None)
+            return
+        self.flush_pending()
         zinfo.header_offset = self.fp.tell()    # Start of header bytes
 
         self._writecheck(zinfo)
@@ -1333,7 +1491,7 @@ class ZipFile:
             zinfo.file_size = file_size = 0
             self.fp.write(zinfo.FileHeader())
             if zinfo.compress_type == ZIP_DEFLATED:
-                cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                cmpr = zlib.compressobj(self.compresslevel,
                     zlib.DEFLATED, -15)
             else:
                 cmpr = None
@@ -1388,6 +1546,13 @@ class ZipFile:
             raise RuntimeError(
                   'Attempt to write to ZIP archive that was already closed')
 
+        if not raw_bytes:
+            zinfo.compress_type = self._compress_type_for(zinfo)
+        if (self.workers > 1 or self.store_incompressible) and not raw_bytes:
+            self._submit(zinfo, 2 * len(byts), _compress_bytes, byts, zinfo.compress_type,
+                         self.compresslevel, MAX_DEFLATE_RATIO if self.store_incompressible else None)
+            return
+        self.flush_pending()
         if not raw_bytes:
             zinfo.file_size = len(byts)            # Uncompressed size
         zinfo.header_offset = self.fp.tell()    # Start of header bytes
@@ -1396,7 +1561,7 @@ class ZipFile:
         if not raw_bytes:
             zinfo.CRC = crc32(byts) & 0xffffffff       # CRC-32 checksum
             if zinfo.compress_type == ZIP_DEFLATED:
-                co = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                co = zlib.compressobj(self.compresslevel,
                     zlib.DEFLATED, -15)
                 byts = co.compress(byts) + co.flush()
                 zinfo.compress_size = len(byts)    # Compressed size
@@ -1440,6 +1605,13 @@ class ZipFile:
         if self.fp is None:
             return
 
+        try:
+            self.flush_pending()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
         if self.mode in ('w', 'a') and self._didModify:  # write ending records
             count = 0
             pos1 = self.fp.tell()
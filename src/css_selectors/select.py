@@ -9,7 +9,6 @@ import itertools
 import re
 from collections import OrderedDict, defaultdict
 from functools import wraps
-from itertools import chain
 
 from lxml import etree
 
@@ -56,6 +55,18 @@ class AlwaysIn:
 always_in = AlwaysIn()
 
 
+class Memo(dict):
+
+    ' A dict of the results of func, calculated as needed '
+
+    def __init__(self, func):
+        self.func = func
+
+    def __missing__(self, key):
+        self[key] = ans = self.func(key)
+        return ans
+
+
 def trace_wrapper(func):
     @wraps(func)
     def trace(*args, **kwargs):
@@ -167,11 +178,19 @@ class Select:
         self._attrib_map = None
         self._attrib_space_map = None
         self._lang_map = None
+        self._matchers = {}
+        # Positions of tags among their siblings, built one parent at a time
+        self._child_positions = {}
+        self._type_positions = {}
         self.map_tag_name = ascii_lower
         if '{' in self.root.tag:
             def map_tag_name(x):
                 return ascii_lower(x.rpartition('}')[2])
             self.map_tag_name = map_tag_name
+        # Lower cased tag, attribute and class names for the compiled matchers
+        self._names = Memo(self.map_tag_name)
+        self._lowered = Memo(ascii_lower)
+        self._class_names = Memo(lambda val: frozenset(ascii_lower(val).split()))
 
     def __call__(self, selector, root=None):
         ''' Return an iterator over all matching tags, in document order.
@@ -179,10 +198,16 @@ class Select:
         specify root, then only tags that are root or descendants of root are
         returned. Note that this can be very expensive if root has a lot of
         descendants. '''
+        yield from self.iterparsedselectors(get_parsed_selector(selector), root=root)
+
+    def iterparsedselectors(self, parsed_selectors, root=None):
+        ''' Same as calling this object, except that it takes the result of
+        :func:`css_selectors.parse` instead of a selector string. Useful to
+        avoid re-parsing selectors that are used with many trees. '''
         seen = set()
         if root is not None:
             root = frozenset(self.itertag(root))
-        for parsed_selector in get_parsed_selector(selector):
+        for parsed_selector in parsed_selectors:
             for item in self.iterparsedselector(parsed_selector):
                 if item not in seen and (root is None or item in root):
                     yield item
@@ -193,6 +218,31 @@ class Select:
         for elem in self(selector, root=root):
             return True
         return False
+
+    def matcher(self, selector):
+        ''' Return a function that takes a tag from the tree and returns True iff
+        the tag matches selector. The selector is compiled into tests that are
+        applied from right to left, the way browsers match selectors, starting
+        with the rightmost compound selector, so most tags are rejected by its
+        first test. Use this instead of calling this object when you need to
+        know if particular tags match, rather than finding all matching tags.
+        Only pass tags to the function, not comments or processing
+        instructions, as from ``root.iter('*')``. '''
+        try:
+            return self._matchers[selector]
+        except KeyError:
+            self._matchers[selector] = ans = self.bind_test(get_compiled_selector(self, selector))
+            return ans
+
+    def parsed_matcher(self, parsed_selectors):
+        ''' Same as :meth:`matcher`, except that it takes the result of
+        :func:`css_selectors.parse` instead of a selector string. '''
+        return self.bind_test(compile_parsed_selectors(self, parsed_selectors))
+
+    def bind_test(self, test):
+        if test is None:
+            return lambda elem: True
+        return lambda elem: test(self, elem)
     # }}}
 
     def iterparsedselector(self, parsed_selector):
@@ -302,12 +352,13 @@ class Select:
         if parent is None:
             raise ValueError('Child has no parent')
         if same_type:
-            siblings = OrderedSet(child.itersiblings(preceding=before))
-            return len(self.element_map[self.map_tag_name(child.tag)] & siblings)
-        else:
-            if before:
-                return parent.index(child)
-            return len(parent) - parent.index(child) - 1
+            if child is self.root:
+                # The siblings of root are not part of the tree
+                return 0
+            pos, counts = self.type_positions(parent)[child]
+            return pos if before else counts[self.map_tag_name(child.tag)] - pos - 1
+        pos = self.child_positions(parent)[child]
+        return pos if before else len(parent) - pos - 1
 
     def all_sibling_count(self, child, same_type=False):
         ' Return the number of siblings of child or raise ValueError if child has no parent '
@@ -315,11 +366,38 @@ class Select:
         if parent is None:
             raise ValueError('Child has no parent')
         if same_type:
-            siblings = OrderedSet(chain(child.itersiblings(preceding=False), child.itersiblings(preceding=True)))
-            return len(self.element_map[self.map_tag_name(child.tag)] & siblings)
+            if child is self.root:
+                return 0
+            counts = self.type_positions(parent)[child][1]
+            return counts[self.map_tag_name(child.tag)] - 1
         else:
             return len(parent) - 1
 
+    def child_positions(self, parent):
+        ' Return a map of the children of parent to their indices, as from parent.index() '
+        try:
+            return self._child_positions[parent]
+        except KeyError:
+            self._child_positions[parent] = ans = {c:i for i, c in enumerate(parent)}
+            return ans
+
+    def type_positions(self, parent):
+        ''' Return a map of the child tags of parent to (index, counts), where
+        index is the index of the tag among the children of the same type and
+        counts maps tag names to the number of children with that name. '''
+        try:
+            return self._type_positions[parent]
+        except KeyError:
+            pass
+        counts = defaultdict(int)
+        self._type_positions[parent] = ans = {}
+        map_tag_name = self.map_tag_name
+        for c in self.iterchildren(parent):
+            name = map_tag_name(c.tag)
+            ans[c] = (counts[name], counts)
+            counts[name] += 1
+        return ans
+
     def is_empty(self, elem):
         ' Return True iff elem has no child tags and no text content '
         for child in elem:
@@ -681,6 +759,284 @@ def select_empty(cache, elem):
     return cache.is_empty(elem)
 
 
+# }}}
+
+# Matchers {{{
+
+# The functions below compile parsed selectors into tests, for
+# Select.matcher(). A test takes the Select object and a tag and returns True
+# iff the tag matches, it does not depend on the tree, so that it can be
+# reused for every tree. A test of None matches every tag.
+
+COMPILE_CACHE_SIZE = 4096
+compile_cache = OrderedDict()
+
+
+def get_compiled_selector(cache, selector):
+    ' The tests for the selector string, compiled once for all trees '
+    if cache.dispatch_map is not default_dispatch_map:
+        return compile_parsed_selectors(cache, get_parsed_selector(selector))
+    key = selector, cache.ignore_inappropriate_pseudo_classes
+    try:
+        return compile_cache[key]
+    except KeyError:
+        compile_cache[key] = ans = compile_parsed_selectors(cache, get_parsed_selector(selector))
+        if len(compile_cache) > COMPILE_CACHE_SIZE:
+            compile_cache.pop(next(iter(compile_cache)))
+        return ans
+
+
+def compile_parsed_selectors(cache, parsed_selectors):
+    tests = tuple(compile_parsed_selector(cache, parsed_selector) for parsed_selector in parsed_selectors)
+    if None in tests:
+        return None
+    if len(tests) == 1:
+        return tests[0]
+
+    def test(cache, elem):
+        for t in tests:
+            if t(cache, elem):
+                return True
+        return False
+    return test
+
+
+def all_of(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return lambda cache, elem: first(cache, elem) and second(cache, elem)
+
+
+def never(cache, elem):
+    return False
+
+
+def compile_parsed_selector(cache, parsed_selector):
+    type_name = type(parsed_selector).__name__
+    try:
+        func = compile_map[ascii_lower(type_name)]
+    except KeyError:
+        raise ExpressionError('%s is not supported' % type_name)
+    return func(cache, parsed_selector)
+
+
+def compile_pseudo_func(func):
+    if func is allow_all:
+        return None
+    return lambda cache, elem: func(cache, elem)
+
+
+def compile_selector(cache, selector):
+    test = compile_parsed_selector(cache, selector.parsed_tree)
+    if selector.pseudo_element is None:
+        return test
+    if isinstance(selector.pseudo_element, FunctionalPseudoElement):
+        raise ExpressionError(
+            "The pseudo-element ::%s is not supported" % selector.pseudo_element.name)
+    return all_of(test, compile_pseudo_func(get_func_for_pseudo(cache, selector.pseudo_element)))
+
+
+def compile_combinedselector(cache, combined):
+    combinator = cache.combinator_mapping[combined.combinator]
+    # The rightmost part is tested first, so that the tree is only walked
+    # for the tags that match it
+    right = compile_parsed_selector(cache, combined.subselector)
+    left = compile_parsed_selector(cache, combined.selector)
+    return all_of(right, combinator_matchers[combinator](left))
+
+
+def match_descendant(left):
+    def test(cache, elem):
+        root = cache.root
+        while elem is not root:
+            elem = elem.getparent()
+            if elem is None:
+                return False
+            if left is None or left(cache, elem):
+                return True
+        return False
+    return test
+
+
+def match_child(left):
+    def test(cache, elem):
+        if elem is cache.root:
+            return False
+        parent = elem.getparent()
+        return parent is not None and (left is None or left(cache, parent))
+    return test
+
+
+def match_direct_adjacent(left):
+    def test(cache, elem):
+        if elem is not cache.root:
+            for sibling in cache.itersiblings(elem, preceding=True):
+                return left is None or left(cache, sibling)
+        return False
+    return test
+
+
+def match_indirect_adjacent(left):
+    def test(cache, elem):
+        if elem is not cache.root:
+            for sibling in cache.itersiblings(elem, preceding=True):
+                if left is None or left(cache, sibling):
+                    return True
+        return False
+    return test
+
+
+combinator_matchers = {
+    'descendant': match_descendant,
+    'child': match_child,
+    'direct_adjacent': match_direct_adjacent,
+    'indirect_adjacent': match_indirect_adjacent,
+}
+
+
+def compile_element(cache, selector):
+    element = selector.element
+    if not element or element == '*':
+        return None
+    name = ascii_lower(element)
+    return lambda cache, elem: cache._names[elem.tag] == name
+
+
+def compile_hash(cache, selector):
+    name = ascii_lower(selector.id)
+
+    def test(cache, elem):
+        val = elem.get('id')
+        return val is not None and cache._lowered[val] == name
+    return all_of(test, compile_parsed_selector(cache, selector.selector))
+
+
+def compile_class(cache, selector):
+    name = ascii_lower(selector.class_name)
+
+    def test(cache, elem):
+        val = elem.get('class')
+        return val is not None and name in cache._class_names[val]
+    return all_of(test, compile_parsed_selector(cache, selector.selector))
+
+
+def compile_negation(cache, selector):
+    exclude = compile_parsed_selector(cache, selector.subselector)
+    if exclude is None:
+        return never
+    return all_of(compile_parsed_selector(cache, selector.selector), lambda cache, elem: not exclude(cache, elem))
+
+
+def compile_attrib(cache, selector):
+    operator = cache.attribute_operator_mapping[selector.operator]
+    name, value = ascii_lower(selector.attrib), selector.value
+    if operator == 'exists':
+        def value_test(val):
+            return True
+    elif operator == 'equals':
+        def value_test(val):
+            return val == value
+    elif operator == 'includes' and is_non_whitespace(value):
+        def value_test(val):
+            return value in val.split()
+    elif operator == 'dashmatch' and value:
+        prefix = value + '-'
+
+        def value_test(val):
+            return val == value or val.startswith(prefix)
+    elif operator == 'prefixmatch' and value:
+        def value_test(val):
+            return val.startswith(value)
+    elif operator == 'suffixmatch' and value:
+        def value_test(val):
+            return val.endswith(value)
+    elif operator == 'substringmatch' and value:
+        def value_test(val):
+            return value in val
+    else:
+        return never
+
+    def test(cache, elem):
+        # Attribute names are mapped the same way as tag names
+        names = cache._names
+        for attr, val in iteritems(elem.attrib):
+            if names[attr] == name and value_test(val):
+                return True
+        return False
+    return all_of(test, compile_parsed_selector(cache, selector.selector))
+
+
+def compile_function(cache, function):
+    fname = function.name.replace('-', '_')
+    try:
+        func = cache.dispatch_map[fname]
+    except KeyError:
+        raise ExpressionError(
+            "The pseudo-class :%s() is unknown" % function.name)
+    if fname == 'lang':
+        test = compile_lang(function)
+    else:
+        function.parsed_arguments  # Report invalid arguments now, rather than when matching
+
+        def test(cache, elem):
+            return func(cache, function, elem)
+    return all_of(compile_parsed_selector(cache, function.selector), test)
+
+
+def compile_lang(function):
+    if function.argument_types() not in (['STRING'], ['IDENT']):
+        raise ExpressionError("Expected a single string or ident for :lang(), got %r" % function.arguments)
+    lang = function.arguments[0].value
+    if not lang:
+        return never
+    lang = ascii_lower(lang)
+    lp = lang + '-'
+
+    def test(cache, elem):
+        # The language of the closest tag with a lang attribute, as for lang_map
+        root = cache.root
+        langs = None
+        while elem is not None:
+            val = elem.get('lang')
+            if val:
+                langs = normalize_language_tag(val)
+                break
+            if elem is root:
+                break
+            elem = elem.getparent()
+        if langs is None:
+            if not cache.default_lang:
+                return False
+            langs = normalize_language_tag(cache.default_lang)
+        for tlang in langs:
+            if tlang == lang or tlang.startswith(lp):
+                return True
+        return False
+    return test
+
+
+def compile_pseudo(cache, pseudo):
+    func = get_func_for_pseudo(cache, pseudo.ident)
+    if func is select_root:
+        # As for select_pseudo(), the rest of the compound selector is ignored
+        return compile_pseudo_func(func)
+    return all_of(compile_parsed_selector(cache, pseudo.selector), compile_pseudo_func(func))
+
+
+compile_map = {
+    'selector': compile_selector,
+    'combinedselector': compile_combinedselector,
+    'element': compile_element,
+    'hash': compile_hash,
+    'class': compile_class,
+    'negation': compile_negation,
+    'attrib': compile_attrib,
+    'function': compile_function,
+    'pseudo': compile_pseudo,
+}
+
 # }}}
 
 default_dispatch_map = {name.partition('_')[2]:obj for name, obj in globals().items() if name.startswith('select_') and callable(obj)}
@@ -7,6 +7,7 @@ __copyright__ = '2015, Kovid Goyal <kovid at kovidgoyal.net>'
 
 import argparse
 import sys
+import time
 import unittest
 
 from lxml import etree, html
@@ -655,10 +656,17 @@ by William Shakespeare
             for elem in select(selector):
                 yield elem.get('id')
 
+        def match_ids(selector):
+            matches = select.matcher(selector)
+            for elem in document.iter():
+                if matches(elem):
+                    yield elem.get('id')
+
         def pcss(main, *selectors, **kwargs):
             result = list(select_ids(main))
-            for selector in selectors:
+            for selector in (main,) + selectors:
                 self.ae(list(select_ids(selector)), result)
+                self.ae(list(match_ids(selector)), result)
             return result
         all_ids = pcss('*')
         self.ae(all_ids[:6], [
@@ -740,15 +748,23 @@ by William Shakespeare
         self.ae(pcss(r'[h\a0 ref]', r'[h\]ref]'), [])
 
         self.assertRaises(ExpressionError, lambda : tuple(select('body:nth-child')))
+        self.assertRaises(ExpressionError, select.matcher, 'body:nth-child')
+        self.assertRaises(ExpressionError, select.matcher, 'li:nth-child(foo)')
+        self.assertRaises(ExpressionError, select.matcher, 'p:hover')
+        self.assertIs(select.matcher('li'), select.matcher('li'))
 
         select = Select(document, ignore_inappropriate_pseudo_classes=True)
         self.assertGreater(len(tuple(select('p:hover'))), 0)
+        self.ae(list(match_ids('p:hover')), list(select_ids('p:hover')))
 
     def test_select_shakespeare(self):
         document = html.document_fromstring(self.HTML_SHAKESPEARE)
         select = Select(document)
         def count(s):
-            return sum(1 for r in select(s))
+            ans = sum(1 for r in select(s))
+            matches = select.matcher(s)
+            self.ae(sum(1 for elem in document.iter() if matches(elem)), ans)
+            return ans
 
         # Data borrowed from http://mootools.net/slickspeed/
 
@@ -798,6 +814,34 @@ by William Shakespeare
         assert count('div[class|=dialog]') == 50  # ? Seems right
         assert count('div[class~=dialog]') == 51  # ? Seems right
 
+    def test_select_large_document(self):
+        # Structural pseudo-classes must not be quadratic in the number of siblings
+        num = 20000
+        document = html.document_fromstring('<body>%s</body>' % ''.join(
+            '<p>%d</p><div>%d</div>' % (i, i) for i in range(num)))
+        select = Select(document)
+        start = time.monotonic()
+
+        def count(s):
+            matches = select.matcher(s)
+            ans = sum(1 for elem in document.iter('*') if matches(elem))
+            self.ae(sum(1 for r in select(s)), ans)
+            return ans
+
+        self.ae(count('p:nth-child(3n+1)'), (num + 2) // 3)
+        self.ae(count('p:nth-last-child(3)'), 1)
+        self.ae(count('p:nth-of-type(odd)'), num // 2)
+        self.ae(count('div:nth-last-of-type(2n)'), num // 2)
+        self.ae(count('p:first-of-type, div:last-of-type'), 2)
+        self.ae(count('body > :last-child'), 1)
+        self.ae(count('p:only-of-type'), 0)
+        self.ae(count('body:only-of-type'), 1)
+        self.assertLess(time.monotonic() - start, 30)
+        select.invalidate_caches()
+        document.find('body').append(document.makeelement('p'))
+        self.ae(count('p:last-child'), 1)
+        self.ae(count('p:nth-last-of-type(1)'), 1)
+
     # }}}
 
 
@@ -0,0 +1,44 @@
+'''
+Benchmarks for the conversion pipeline. These are not collected by pytest,
+run the individual modules with, for example::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_palmdoc
+'''
+import glob
+import os
+import time
+from contextlib import contextmanager
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'samples')
+
+
+def sample_paths(ext, args=()):
+    ' Return the paths given on the command line or all bundled samples with the extension ext '
+    return list(args) or sorted(glob.glob(os.path.join(SAMPLES_DIR, '*.' + ext)))
+
+
+@contextmanager
+def timer(results, name):
+    st = time.perf_counter()
+    try:
+        yield
+    finally:
+        results[name] = results.get(name, 0) + time.perf_counter() - st
+
+
+def load_oeb(path, output_fmt='epub'):
+    ' Read the e-book at path into an OEBBook the way the conversion pipeline does, returns (oeb, opts) '
+    from calibre.ebooks.conversion.plumber import Plumber, create_oebbook
+    from calibre.ptempfile import PersistentTemporaryDirectory
+    from calibre.utils.logging import Log
+    log = Log()
+    log.filter_level = log.ERROR
+    plumber = Plumber(path, 'dummy.' + output_fmt, log)
+    plumber.setup_options()
+    tdir = PersistentTemporaryDirectory('_bench')
+    with open(path, 'rb') as stream, plumber.input_plugin:
+        oeb = plumber.input_plugin(stream, plumber.opts, plumber.input_fmt, log, {}, tdir)
+        if not hasattr(oeb, 'manifest'):
+            oeb = create_oebbook(log, oeb, plumber.opts, encoding=plumber.input_plugin.output_encoding)
+    oeb.plumber_output_format = output_fmt
+    return oeb, plumber.opts
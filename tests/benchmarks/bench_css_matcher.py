@@ -0,0 +1,101 @@
+'''
+Compare Select.__call__ with the compiled matchers of Select.matcher(), for
+the selectors of the stylesheets of the bundled samples, on every spine
+document.
+
+Three uses are timed:
+
+  * testing whether a few tags of every document match each selector, as
+    when the style of a single tag is needed
+  * finding all the tags that match each selector, with one Select object
+    per document, as for the Stylizer
+  * finding all the tags that match the first few selectors, with a Select
+    object for each selector, as for the HTML transform rules
+
+The results are checked to be identical. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_css_matcher [book.epub ...]
+'''
+import os
+import sys
+
+from tests.benchmarks import load_oeb, sample_paths, timer
+
+# Test every TAG_STEP-th tag of every document for the first use
+TAG_STEP = 50
+
+
+def book_selectors(oeb):
+    from css_selectors import SelectorError, parse
+
+    from calibre.ebooks.oeb.base import OEB_STYLES
+    ans = {}
+    for item in oeb.manifest:
+        if item.media_type in OEB_STYLES:
+            for rule in item.data.cssRules:
+                if rule.type == rule.STYLE_RULE:
+                    for selector in rule.selectorList:
+                        try:
+                            parse(selector.selectorText)
+                        except SelectorError:
+                            continue
+                        ans[selector.selectorText] = True
+    return list(ans)
+
+
+def with_select(roots, selectors, use, times):
+    from css_selectors import Select
+    ans = []
+    with timer(times, 'select'):
+        for root in roots:
+            select = Select(root, ignore_inappropriate_pseudo_classes=True)
+            tags = tuple(root.iter('*'))[::TAG_STEP]
+            for text in selectors:
+                if use == 'few':
+                    matches = frozenset(select(text))
+                    ans.append(tuple(tag in matches for tag in tags))
+                    continue
+                if use == 'rules':
+                    select = Select(root, ignore_inappropriate_pseudo_classes=True)
+                ans.append(tuple(select(text)))
+    return ans
+
+
+def with_matcher(roots, selectors, use, times):
+    from css_selectors import Select
+    ans = []
+    with timer(times, 'matcher'):
+        for root in roots:
+            select = Select(root, ignore_inappropriate_pseudo_classes=True)
+            tags = tuple(root.iter('*'))[::TAG_STEP]
+            for text in selectors:
+                if use == 'few':
+                    ans.append(tuple(map(select.matcher(text), tags)))
+                    continue
+                if use == 'rules':
+                    select = Select(root, ignore_inappropriate_pseudo_classes=True)
+                ans.append(tuple(filter(select.matcher(text), root.iter('*'))))
+    return ans
+
+
+def main(args=sys.argv[1:]):
+    for path in sample_paths('epub', args):
+        oeb, opts = load_oeb(path)
+        roots = [item.data for item in oeb.spine]
+        selectors = book_selectors(oeb)
+        print(f'{os.path.basename(path)}: {len(roots)} documents')
+        for use, num, desc in (
+            ('few', None, f'every {TAG_STEP}th tag'), ('all', None, 'all tags, Select per document'),
+            ('rules', 100, 'all tags, Select per selector'),
+        ):
+            times = {}
+            expected = with_select(roots, selectors[:num], use, times)
+            actual = with_matcher(roots, selectors[:num], use, times)
+            if actual != expected:
+                raise SystemExit(f'{path}: the matchers found different tags')
+            print(f'  {len(selectors[:num])} selectors, {desc}: Select: {times["select"]:7.3f}s'
+                  f'  matcher: {times["matcher"]:7.3f}s  ({times["select"]/times["matcher"]:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+'''
+Benchmark the Dehyphenator with its word index against searching the whole
+document for every hyphenated word, as it used to.
+
+The text is synthetic, words from a vocabulary of a few thousand, some of
+them hyphenated at the end of a line in the markup each format looks for.
+Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_dehyphenator [size in MB]
+'''
+import sys
+import time
+
+from tests.unit.test_dehyphenator import FORMATS, reference_dehyphenator, synthetic_text
+
+
+def timed(dehyphenator, text, fmt):
+    st = time.perf_counter()
+    ans = dehyphenator(text, fmt, 1)
+    return time.perf_counter() - st, ans
+
+
+def main(args=sys.argv[1:]):
+    from calibre.ebooks.conversion.preprocess import Dehyphenator
+    size = float(args[0]) if args else 5
+    text = synthetic_text(int(size * 1024 * 1024))
+    print(f'{len(text)/1024/1024:.1f} MB of text')
+    for fmt in FORMATS:
+        new_time, new = timed(Dehyphenator(), text, fmt)
+        ref_time, ref = timed(reference_dehyphenator(), text, fmt)
+        if new != ref:
+            raise SystemExit(f'{fmt}: the results are different')
+        print(f'  {fmt:16s} full text search: {ref_time:7.2f}s  word index: {new_time:7.2f}s  ({ref_time/new_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Benchmark the table driven Huff/cdic decoder against the original bit by bit
+one.
+
+There are no Huff/cdic compressed samples, so the markup of the bundled sample
+EPUBs is split into 4 KB records and compressed with a dictionary of its most
+common words and word pairs, the way Mobipocket Creator does it. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_huffcdic [sample.epub ...]
+'''
+import itertools
+import os
+import sys
+import time
+from collections import Counter
+
+from tests.benchmarks import sample_paths
+from tests.benchmarks.bench_palmdoc import text_records
+from tests.unit.test_huffcdic import TOKEN, build_huffcdic
+
+
+def dictionary(records, num_words=3000, num_pairs=2000):
+    words, pairs = Counter(), Counter()
+    for r in records:
+        tokens = [t for t in TOKEN.findall(r) if len(t) > 2]
+        words.update(tokens)
+        pairs.update(itertools.pairwise(tokens))
+    words = [w for w, c in words.most_common(num_words)]
+    known = set(words)
+    pairs = [p for p, c in pairs.most_common(num_pairs * 2) if p[0] in known and p[1] in known][:num_pairs]
+    return words, pairs
+
+
+def timed(func, records):
+    st = time.perf_counter()
+    out = [func(r) for r in records]
+    return time.perf_counter() - st, out
+
+
+def main(args=sys.argv[1:]):
+    from calibre.ebooks.mobi.huffcdic import HuffReader, ReferenceReader
+    for path in sample_paths('epub', args):
+        records = text_records(path)
+        huffs, encoded = build_huffcdic(records, *dictionary(records), cdic_bits=12)
+        st = time.perf_counter()
+        reader = HuffReader(huffs)
+        setup = time.perf_counter() - st
+        new_time, new = timed(reader.unpack, encoded)
+        ref_time, ref = timed(HuffReader(huffs, ReferenceReader).unpack, encoded)
+        if new != records or ref != records:
+            raise SystemExit(f'{path}: decoding failed')
+        size = sum(map(len, records)) / (1024 * 1024)
+        print(f'{os.path.basename(path)}: {size:.1f} MB in {len(records)} records,'
+              f' {sum(map(len, encoded))/1024/1024:.1f} MB compressed')
+        print(f'  bit by bit:   {ref_time:7.2f}s')
+        print(f'  table driven: {new_time:7.2f}s  ({ref_time/new_time:.1f}x) + {setup:.2f}s to build the tables')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+Benchmark the image work of EPUB and MOBI output with an empty image cache,
+as for the first conversion of a book, and with the cache filled by that
+conversion, as when the book is converted again.
+
+The images are synthetic photographs, rescaled for the EPUB output profile and
+turned into MOBI image records and a thumbnail. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_image_cache [number of images]
+'''
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from tests.benchmarks.bench_rescale_images import photo, rescale
+
+
+def mobi_records(images):
+    from calibre.ebooks.mobi import MAX_THUMB_DIMEN, MAX_THUMB_SIZE
+    from calibre.ebooks.mobi.utils import rescale_image
+    from calibre.ebooks.mobi.writer2.resources import process_jpegs_for_amazon
+    st = time.perf_counter()
+    ans = [process_jpegs_for_amazon(rescale_image(raw)) for raw in images]
+    ans.append(rescale_image(images[0], dimen=MAX_THUMB_DIMEN, maxsizeb=MAX_THUMB_SIZE))
+    return time.perf_counter() - st, ans
+
+
+def main(args=sys.argv[1:]):
+    from calibre.utils.image_cache import ImageCache
+    num = int(args[0]) if args else 30
+    images = [photo(i) for i in range(num)]
+    print(f'{num} images of {sum(map(len, images))/1024/1024:.1f} MB')
+    with tempfile.TemporaryDirectory() as tdir, patch('calibre.utils.image_cache._image_cache', ImageCache(tdir)) as cache:
+        for name, func in (('EPUB', lambda: rescale(images, 1)), ('MOBI', lambda: mobi_records(images))):
+            cold_time, cold = func()
+            warm_time, warm = func()
+            if cold != warm:
+                raise SystemExit(f'{name}: the cached images are different')
+            print(f'  {name}: empty cache: {cold_time:7.2f}s  filled cache: {warm_time:7.2f}s  ({cold_time/warm_time:.0f}x)')
+        print(f'  {cache.disk_size()/1024/1024:.1f} MB in the cache')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+'''
+Benchmark rescaling the images of a book, as for EPUB output, when the images
+already fit the screen of the output profile, with the sizes read from the
+image headers and with every image opened by Pillow, as before.
+
+The images are synthetic photographs smaller than the screen, so that none of
+them is changed, without the image cache and with a cache filled by an
+earlier conversion. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_imghdr_probe [number of images]
+'''
+import sys
+import tempfile
+from unittest.mock import patch
+
+from tests.benchmarks.bench_rescale_images import photo, rescale
+
+
+def main(args=sys.argv[1:]):
+    num = int(args[0]) if args else 300
+    distinct = [photo(i, size=(500, 700)) for i in range(min(num, 10))]
+    images = [distinct[i % len(distinct)] for i in range(num)]
+    print(f'{num} images of {sum(map(len, images))/1024/1024:.1f} MB')
+    from calibre.utils.image_cache import ImageCache
+    with tempfile.TemporaryDirectory() as tdir:
+        for name, cache in (('no cache', False), ('filled cache', ImageCache(tdir))):
+            with patch('calibre.utils.image_cache._image_cache', cache):
+                with patch('calibre.ebooks.oeb.transforms.rescale.needs_rescale', lambda *a: True):
+                    rescale(images, 1)
+                    open_time, opened = rescale(images, 1)
+                probe_time, probed = rescale(images, 1)
+            if opened != probed:
+                raise SystemExit('The images are different')
+            print(f'  {name}: opened with Pillow: {open_time:7.3f}s  headers only: {probe_time:7.3f}s'
+                  f'  ({open_time/probe_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
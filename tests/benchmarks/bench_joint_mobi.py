@@ -0,0 +1,85 @@
+'''
+Compare creating joint MOBI 6 + KF8 files from the bundled sample EPUBs with
+the KF8 book created before the MOBI 6 book and in a forked process at the
+same time.
+
+The records of both files are checked to be identical, apart from the two
+headers, which contain a random id. Conversions are not reproducible by
+default, so the uuids used for generated ids and font obfuscation, the string
+hash seed and the order in which the manifest is iterated are all fixed.
+Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_joint_mobi [book.epub ...]
+'''
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from operator import attrgetter
+from unittest.mock import patch
+
+from tests.benchmarks import sample_paths
+
+
+def convert(path, output, parallel):
+    from calibre.customize.ui import plugin_for_output_format
+    from calibre.ebooks.conversion.plumber import Plumber
+    from calibre.ebooks.oeb.base import Manifest
+    from calibre.utils.logging import Log
+    log = Log()
+    log.filter_level = log.ERROR
+    plumber = Plumber(path, output, log)
+    plumber.merge_ui_recommendations([('mobi_file_type', 'both', 3), ('mobi_parallel_joint', parallel, 3)])
+    plugin = plugin_for_output_format('mobi')
+    orig, times = plugin.convert, []
+
+    def timed_convert(*args):
+        st = time.perf_counter()
+        try:
+            return orig(*args)
+        finally:
+            times.append(time.perf_counter() - st)
+
+    counter = itertools.count(1)
+    with patch.object(plugin, 'convert', timed_convert), patch('os.cpu_count', return_value=max(2, os.cpu_count() or 1)), \
+            patch('uuid.uuid4', lambda: uuid.UUID(int=next(counter))), \
+            patch.object(Manifest, '__iter__', lambda self: iter(sorted(self.items, key=attrgetter('href')))), \
+            patch.object(Manifest, 'values', lambda self: sorted(self.items, key=attrgetter('href'))):
+        plumber.run()
+    return times[0]
+
+
+def records(path):
+    from calibre.ebooks.mobi.reader.mobi6 import MobiReader
+    from calibre.utils.logging import Log
+    log = Log()
+    log.filter_level = log.ERROR + 1
+    sections = [bytes(s) for s, h in MobiReader(path, log).sections]
+    boundary = sections.index(b'BOUNDARY')
+    # Record 0 of both books has the random uid and fonts are obfuscated with
+    # a random key
+    return [len(s) if s.startswith(b'FONT') else s for s in sections[1:boundary + 1] + sections[boundary + 2:]]
+
+
+def main(args=sys.argv[1:]):
+    if os.environ.get('PYTHONHASHSEED') != '0':
+        env = dict(os.environ, PYTHONHASHSEED='0', PYTHONPATH=os.pathsep.join(sys.path))
+        raise SystemExit(subprocess.call([sys.executable, '-m', 'tests.benchmarks.bench_joint_mobi'] + list(args), env=env))
+    with tempfile.TemporaryDirectory() as tdir:
+        for path in sample_paths('epub', args):
+            base = os.path.splitext(os.path.basename(path))[0]
+            serial, parallel = os.path.join(tdir, base + '-serial.mobi'), os.path.join(tdir, base + '-parallel.mobi')
+            serial_time = convert(path, serial, False)
+            parallel_time = convert(path, parallel, True)
+            if records(serial) != records(parallel):
+                raise SystemExit(f'{path}: the joint files are different')
+            print(f'{os.path.basename(path)}: {os.path.getsize(serial)/1024/1024:.1f} MB MOBI, time in the MOBI output plugin')
+            print(f'  KF8 first:       {serial_time:7.2f}s')
+            print(f'  KF8 in parallel: {parallel_time:7.2f}s  ({serial_time/parallel_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
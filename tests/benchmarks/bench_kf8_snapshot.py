@@ -0,0 +1,80 @@
+'''
+Benchmark creating KF8 books from the bundled sample EPUBs with the markup
+copied up front, as it used to be, against snapshots taken when a document is
+first changed and without preserving the markup at all, as for AZW3 output.
+
+The time spent in the KF8 writer is measured inside the AZW3 output plugin,
+after all the transforms of the conversion pipeline have run. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_kf8_snapshot [book.epub ...]
+'''
+import copy
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from tests.benchmarks import sample_paths
+
+
+def copy_all(self, preserve_data=True):
+    ' The old KF8Writer.dup_data(), which copies all markup and stylesheets '
+    import css_parser
+
+    from calibre.ebooks.mobi.writer8.main import XML_DOCS
+    from calibre.ebooks.oeb.base import OEB_STYLES
+    self._data_cache, self._snapshots = {}, None
+    for item in self.oeb.manifest:
+        if item.media_type in XML_DOCS:
+            self._data_cache[item.href] = copy.deepcopy(item.data)
+        elif item.media_type in OEB_STYLES:
+            self._data_cache[item.href] = css_parser.parseString(item.data.cssText, validate=False)
+
+
+def kf8_times(path, repeat=3):
+    from calibre.ebooks.conversion.plumber import Plumber
+    from calibre.ebooks.mobi.writer8 import main as writer8
+    from calibre.utils.logging import Log
+    log = Log()
+    log.filter_level = log.ERROR
+    create_kf8_book, results = writer8.create_kf8_book, {}
+
+    def timed(name, oeb, *args, **kw):
+        times = []
+        for i in range(repeat):
+            # Put back the markup changed when it is not preserved, outside
+            # of the timed code, except after the last run
+            snapshots = [item.snapshot() for item in oeb.manifest if item.media_type in writer8.XML_DOCS] if i < repeat - 1 else ()
+            st = time.perf_counter()
+            ans = create_kf8_book(oeb, *args, **kw)
+            times.append(time.perf_counter() - st)
+            for snapshot in snapshots:
+                snapshot.restore()
+        results[name] = min(times)
+        return ans
+
+    def create_all(oeb, opts, resources, for_joint=False, preserve_data=True):
+        with patch.object(writer8.KF8Writer, 'dup_data', copy_all):
+            timed('copy', oeb, opts, resources)
+        timed('snapshot', oeb, opts, resources)
+        # Changes the markup of the book, so it has to be last
+        return timed('none', oeb, opts, resources, preserve_data=False)
+
+    with tempfile.TemporaryDirectory() as tdir, patch.object(writer8, 'create_kf8_book', create_all):
+        Plumber(path, os.path.join(tdir, 'out.azw3'), log).run()
+    return results
+
+
+def main(args=sys.argv[1:]):
+    for path in sample_paths('epub', args):
+        results = kf8_times(path)
+        copy_time = results['copy']
+        print(f'{os.path.basename(path)}: time to create the KF8 book')
+        print(f'  {"markup copied up front:":23s} {copy_time:7.2f}s')
+        for name, label in (('snapshot', 'snapshots:'), ('none', 'markup not preserved:')):
+            print(f'  {label:23s} {results[name]:7.2f}s  ({copy_time/results[name]:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
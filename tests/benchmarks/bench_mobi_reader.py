@@ -0,0 +1,56 @@
+'''
+Compare the peak memory used to read the bundled MOBI/AZW3 samples with the
+file memory mapped and with every section copied out of the file, as the
+reader used to do.
+
+Every measurement is made in a fresh process. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_mobi_reader [book.azw3 ...]
+'''
+import os
+import subprocess
+import sys
+import tempfile
+
+from tests.benchmarks import sample_paths
+
+CHILD = '''
+import resource, sys, time
+from calibre.ebooks.mobi.reader import mobi6
+from calibre.ebooks.mobi.reader.mobi8 import Mobi8Reader
+from calibre.utils.logging import Log
+if sys.argv[2] == 'copy':
+    # Read the file and slice it as bytes, so every section is a copy
+    mobi6.map_stream = lambda stream: stream.read()
+    mobi6.memoryview = bytes
+log = Log()
+log.filter_level = log.ERROR + 1
+st = time.perf_counter()
+mr = mobi6.MobiReader(sys.argv[1], log)
+opened = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if mr.kf8_type is None:
+    mr.extract_content('.', {})
+else:
+    Mobi8Reader(mr, log)()
+print(opened, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, time.perf_counter() - st)
+'''
+
+
+def measure(path, mode):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    with tempfile.TemporaryDirectory() as tdir:
+        out = subprocess.check_output([sys.executable, '-c', CHILD, os.path.abspath(path), mode], cwd=tdir, env=env)
+    opened, rss, elapsed = out.split()[-3:]
+    return int(opened) / 1024, int(rss) / 1024, float(elapsed)
+
+
+def main(args=sys.argv[1:]):
+    for path in list(args) or sample_paths('azw3') + sample_paths('mobi'):
+        print(f'{os.path.basename(path)}: {os.path.getsize(path)/1024/1024:.1f} MB, peak RSS after opening / after extracting')
+        for mode, label in (('copy', 'copied sections'), ('mmap', 'mapped sections')):
+            opened, rss, elapsed = measure(path, mode)
+            print(f'  {label}: {opened:7.1f} MB / {rss:7.1f} MB  {elapsed:6.2f}s')
+
+
+if __name__ == '__main__':
+    main()
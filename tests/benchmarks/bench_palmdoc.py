@@ -0,0 +1,54 @@
+'''
+Benchmark the PalmDoc compressor against the original rindex() based one.
+
+The markup of the bundled sample EPUBs is split into 4 KB records, the same
+record size used by the MOBI writers, and compressed with both
+implementations. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_palmdoc [sample.epub ...]
+'''
+import os
+import sys
+import time
+import zipfile
+
+from tests.benchmarks import sample_paths
+
+RECORD_SIZE = 4096
+
+
+def text_records(path):
+    records = []
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            if name.lower().endswith(('.html', '.xhtml', '.htm', '.css', '.ncx', '.opf')):
+                raw = zf.read(name)
+                records.extend(raw[i:i+RECORD_SIZE] for i in range(0, len(raw), RECORD_SIZE))
+    return records
+
+
+def timed(func, records):
+    st = time.perf_counter()
+    out = [func(r) for r in records]
+    return time.perf_counter() - st, out
+
+
+def main(args=sys.argv[1:]):
+    from calibre.ebooks.compression.palmdoc import decompress_doc, py_compress_doc, reference_compress_doc
+    for path in sample_paths('epub', args):
+        records = text_records(path)
+        size = sum(map(len, records)) / (1024 * 1024)
+        ref_time, ref_out = timed(reference_compress_doc, records)
+        new_time, new_out = timed(py_compress_doc, records)
+        if new_out != ref_out:
+            raise SystemExit(f'{path}: compressed output differs from the reference implementation')
+        for raw, compressed in zip(records, new_out):
+            if decompress_doc(compressed) != raw:
+                raise SystemExit(f'{path}: round trip through decompress_doc failed')
+        print(f'{os.path.basename(path)}: {len(records)} records, {size:.2f} MB')
+        print(f'  reference: {ref_time:7.2f}s {size/ref_time:7.2f} MB/s')
+        print(f'  hashchain: {new_time:7.2f}s {size/new_time:7.2f} MB/s  ({ref_time/new_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Benchmark running a list of literal search and replace rules over the HTML
+files of the bundled sample EPUBs with a compiled RuleSet, against running
+them one by one with re.sub(), as the HTML preprocessor used to.
+
+Two sets of rules are used: rules that replace the most common words and
+tags of each book, which match in every file, and rules that remove a
+element from a single file, the way rules that remove headers and footers
+only match in some files. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_preprocess_rules [book.epub ...] [--rules N]
+'''
+import os
+import re
+import sys
+import time
+import zipfile
+from collections import Counter
+from functools import partial
+
+from tests.benchmarks import sample_paths
+
+
+def html_files(path):
+    with zipfile.ZipFile(path) as zf:
+        return [zf.read(name).decode('utf-8', 'replace') for name in zf.namelist()
+                if name.lower().endswith(('.html', '.xhtml', '.htm'))]
+
+
+def common_rules(files, num_rules):
+    tokens = Counter()
+    for raw in files:
+        tokens.update(re.findall(r'<[a-z]+|\w{2,}', raw))
+    return [(re.compile(re.escape(t)), f'[{i}]') for i, (t, c) in enumerate(tokens.most_common(num_rules))]
+
+
+def rare_rules(files, num_rules):
+    texts = []
+    for raw in files[::max(1, len(files) // num_rules)][:num_rules]:
+        texts.extend(re.findall(r'(<[a-z]+[^<>]*>[^<>]{12,40})<', raw)[-1:])
+    return [(re.compile(re.escape(t)), '') for t in texts]
+
+
+def one_by_one(rules, raw):
+    for pattern, replacement in rules:
+        raw = pattern.sub(replacement, raw)
+    return raw
+
+
+def best_time(func, files, repeat=5):
+    times = []
+    for i in range(repeat):
+        st = time.perf_counter()
+        ans = [func(raw) for raw in files]
+        times.append(time.perf_counter() - st)
+    return min(times), ans
+
+
+def compare(files, rules):
+    from calibre.ebooks.conversion.preprocess import RuleSet
+    # The rule set is compiled once per conversion
+    rule_set = RuleSet(rules)
+    ref_time, expected = best_time(partial(one_by_one, rules), files)
+    new_time, actual = best_time(rule_set, files)
+    return ref_time, new_time, actual == expected
+
+
+def main(args=sys.argv[1:]):
+    args = list(args)
+    num_rules = 20
+    if '--rules' in args:
+        idx = args.index('--rules')
+        num_rules = int(args[idx + 1])
+        del args[idx:idx + 2]
+    for path in sample_paths('epub', args):
+        files = html_files(path)
+        size = sum(map(len, files)) / (1024 * 1024)
+        print(f'{os.path.basename(path)}: {size:.1f} MB of HTML in {len(files)} files')
+        for name, rules in (('common', common_rules(files, num_rules)), ('rare', rare_rules(files, num_rules))):
+            one_by_one, compiled, same = compare(files, rules)
+            if not same:
+                raise SystemExit(f'{path}: the results are different')
+            print(f'  {len(rules):3d} {name + " rules:":14s} one by one: {one_by_one:6.3f}s  rule set: {compiled:6.3f}s'
+                  f'  ({one_by_one/compiled:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
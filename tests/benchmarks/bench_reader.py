@@ -0,0 +1,49 @@
+'''
+Compare reading the bundled samples with the HTML parsed lazily in a single
+process and pre-parsed in worker processes.
+
+The parsed documents are checked to be identical. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_reader [book.epub ...]
+'''
+import os
+import sys
+
+from lxml import etree
+
+from tests.benchmarks import load_oeb, sample_paths, timer
+
+
+def read(path, workers, times):
+    from calibre.ebooks.oeb.base import OEB_DOCS
+    from calibre.ebooks.oeb.reader import OEBReader
+    orig = OEBReader._manifest_preparse
+
+    def preparse(self):
+        self.oeb.html_parse_workers = workers
+        return orig(self)
+
+    OEBReader._manifest_preparse = preparse
+    try:
+        with timer(times, workers):
+            oeb, opts = load_oeb(path)
+    finally:
+        OEBReader._manifest_preparse = orig
+    return {item.href: etree.tostring(item.data) for item in oeb.manifest.values() if item.media_type in OEB_DOCS}
+
+
+def main(args=sys.argv[1:]):
+    workers = max(2, os.cpu_count() or 1)
+    for path in sample_paths('epub', args):
+        times = {}
+        expected = read(path, 1, times)
+        actual = read(path, workers, times)
+        if actual != expected:
+            raise SystemExit(f'{path}: pre-parsing produced different documents')
+        print(f'{os.path.basename(path)}: {len(expected)} documents')
+        print(f'  lazy:                 {times[1]:7.2f}s')
+        print(f'  {workers:2d} worker processes: {times[workers]:7.2f}s  ({times[1]/times[workers]:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Benchmark rescaling the images of a book, as for EPUB output, one at a time
+and in worker threads.
+
+The images are synthetic photographs, JPEGs of noise, larger than the screen
+of the output profile so that all of them are decoded, resized and encoded
+again. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_rescale_images [number of images] [--workers N]
+'''
+import io
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+
+def photo(seed, size=(1600, 2400)):
+    from PIL import Image
+    bands = [Image.effect_noise(size, 40 + 10 * ((seed + i) % 5)) for i in range(3)]
+    buf = io.BytesIO()
+    Image.merge('RGB', bands).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+
+def rescale(images, workers):
+    from calibre.ebooks.oeb.base import OEBBook
+    from calibre.ebooks.oeb.transforms.rescale import RescaleImages
+    from calibre.utils.logging import Log
+    log = Log()
+    log.filter_level = log.ERROR
+    oeb = OEBBook(log, None)
+    for i, raw in enumerate(images):
+        oeb.manifest.add(f'img{i}', f'images/{i}.jpg', 'image/jpeg', data=raw)
+    opts = SimpleNamespace(dest=SimpleNamespace(width=600, height=800, dpi=166),
+        margin_left=0, margin_right=0, margin_top=0, margin_bottom=0)
+    st = time.perf_counter()
+    RescaleImages(check_colorspaces=True, workers=workers)(oeb, opts, max_size='profile')
+    elapsed = time.perf_counter() - st
+    return elapsed, {item.href: item.data for item in oeb.manifest}
+
+
+def main(args=sys.argv[1:]):
+    args = list(args)
+    workers = os.cpu_count() or 1
+    if '--workers' in args:
+        idx = args.index('--workers')
+        workers = int(args[idx + 1])
+        del args[idx:idx + 2]
+    num = int(args[0]) if args else 100
+    # A few distinct images, repeated, to keep the setup short
+    distinct = [photo(i) for i in range(min(num, 10))]
+    images = [distinct[i % len(distinct)] for i in range(num)]
+    print(f'{num} images of {sum(map(len, images))/1024/1024:.1f} MB, {os.cpu_count()} CPU cores')
+    serial_time, serial = rescale(images, 1)
+    parallel_time, parallel = rescale(images, workers)
+    if serial != parallel:
+        raise SystemExit('The rescaled images are different')
+    print(f'  one at a time: {serial_time:7.2f}s  {workers} threads: {parallel_time:7.2f}s'
+          f'  ({serial_time/parallel_time:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
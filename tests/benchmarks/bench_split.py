@@ -0,0 +1,46 @@
+'''
+Benchmark splitting a single large XHTML file to size with the serialized size
+index, against splitting and serializing the tree for every split point that
+is tried, as it used to.
+
+The file is synthetic, with headings, nested <div>s, paragraphs and the other
+tags the splitter looks for. It is split once as it is and once as a single
+chapter, whose only headings are in a list of contents at the start, too
+close to the start of the file to split on. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_split [size in MB] [--flow-size KB]
+'''
+import sys
+import time
+
+from tests.unit.test_split_size_index import split_to_size, synthetic_html
+
+
+def timed(html, max_flow_size, use_index):
+    st = time.perf_counter()
+    ans = split_to_size(html, max_flow_size, use_index=use_index)
+    return time.perf_counter() - st, ans
+
+
+def main(args=sys.argv[1:]):
+    args = list(args)
+    flow_size = 260
+    if '--flow-size' in args:
+        idx = args.index('--flow-size')
+        flow_size = int(args[idx + 1])
+        del args[idx:idx + 2]
+    size = float(args[0]) if args else 5
+    for contents in (0, 200):
+        html = synthetic_html(int(size * 1024 * 1024), contents=contents)
+        print(f'{len(html.encode("utf-8"))/1024/1024:.1f} MB of XHTML with {contents} headings of contents,'
+              f' split into files of at most {flow_size} KB')
+        new_time, new = timed(html, flow_size * 1024, True)
+        ref_time, ref = timed(html, flow_size * 1024, False)
+        if new != ref:
+            raise SystemExit('The split files are different')
+        print(f'  {len(new)} files  serialized per split point: {ref_time:7.2f}s  size index: {new_time:7.2f}s'
+              f'  ({ref_time/new_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+'''
+Compare the rule matching engines of the Stylizer on the bundled samples.
+
+Every spine document is stylized with Stylizer.rule_engine set to 'select'
+(match every rule against every document) and to 'indexed' (only match the
+rules found by the RuleIndex) and the resulting styles are checked to be
+identical. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_stylizer [book.epub ...]
+'''
+import os
+import sys
+
+from tests.benchmarks import load_oeb, sample_paths, timer
+
+
+def stylize(oeb, opts, engine, times):
+    from calibre.ebooks.oeb.stylizer import Stylizer
+    Stylizer.rule_engine = engine
+    if hasattr(oeb, 'stylizer_rules'):
+        del oeb.stylizer_rules
+    styles = []
+    with timer(times, engine):
+        stylizers = [Stylizer(item.data, item.href, oeb, opts, opts.output_profile) for item in oeb.spine]
+    for item, stylizer in zip(oeb.spine, stylizers):
+        styles.extend((dict(stylizer.style(e)._style), dict(stylizer.style(e)._pseudo_classes)) for e in item.data.iter('*'))
+    return styles
+
+
+def main(args=sys.argv[1:]):
+    from calibre.ebooks.oeb.stylizer import Stylizer
+    for path in sample_paths('epub', args):
+        oeb, opts = load_oeb(path)
+        times = {}
+        try:
+            for engine in ('select', 'indexed'):
+                stylize(oeb, opts, engine, times)  # warm up
+                times.clear()
+            expected = stylize(oeb, opts, 'select', times)
+            actual = stylize(oeb, opts, 'indexed', times)
+        finally:
+            Stylizer.rule_engine = 'indexed'
+        if actual != expected:
+            raise SystemExit(f'{path}: the indexed engine computed different styles')
+        print(f'{os.path.basename(path)}: {len(oeb.spine)} documents')
+        print(f'  select:  {times["select"]:7.2f}s')
+        print(f'  indexed: {times["indexed"]:7.2f}s  ({times["select"]/times["indexed"]:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
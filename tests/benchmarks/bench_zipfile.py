@@ -0,0 +1,47 @@
+'''
+Compare zipping the extracted contents of the bundled samples with a single
+thread and with the parallel writer of calibre.utils.zipfile.
+
+The archives are checked to be identical. Run with::
+
+    PYTHONPATH=src python -m tests.benchmarks.bench_zipfile [book.epub ...]
+'''
+import io
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+from tests.benchmarks import sample_paths, timer
+
+
+def build(tdir, workers, times, repeat=5):
+    from calibre.utils.zipfile import ZipFile
+    for i in range(repeat):
+        buf = io.BytesIO()
+        with timer(times, workers), ZipFile(buf, 'w', workers=workers) as zf:
+            zf.add_dir(tdir)
+    return buf.getvalue()
+
+
+def main(args=sys.argv[1:]):
+    workers = max(2, os.cpu_count() or 1)
+    for path in sample_paths('epub', args):
+        tdir = tempfile.mkdtemp(prefix='bench_zipfile_')
+        try:
+            with zipfile.ZipFile(path) as zf:
+                zf.extractall(tdir)
+            times = {}
+            expected = build(tdir, 1, times)
+            if build(tdir, workers, times) != expected:
+                raise SystemExit(f'{path}: the parallel writer produced a different archive')
+        finally:
+            shutil.rmtree(tdir, ignore_errors=True)
+        print(f'{os.path.basename(path)}: {len(expected)/1024:.0f} KB')
+        print(f'  1 thread:    {times[1]:7.2f}s')
+        print(f'  {workers:2d} threads:  {times[workers]:7.2f}s  ({times[1]/times[workers]:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+'''Fixtures shared by all tests.'''
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_image_cache(monkeypatch):
+    '''Keep conversions run by the tests, in this process or in the CLI, out
+    of the image cache in the user's cache folder. Tests of the cache patch in
+    their own.'''
+    monkeypatch.setenv('CALIBRE_IMAGE_CACHE_SIZE', '0')
+    monkeypatch.setattr('calibre.utils.image_cache._image_cache', False)
@@ -0,0 +1,19 @@
+'''
+Unit tests. Helpers shared by the test modules are defined here.
+'''
+
+
+def quiet_log():
+    ' Return a Log that prints nothing, for the conversion code under test '
+    from calibre.utils.logging import Log
+    log = Log()
+    log.filter_level = log.ERROR + 1
+    return log
+
+
+def empty_oeb(log=None):
+    ' Return an empty OEBBook that parses documents added to its manifest the way the conversion pipeline does '
+    from calibre.ebooks.conversion.preprocess import HTMLPreProcessor
+    from calibre.ebooks.oeb.base import OEBBook
+    log = quiet_log() if log is None else log
+    return OEBBook(log, HTMLPreProcessor(log))
@@ -0,0 +1,65 @@
+'''Tests for the word index of the Dehyphenator.'''
+import random
+import unittest
+
+FORMATS = ('html', 'pdf', 'txt', 'individual_words', 'html_cleanup', 'txt_cleanup')
+WORDS = ('reconstruction', 'dis', 'connected', 'ness', 'unhappy', 'ally', 'Rebuild', 'ings', 'x', 'İstanbul',
+    'straße', 'ex', 'ous', 'tion', 'co', 'operate', 'être', 'Über', 'ment', 'carry', 'ing', 'data_set', '42')
+MARKUP = ('</p>\n<p>', '</i> <i>', '</span></p><p class="x"><span>', '<p>', '\n', '\n\t', ' ', ' ', ' ', '. ')
+
+
+def synthetic_text(size, seed=0):
+    ' Text with words hyphenated at line ends, in the markup the Dehyphenator looks for '
+    rand = random.Random(seed)
+    vocabulary = list(WORDS) + [''.join(rand.choice('abcdefghijklmnopqrstuvwxyz') for i in range(rand.randint(2, 10)))
+        for j in range(3000)]
+    parts, total = [], 0
+    while total < size:
+        word = rand.choice(vocabulary)
+        if len(word) > 3 and rand.random() < 0.15:
+            cut = rand.randint(1, len(word) - 1)
+            word = word[:cut] + rand.choice('-‐') + rand.choice(MARKUP) + word[cut:]
+        elif rand.random() < 0.05:
+            word += '-' + rand.choice(vocabulary)
+        sep = rand.choice(MARKUP)
+        parts.extend((word, sep))
+        total += len(word) + len(sep)
+    return ''.join(parts)
+
+
+def reference_dehyphenator():
+    ' A Dehyphenator that searches the whole document for every word, as it used to '
+    from calibre.ebooks.conversion.preprocess import Dehyphenator
+
+    class ReferenceDehyphenator(Dehyphenator):
+
+        def in_document(self, text):
+            return self.html.find(text) != -1
+
+    return ReferenceDehyphenator()
+
+
+class TestDehyphenator(unittest.TestCase):
+
+    def test_same_as_full_text_search(self):
+        from calibre.ebooks.conversion.preprocess import Dehyphenator
+        for seed in range(3):
+            text = synthetic_text(20000, seed)
+            for fmt in FORMATS:
+                for length in (1, 50):
+                    self.assertEqual(Dehyphenator()(text, fmt, length), reference_dehyphenator()(text, fmt, length),
+                        f'{fmt} with seed {seed}')
+
+    def test_in_document(self):
+        from calibre.ebooks.conversion.preprocess import Dehyphenator
+        html = '<p class="x">Unhappy İstanbul co-operate\0 straße</p> well-known 3-d_x'
+        d = Dehyphenator()
+        d.index_document(html)
+        for text in ('', 'happ', 'unhappy', 'Unhappy', 'İstanbul', 'i̇stanbul', 'class', 'x', 'p', 'co-op', 'o-operat',
+                'co-operate', 'operate\0', 'ell-kn', 'well-known 3', '3-d_x', 'd-x', 'known-3', 'stanbul co', 'y</p>',
+                'strasse', 'straß'):
+            self.assertEqual(d.in_document(text), html.find(text) != -1, text)
+
+
+if __name__ == '__main__':
+    unittest.main()
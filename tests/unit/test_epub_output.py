@@ -0,0 +1,73 @@
+'''Tests for writing EPUB files straight from the OEBBook.'''
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from tests.unit import quiet_log
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', '..', 'samples', '2025-06.epub')
+# Identifiers that are randomly generated for every conversion
+RANDOM = re.compile(rb'[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}|navPoint id="[^"]+"|\d{4}-\d\d-\d\dT[\d:.+]+')
+
+
+class TestEPUBOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(prefix='epub_output_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def convert(self, name, container_callback=None, **options):
+        from calibre.customize.conversion import OptionRecommendation
+        from calibre.customize.ui import plugin_for_output_format
+        from calibre.ebooks.conversion.plumber import Plumber
+        log = quiet_log()
+        output = os.path.join(self.tdir, name)
+        plugin = plugin_for_output_format('epub')
+        if container_callback is not None:
+            plugin.container_callback = container_callback
+        try:
+            plumber = Plumber(SAMPLE, output, log)
+            plumber.merge_ui_recommendations([(k, v, OptionRecommendation.HIGH) for k, v in options.items()])
+            plumber.run()
+        finally:
+            plugin.__dict__.pop('container_callback', None)
+        with zipfile.ZipFile(output) as zf:
+            return zf.namelist(), {n: RANDOM.sub(b'', zf.read(n)) for n in zf.namelist() if not n.endswith('/')}
+
+    def test_matches_folder_output(self):
+        names, streamed = self.convert('streamed.epub')
+        self.assertEqual(names[:2], ['mimetype', 'META-INF/'])
+        self.assertEqual(streamed['mimetype'], b'application/epub+zip')
+        self.assertFalse([n for n in names if n.endswith('/') and n != 'META-INF/'])
+        # A container callback forces the book through a temporary folder
+        names, staged = self.convert('staged.epub', container_callback=lambda container: None)
+        self.assertEqual(staged, streamed)
+
+    def test_reproducible_order(self):
+        names, _ = self.convert('one.epub')
+        self.assertEqual(self.convert('two.epub')[0], names)
+
+    def test_compression_workers(self):
+        from unittest.mock import patch
+
+        from calibre.utils.zipfile import ZipFile
+        for callback in (None, lambda container: None):
+            with patch('calibre.ebooks.epub.ZipFile', wraps=ZipFile) as zf:
+                expected = self.convert('serial.epub', callback, epub_compression_workers=1)
+                self.assertEqual(zf.call_args.kwargs['workers'], 1)
+                self.assertEqual(self.convert('parallel.epub', callback, epub_compression_workers=3), expected)
+                self.assertEqual(zf.call_args.kwargs['workers'], 3)
+
+    def test_invalid_compression_level(self):
+        with self.assertRaisesRegex(ValueError, 'between 0 and 9'):
+            self.convert('invalid.epub', epub_compression_level=10)
+        self.assertFalse(os.path.exists(os.path.join(self.tdir, 'invalid.epub')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+'''Tests for flattening the CSS of a book in worker processes.'''
+import multiprocessing
+import os
+import unittest
+
+from lxml import etree
+
+from tests.unit import empty_oeb, quiet_log
+
+CSS = '''
+@page { margin: 1em }
+@font-face { font-family: X; src: url(x.ttf) }
+p { text-indent: 2em; font-size: 14px }
+.b { font-weight: bold }
+.c, .C { color: red }
+a:hover { color: blue }
+a.x:hover { color: green }
+h1 { font-size: 2em; margin-bottom: 30pt }
+'''
+
+HTML = '''<html xmlns="http://www.w3.org/1999/xhtml" style="color: gray"><head><link rel="stylesheet" href="style.css"/>
+<style>p.b {{ margin-left: {0}em }}</style></head><body>
+<h1 align="center">Chapter {0}</h1><p class="b c" style="font-size: {0}0%">One<!-- comment --></p>
+<p class="C">Two <font size="+{0}" color="red">big</font></p><table align="center"><tr><td valign="top">cell</td></tr></table>
+<p><a href="#x" class="x">link</a> <a href="#y">other</a> tail</p>
+</body></html>'''
+
+
+def make_oeb(num_docs):
+    from calibre.customize.ui import input_profiles, output_profiles
+    from calibre.ebooks.conversion.plumber import Plumber
+    from calibre.ebooks.oeb.base import CSS_MIME, XHTML_MIME
+    log = quiet_log()
+    sample = os.path.join(os.path.dirname(__file__), '..', '..', 'samples', '01.epub')
+    plumber = Plumber(sample, 'dummy.epub', log)
+    plumber.setup_options()
+    opts = plumber.opts
+    opts.source = next(p for p in input_profiles() if p.short_name == 'default')
+    opts.dest = next(p for p in output_profiles() if p.short_name == 'kindle')
+    oeb = empty_oeb(log)
+    oeb.manifest.add('css', 'style.css', CSS_MIME, data=CSS)
+    for i in range(num_docs):
+        item = oeb.manifest.add(f'c{i}', f'c{i}.xhtml', XHTML_MIME, data=etree.fromstring(HTML.format(i + 1)))
+        oeb.spine.add(item)
+    return oeb, opts
+
+
+@unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+class TestParallelFlatten(unittest.TestCase):
+
+    def flatten(self, workers, fbase=None):
+        from calibre.ebooks.oeb.stylizer import style_cache
+        from calibre.ebooks.oeb.transforms.flatcss import CSSFlattener
+        oeb, opts = make_oeb(5)
+        opts.css_flatten_workers = workers
+        fkey = opts.dest.fkey if fbase else None
+        CSSFlattener(fbase=fbase, fkey=fkey, lineh=None)(oeb, opts)
+        self.cache_counts = style_cache(oeb).counts()
+        docs = [etree.tostring(item.data, encoding='unicode') for item in oeb.spine]
+        sheets = sorted((item.href, item.data.cssText) for item in oeb.manifest.values() if item.media_type == 'text/css')
+        return docs, sheets, opts._stored_page_margins
+
+    def test_same_output(self):
+        for fbase in (None, 12):
+            expected = self.flatten(1, fbase)
+            actual = self.flatten(3, fbase)
+            self.assertEqual(expected, actual)
+            self.assertNotIn('data-calibre', ''.join(actual[0]))
+            self.assertIn('class="calibre', ''.join(actual[0]))
+
+    def test_cache_counts(self):
+        # Without a base font size every document is stylized once, so the
+        # workers look up as many inline stylesheets as a single process
+        self.flatten(1)
+        sheets, styles = self.cache_counts[:2], self.cache_counts[2:]
+        self.assertEqual(sum(sheets), 5)
+        self.assertGreater(sum(styles), 0)
+        self.flatten(3)
+        self.assertEqual(sum(self.cache_counts[:2]), 5)
+        self.assertGreater(sum(self.cache_counts[2:]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
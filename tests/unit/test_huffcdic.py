@@ -0,0 +1,200 @@
+'''Tests for the table driven Huff/cdic decoder.'''
+import heapq
+import random
+import re
+import struct
+import unittest
+from collections import Counter
+
+TOKEN = re.compile(rb'[A-Za-z]+ ?|.', re.DOTALL)
+
+
+def code_lengths(weights):
+    ' Huffman code lengths for the list of weights '
+    heap = [(w, i, (i,)) for i, w in enumerate(weights)]
+    heapq.heapify(heap)
+    lengths = [0] * len(weights)
+    while len(heap) > 1:
+        w1, i1, s1 = heapq.heappop(heap)
+        w2, i2, s2 = heapq.heappop(heap)
+        for s in s1 + s2:
+            lengths[s] += 1
+        heapq.heappush(heap, (w1 + w2, min(i1, i2), s1 + s2))
+    return lengths
+
+
+class BitWriter:
+
+    def __init__(self):
+        self.val = self.nbits = 0
+
+    def write(self, code, length):
+        self.val = (self.val << length) | code
+        self.nbits += length
+
+    def getvalue(self):
+        pad = -self.nbits % 8
+        return (self.val << pad).to_bytes((self.nbits + pad) // 8, 'big')
+
+
+def build_huffcdic(texts, words=(), pairs=(), cdic_bits=8, self_reference=False):
+    '''
+    Compress the list of byte strings texts, returning (huff records, text
+    records). The dictionary has all single bytes and the words as literal
+    entries and the pairs as entries that are themselves compressed. The two
+    halves of a pair are words or earlier pairs, given by their text. Codes
+    are assigned the way Mobipocket does it: longer codes have smaller values
+    and codes of the same length index the dictionary backwards.
+    '''
+    entries = [bytes((i,)) for i in range(256)] + list(words)
+    index = {e: i for i, e in enumerate(entries)}
+    literals = dict(index)
+    pair_index = {}
+    for a, b in pairs:
+        pair_index[(index[a], index[b])] = index[a + b] = len(entries)
+        entries.append((index[a], index[b]))
+    if self_reference:
+        entries.append(None)  # an entry that refers to itself
+
+    counts = Counter()
+    tokenized = []
+    for text in texts:
+        symbols = []
+        for m in TOKEN.finditer(text):
+            tok = m.group()
+            if tok in literals:
+                symbols.append(literals[tok])
+            else:
+                symbols.extend(index[tok[i:i+1]] for i in range(len(tok)))
+        merged = []
+        for s in symbols:
+            if merged and (merged[-1], s) in pair_index:
+                merged[-1] = pair_index[(merged[-1], s)]
+            else:
+                merged.append(s)
+        counts.update(merged)
+        tokenized.append(merged)
+    for i, e in enumerate(entries):
+        if isinstance(e, tuple):
+            counts.update(e)
+
+    lengths = code_lengths([counts[i] + 1 for i in range(len(entries))])
+    maxlen = max(lengths)
+    assert 8 <= maxlen <= 32
+    by_length = {L: [i for i in range(len(entries)) if lengths[i] == L] for L in range(1, 33)}
+    mincode, base, rawmax = [0] * 34, {}, [0] * 34
+    for L in range(maxlen - 1, 0, -1):
+        mincode[L] = (mincode[L + 1] + len(by_length[L + 1]) + 1) // 2
+    codes, order = {}, []
+    for L in range(1, maxlen + 1):
+        base[L] = len(order)
+        syms = by_length[L]
+        order.extend(syms)
+        # dictionary index r = rawmax - code, so the first symbol gets the
+        # largest code
+        rawmax[L] = base[L] + mincode[L] + len(syms) - 1
+        for j, s in enumerate(syms):
+            codes[s] = (rawmax[L] - (base[L] + j), L)
+
+    dict1 = []
+    for p in range(256):
+        for L in range(1, 9):
+            if by_length[L] and mincode[L] <= p >> (8 - L) < mincode[L] + len(by_length[L]):
+                dict1.append(L | 0x80 | (rawmax[L] << 8))
+                break
+        else:
+            dict1.append(9)
+    dict2 = []
+    for L in range(1, 33):
+        dict2 += [mincode[L], rawmax[L]]
+    huff = b'HUFF\x00\x00\x00\x18' + struct.pack('>LL', 16, 16 + 1024) + struct.pack('>256L', *dict1) + struct.pack('>64L', *dict2)
+
+    def encode(symbols):
+        w = BitWriter()
+        for s in symbols:
+            w.write(*codes[s])
+        return w.getvalue()
+
+    raw_entries = []
+    for s in order:
+        e = entries[s]
+        if e is None:
+            raw_entries.append((encode([s, 0]), 0))
+        elif isinstance(e, tuple):
+            raw_entries.append((encode(e), 0))
+        else:
+            raw_entries.append((e, 0x8000))
+    cdics = []
+    per_cdic = 1 << cdic_bits
+    for start in range(0, len(raw_entries), per_cdic):
+        chunk = raw_entries[start:start + per_cdic]
+        offsets, body, off = [], b'', 2 * len(chunk)
+        for data, flag in chunk:
+            offsets.append(off + len(body))
+            body += struct.pack('>H', len(data) | flag) + data
+        cdics.append(b'CDIC\x00\x00\x00\x10' + struct.pack('>LL', len(raw_entries), cdic_bits) + struct.pack(f'>{len(chunk)}H', *offsets) + body)
+    huffs = [huff] + cdics
+    records = [encode(symbols) for symbols in tokenized]
+    if self_reference:
+        records.append(encode([len(entries) - 1]))
+    return huffs, records
+
+
+def sample_text(num_words=20000, seed=7):
+    rnd = random.Random(seed)
+    vocab = [''.join(rnd.choice('etaoinshrdlucmfw') for _ in range(rnd.randint(1, 9))) for _ in range(800)]
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    text = ' '.join(rnd.choices(vocab, weights, k=num_words))
+    text = re.sub(r'(\w+ \w+ \w+ \w+ \w+ \w+ \w+ \w+)', r'<p>\1.</p>\n', text)
+    return text.encode('ascii'), vocab
+
+
+class TestHuffCdic(unittest.TestCase):
+
+    def setUp(self):
+        text, vocab = sample_text()
+        words = [w.encode() + b' ' for w in vocab[:300]]
+        # Pairs of words and pairs of a pair and a word, so that compressed
+        # entries refer to other compressed entries
+        pairs = [(words[i], words[i + 1]) for i in range(0, 100, 2)]
+        pairs += [(a + b, words[0]) for a, b in pairs[:10]]
+        self.records = [text[i:i + 4096] for i in range(0, len(text), 4096)]
+        self.words, self.pairs = words, pairs
+
+    def readers(self, huffs):
+        from calibre.ebooks.mobi.huffcdic import HuffReader, ReferenceReader
+        return HuffReader(huffs), HuffReader(huffs, ReferenceReader)
+
+    def test_decode(self):
+        huffs, records = build_huffcdic(self.records, self.words, self.pairs)
+        self.assertGreater(len(huffs), 2)
+        new, ref = self.readers(huffs)
+        for raw, expected in zip(records, self.records):
+            self.assertEqual(new.unpack(raw), expected)
+            self.assertEqual(ref.unpack(raw), expected)
+        # Expanded entries are reused
+        self.assertEqual(b''.join(map(new.unpack, records)), b''.join(self.records))
+
+    def test_long_codes(self):
+        from calibre.ebooks.mobi.huffcdic import LOOKUP_BITS
+        # Every byte equally likely, except for a few, gives codes longer
+        # than the lookup table
+        rnd = random.Random(3)
+        text = bytes(rnd.choices(range(256), [1] * 250 + [5000] * 6, k=100000))
+        records = [text[i:i + 4096] for i in range(0, len(text), 4096)]
+        huffs, encoded = build_huffcdic(records)
+        new, ref = self.readers(huffs)
+        self.assertIn(None, new.reader.lookup)
+        self.assertGreater(new.reader.decode_code(0)[0], LOOKUP_BITS)
+        self.assertEqual(list(map(new.unpack, encoded)), records)
+
+    def test_self_reference(self):
+        from calibre.ebooks.mobi import MobiError
+        huffs, records = build_huffcdic(self.records[:1], self.words, self.pairs, self_reference=True)
+        new, ref = self.readers(huffs)
+        self.assertEqual(new.unpack(records[0]), self.records[0])
+        self.assertRaises(MobiError, new.unpack, records[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+'''Tests for the on-disk cache of image transformations.'''
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        from calibre.utils.image_cache import ImageCache
+        self.tdir = tempfile.mkdtemp(prefix='image_cache_test_')
+        self.cache = ImageCache(self.tdir, max_size=4000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def test_get_set(self):
+        c = self.cache
+        key = c.key(b'data', 'op', 1, (2, 3))
+        self.assertNotEqual(key, c.key(b'data', 'op', 1, (2, 4)))
+        self.assertNotEqual(key, c.key(b'data', 'other', 1, (2, 3)))
+        self.assertNotEqual(key, c.key(b'datb', 'op', 1, (2, 3)))
+        self.assertIsNone(c.get(key))
+        c.set(key, [b'result', None, [['scale', 1, 2]]])
+        self.assertEqual(c.get(key), ([b'result', None, [['scale', 1, 2]]],))
+        c.set(key, None)
+        self.assertEqual(c.get(key), (None,))
+        with open(c.entry_path(key), 'wb') as f:
+            f.write(b'\xc1')
+        self.assertIsNone(c.get(key))
+        self.assertEqual((c.hits, c.misses), (2, 2))
+
+    def test_eviction(self):
+        c = self.cache
+        keys = [c.key(bytes([i]), 'op') for i in range(8)]
+        for i, key in enumerate(keys):
+            c.set(key, b'x' * 900)
+            # Use the first entry, so that it is the most recently used
+            os.utime(c.entry_path(keys[0]), (time.time() + i, time.time() + i))
+        self.assertLessEqual(c.disk_size(), 4000)
+        self.assertIsNotNone(c.get(keys[0]))
+        self.assertIsNotNone(c.get(keys[-1]))
+        self.assertIsNone(c.get(keys[1]))
+        c.clear()
+        self.assertEqual(c.disk_size(), 0)
+
+    def test_cached_transform(self):
+        from calibre.utils.image_cache import cached_image_transform
+        calls = []
+
+        @cached_image_transform('test', cacheable=lambda ans: ans != b'uncached')
+        def transform(data, size, scale=1):
+            calls.append(data)
+            if data == b'bad':
+                raise ValueError(data)
+            if data.startswith(b'same'):
+                return data
+            return data[:size] * scale
+
+        unchanged = b'same' * 1000
+        with patch('calibre.utils.image_cache._image_cache', self.cache):
+            for i in range(2):
+                self.assertEqual(transform(b'abcdef', 2), b'ab')
+                self.assertEqual(transform(b'abcdef', 2, scale=2), b'abab')
+                self.assertEqual(transform(b'uncached', 10), b'uncached')
+                self.assertRaises(ValueError, transform, b'bad', 1)
+                self.assertIs(transform(unchanged, 1), unchanged)
+        self.assertEqual(calls, [b'abcdef', b'abcdef', b'uncached', b'bad', unchanged, b'uncached', b'bad'])
+        # Only a marker is stored for the unchanged image
+        self.assertLess(self.cache.disk_size(), len(unchanged))
+        with patch('calibre.utils.image_cache._image_cache', False):
+            self.assertEqual(transform(b'abcdef', 2), b'ab')
+        self.assertEqual(len(calls), 8)
+
+    def test_rescale_images(self):
+        from calibre.utils.image_cache import ImageCache
+        from tests.unit.test_rescale_images import rescale
+        cache = ImageCache(self.tdir)
+        with patch('calibre.utils.image_cache._image_cache', False):
+            expected = rescale(1)
+        with patch('calibre.utils.image_cache._image_cache', cache):
+            self.assertEqual(rescale(2), expected)
+            self.assertEqual(cache.hits, 0)
+            misses = cache.misses
+            self.assertEqual(rescale(2), expected)
+        self.assertEqual((cache.hits, cache.misses), (misses, misses))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+'''Tests for reading the size and colorspace of images from their headers.'''
+import io
+import unittest
+
+COLORSPACES = {'1': 'gray', 'L': 'gray', 'LA': 'gray', 'I;16': 'gray', 'RGB': 'rgb', 'RGBA': 'rgb', 'CMYK': 'cmyk', 'P': 'palette'}
+
+
+def image_data(size, mode, fmt, **kw):
+    from PIL import Image
+    img = Image.linear_gradient('L').resize(size)
+    if mode == 'P':
+        img = Image.merge('RGB', (img, img.transpose(Image.Transpose.FLIP_LEFT_RIGHT), img)).quantize(16)
+    elif mode != 'L':
+        img = img.convert(mode)
+    buf = io.BytesIO()
+    img.save(buf, fmt, **kw)
+    return buf.getvalue()
+
+
+def exif():
+    from PIL import Image
+    ans = Image.Exif()
+    ans[0x0112] = 1  # orientation
+    return ans.tobytes()
+
+
+def images():
+    for size in ((1, 1), (37, 1200), (4097, 3)):
+        for mode in ('1', 'L', 'LA', 'RGB', 'RGBA', 'P'):
+            yield image_data(size, mode, 'PNG')
+        yield image_data(size, 'I;16', 'PNG')
+        for mode in ('L', 'RGB', 'CMYK'):
+            yield image_data(size, mode, 'JPEG')
+        yield image_data(size, 'RGB', 'JPEG', progressive=True)
+        yield image_data(size, 'RGB', 'JPEG', exif=exif(), icc_profile=b'\0' * 5000)
+        yield image_data(size, 'P', 'GIF')
+        for mode in ('RGB', 'RGBA'):
+            yield image_data(size, mode, 'WEBP')
+            yield image_data(size, mode, 'WEBP', lossless=True)
+        yield image_data(size, 'RGB', 'WEBP', exif=exif())
+
+
+class TestProbe(unittest.TestCase):
+
+    def test_same_as_pillow(self):
+        from PIL import Image
+
+        from calibre.utils.imghdr import identify, probe
+        for data in images():
+            img = Image.open(io.BytesIO(data))
+            expected = img.format.lower(), img.width, img.height, COLORSPACES[img.mode]
+            self.assertEqual(probe(data), expected)
+            self.assertEqual(probe(io.BytesIO(data)), expected)
+            self.assertEqual(identify(data), expected[:3])
+
+    def test_bad_data(self):
+        from calibre.utils.imghdr import probe
+        self.assertEqual(probe(b''), (None, -1, -1, None))
+        self.assertEqual(probe(b'not an image'), (None, -1, -1, None))
+        self.assertEqual(probe(b'\xff\xd8\xff\xe0\0\x10JFIF'), ('jpeg', -1, -1, None))
+        self.assertEqual(probe(b'RIFF\0\0\0\0WEBPVP8X'), ('webp', -1, -1, None))
+        self.assertEqual(probe(b'\x89PNG\r\n\x1a\n'), ('png', -1, -1, None))
+        self.assertEqual(probe(b'BM' + b'\0' * 50)[1:], (-1, -1, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
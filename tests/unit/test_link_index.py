@@ -0,0 +1,90 @@
+'''Tests for the index of the links between the files of a book.'''
+import unittest
+
+from lxml import etree
+
+from tests.unit import empty_oeb
+
+CHAPTER = '''<html xmlns="http://www.w3.org/1999/xhtml"><head><title>{0}</title>
+<link rel="stylesheet" href="../styles/style.css"/></head>
+<body><p><a href="{1}.html#n1">Next</a> <a href="#top">Top</a> <a href="http://example.com/x.html">Out</a>
+<img src="../images/a%20b.png"/></p></body></html>'''
+
+CSS = '''@font-face { font-family: "A"; src: url(../fonts/a.ttf) }
+p { background-image: url("../images/bg.png") }'''
+
+
+class TestLinkIndex(unittest.TestCase):
+
+    def setUp(self):
+        from calibre.ebooks.oeb.base import CSS_MIME, XHTML_MIME
+        self.oeb = oeb = empty_oeb()
+        add = oeb.manifest.add
+        self.one = add('one', 'text/one.html', XHTML_MIME, data=CHAPTER.format('One', 'two'))
+        self.two = add('two', 'text/two.html', XHTML_MIME, data=CHAPTER.format('Two', 'one'))
+        self.css = add('css', 'styles/style.css', CSS_MIME, data=CSS)
+        self.image = add('img', 'images/a b.png', 'image/png', data=b'\x89PNG')
+        self.font = add('font', 'fonts/a.ttf', 'font/ttf', data=b'\0')
+        self.unused = add('unused', 'images/unused.png', 'image/png', data=b'\x89PNG')
+        oeb.spine.add(self.one)
+        oeb.spine.add(self.two)
+
+    def test_links(self):
+        links = self.oeb.links
+        self.assertEqual([(l.href, l.fragment) for l in links.links_from(self.one)], [
+            ('styles/style.css', ''), ('text/two.html', 'n1'), ('text/one.html', 'top'), ('images/a%20b.png', '')])
+        self.assertEqual([l.elem.tag.rpartition('}')[2] for l in links.links_from(self.one)], ['link', 'a', 'a', 'img'])
+        self.assertEqual([(l.href, l.elem) for l in links.links_from(self.css)], [('fonts/a.ttf', None), ('images/bg.png', None)])
+        self.assertEqual(links.links_from(self.image), ())
+        self.assertIs(links.links_from(self.one), links.links_from(self.one))
+        self.assertEqual(links.referrers('styles/style.css'), {self.one, self.two})
+        self.assertEqual(links.referrers('text/one.html'), {self.one, self.two})
+        self.assertEqual(links.referrers('fonts/a.ttf'), {self.css})
+        self.assertEqual(links.referrers('http://example.com/x.html'), set())
+        self.assertEqual(links.referrers(self.image.href), {self.one, self.two})
+
+    def test_invalidation(self):
+        links = self.oeb.links
+        self.assertEqual(links.referrers('text/two.html'), {self.one, self.two})
+        root = etree.fromstring(CHAPTER.format('One', 'three'))
+        self.one.data = root
+        self.assertEqual(links.referrers('text/two.html'), {self.two})
+        self.assertEqual(links.referrers('text/three.html'), {self.one})
+
+        for a in root.iter('{*}a'):
+            a.set('href', 'two.html')
+        self.assertEqual(links.referrers('text/two.html'), {self.two})
+        links.invalidate(self.one)
+        self.assertEqual(links.referrers('text/two.html'), {self.one, self.two})
+        self.assertEqual(links.referrers('text/three.html'), set())
+
+        self.oeb.manifest.remove(self.two)
+        self.assertEqual(links.referrers('text/two.html'), {self.one})
+        self.assertEqual(links.referrers('styles/style.css'), {self.one})
+
+    def test_rewrite_links(self):
+        links = self.oeb.links
+        self.assertEqual(links.referrers('images/bg.png'), {self.css})
+        links.rewrite_links(self.css, lambda url: url.replace('bg.png', 'bg2.png'))
+        self.assertEqual(links.referrers('images/bg.png'), set())
+        self.assertEqual(links.referrers('images/bg2.png'), {self.css})
+        links.rewrite_links(self.one, lambda url: url.replace('two.html', 'three.html'))
+        self.assertEqual(links.referrers('text/two.html'), {self.two})
+        self.assertEqual(links.referrers('text/three.html'), {self.one})
+
+    def test_trim_manifest(self):
+        from calibre.ebooks.oeb.transforms.trimmanifest import ManifestTrimmer
+        ManifestTrimmer()(self.oeb, None)
+        self.assertEqual(set(self.oeb.manifest), {self.one, self.two, self.css, self.image, self.font})
+
+    def test_rename_files(self):
+        from calibre.ebooks.oeb.transforms.filenames import FlatFilenames
+        FlatFilenames()(self.oeb, None)
+        hrefs = self.oeb.manifest.hrefs
+        self.assertEqual(set(hrefs), {
+            'text_one.html', 'text_two.html', 'styles_style.css', 'images_a%20b.png', 'fonts_a.ttf', 'images_unused.png'})
+        one = hrefs['text_one.html']
+        self.assertEqual([(l.href, l.fragment) for l in self.oeb.links.links_from(one)], [
+            ('styles_style.css', ''), ('text_two.html', 'n1'), ('text_one.html', 'top'), ('images_a%20b.png', '')])
+        self.assertEqual(self.oeb.links.referrers('fonts_a.ttf'), {hrefs['styles_style.css']})
+        self.assertEqual(self.oeb.links.referrers('text/two.html'), set())
@@ -0,0 +1,103 @@
+'''Tests for the position lookups and part assembly of the KF8 reader.'''
+import glob
+import os
+import tempfile
+import unittest
+from itertools import count
+from unittest.mock import patch
+from uuid import UUID
+
+from tests.unit import quiet_log
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', '..', 'samples', '*.azw3')))
+
+
+def get_id_tag(self, pos):
+    ' The linear search for the anchor before pos that Mobi8Reader used to do '
+    from calibre.ebooks.mobi.reader.mobi8 import reverse_tag_iter
+    fi = self.get_file_info(pos)
+    if fi.num is None and fi.start is None:
+        raise ValueError(f'No file contains pos: {pos}')
+    textblock = self.parts[fi.num]
+    npos = pos - fi.start
+    pgt = textblock.find(b'>', npos)
+    plt = textblock.find(b'<', npos)
+    if plt == npos or pgt < plt:
+        npos = pgt + 1
+    for tag in reverse_tag_iter(textblock[0:npos]):
+        m = self.id_re.match(tag) or self.name_re.match(tag)
+        if m is not None:
+            return m.group(1)
+        m = self.aid_re.match(tag)
+        if m is not None:
+            self.linked_aids.add(m.group(1).decode('utf-8'))
+            return m.group(1) + b'-' + self.aid_anchor_suffix
+    return b''
+
+
+def get_file_info(self, pos):
+    from calibre.ebooks.mobi.reader.mobi8 import Part
+    for part in self.partinfo:
+        if pos >= part.start and pos < part.end:
+            return part
+    return Part(*[None] * len(Part._fields))
+
+
+class TestMobi8Reader(unittest.TestCase):
+
+    def read(self, path):
+        from calibre import CurrentDir
+        from calibre.ebooks.mobi.reader.mobi6 import MobiReader
+        from calibre.ebooks.mobi.reader.mobi8 import Mobi8Reader
+        log = quiet_log()
+        mr = MobiReader(path, log)
+        if mr.kf8_type is None:
+            return None, None
+        m8 = Mobi8Reader(mr, log)
+        with tempfile.TemporaryDirectory() as tdir, CurrentDir(tdir), patch(
+                'calibre.ebooks.mobi.reader.mobi8.uuid4', side_effect=(UUID(int=i) for i in count())):
+            m8()
+            files = {}
+            for name in glob.glob(os.path.join('text', '*')):
+                with open(name, 'rb') as f:
+                    files[name] = f.read()
+        return m8, files
+
+    def test_same_output(self):
+        from calibre.ebooks.mobi.reader.mobi8 import Mobi8Reader
+        for path in SAMPLES:
+            m8, files = self.read(path)
+            if m8 is None:
+                continue
+            with patch.object(Mobi8Reader, 'assemble_skeleton', Mobi8Reader.assemble_skeleton_slowly), patch.object(
+                    Mobi8Reader, 'get_id_tag', get_id_tag), patch.object(Mobi8Reader, 'get_file_info', get_file_info):
+                expected_m8, expected = self.read(path)
+            self.assertTrue(files, path)
+            self.assertEqual(m8.partinfo, expected_m8.partinfo, path)
+            self.assertEqual(m8.linked_aids, expected_m8.linked_aids, path)
+            self.assertEqual(files, expected, path)
+
+    def test_lookups(self):
+        for path in SAMPLES:
+            m8, _ = self.read(path)
+            if m8 is None:
+                continue
+            m8.build_parts()
+            self.assertIsNotNone(m8.part_starts, path)
+            end = m8.partinfo[-1].end
+            for pos in list(range(0, end, max(1, end // 3000))) + [-1, end - 1, end, end + 1]:
+                fi = m8.get_file_info(pos)
+                self.assertEqual(fi, get_file_info(m8, pos), (path, pos))
+                if fi.num is None:
+                    self.assertRaises(ValueError, m8.get_id_tag, pos)
+                    continue
+                m8.linked_aids = set()
+                ans = m8.get_id_tag(pos)
+                found = m8.linked_aids
+                m8.linked_aids = set()
+                self.assertEqual(ans, get_id_tag(m8, pos), (path, pos))
+                self.assertEqual(found, m8.linked_aids, (path, pos))
+
+
+if __name__ == '__main__':
+    unittest.main()
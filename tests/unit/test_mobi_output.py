@@ -0,0 +1,116 @@
+'''Tests for creating the KF8 half of joint MOBI files in a forked process.'''
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.unit import quiet_log
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', '..', 'samples', '02.epub')
+
+
+def die():
+    ' Replaces the function run in the forked process, to kill it '
+    os._exit(1)
+
+
+@unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'fork is not available')
+class TestJointKF8(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(prefix='mobi_output_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def test_forked_kf8_book(self):
+        from calibre.customize.ui import plugin_for_output_format
+        from calibre.ebooks.conversion.plumber import Plumber
+        from calibre.ebooks.mobi.writer2.resources import Resources
+        from calibre.ebooks.mobi.writer8.main import create_kf8_book, start_joint_kf8_book
+        from calibre.ebooks.oeb.base import OEB_DOCS, XPath
+        log = quiet_log()
+        plugin = plugin_for_output_format('mobi')
+        books = []
+
+        def convert(oeb, output_path, input_plugin, opts, log):
+            opts.mobi_periodical = False
+            resources = Resources(oeb, opts, False, add_fonts=True)
+            before = {item.href: item.id for item in oeb.manifest}
+            result = start_joint_kf8_book(oeb, opts, resources)
+            # The inline ToC only exists in the forked process
+            self.assertEqual({item.href: item.id for item in oeb.manifest}, before)
+            forked = result()
+            self.assertIs(forked.metadata, oeb.metadata)
+            # The markup of the book is changed in place only in the forked
+            # process
+            for item in oeb.spine:
+                if item.media_type in OEB_DOCS:
+                    self.assertFalse(XPath('//*[@aid]')(item.data), item.href)
+            books.extend((forked, create_kf8_book(oeb, opts, resources, for_joint=True)))
+            # The serial KF8 book restores the markup it changed for MOBI 6
+            for item in oeb.spine:
+                if item.media_type in OEB_DOCS:
+                    self.assertFalse(XPath('//*[@aid]')(item.data), item.href)
+
+        plugin.convert = convert
+        try:
+            Plumber(SAMPLE, os.path.join(self.tdir, 'out.mobi'), log).run()
+        finally:
+            del plugin.convert
+        forked, serial = books
+        # Record 0 has a random uid
+        self.assertEqual(forked.records[1:], serial.records[1:])
+        self.assertEqual(forked.used_images, serial.used_images)
+        forked.uid = serial.uid
+        self.assertEqual(forked.record0, serial.record0)
+
+    def joint_kf8_book(self, parallel):
+        from unittest.mock import patch
+
+        from calibre.customize.conversion import OptionRecommendation
+        from calibre.customize.ui import plugin_for_output_format
+        from calibre.ebooks.conversion.plumber import Plumber
+        log = quiet_log()
+        plugin = plugin_for_output_format('mobi')
+        write_mobi, books, runs = plugin.write_mobi, [], []
+
+        def capture(input_plugin, output_path, kf8, resources):
+            runs.append(callable(kf8))
+
+            def result():
+                books.append(kf8() if callable(kf8) else kf8)
+                return books[-1]
+            return write_mobi(input_plugin, output_path, result, resources)
+
+        plugin.write_mobi = capture
+        try:
+            with patch('os.cpu_count', return_value=2), patch('calibre.ebooks.mobi.writer8.main._create_joint_kf8_book', die):
+                plumber = Plumber(SAMPLE, os.path.join(self.tdir, 'out.mobi'), log)
+                plumber.merge_ui_recommendations([
+                    ('mobi_file_type', 'both', OptionRecommendation.HIGH),
+                    ('mobi_parallel_joint', parallel, OptionRecommendation.HIGH)])
+                plumber.run()
+        finally:
+            del plugin.write_mobi
+        self.assertEqual(len(books), 1)
+        return books[0], runs
+
+    def test_failed_fork(self):
+        # The MOBI 6 book has changed the book by the time the process fails,
+        # so the conversion is run again, without a process
+        serial, runs = self.joint_kf8_book(False)
+        self.assertEqual(runs, [False])
+        recovered, runs = self.joint_kf8_book(True)
+        self.assertEqual(runs, [True, False])
+        self.assertEqual(recovered.records[1:], serial.records[1:])
+        self.assertEqual(recovered.used_images, serial.used_images)
+        # record0 is generated from the metadata when it is read, the two
+        # conversions have different random identifiers and uids
+        recovered.metadata, recovered.uid = serial.metadata, serial.uid
+        self.assertEqual(recovered.record0, serial.record0)
+
+
+if __name__ == '__main__':
+    unittest.main()
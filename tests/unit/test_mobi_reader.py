@@ -0,0 +1,64 @@
+'''Tests for reading the sections of MOBI files without copying them.'''
+import io
+import os
+import unittest
+
+from tests.unit import quiet_log
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', '..', 'samples', '2025-06.azw3')
+
+
+class TestSections(unittest.TestCase):
+
+    def read(self, stream):
+        from calibre.ebooks.mobi.reader.mobi6 import MobiReader
+        log = quiet_log()
+        return MobiReader(stream, log)
+
+    def test_mapped_sections(self):
+        with open(SAMPLE, 'rb') as f:
+            raw = f.read()
+            mapped = self.read(f)
+        copied = self.read(io.BytesIO(raw))
+        self.assertEqual(len(mapped.sections), len(copied.sections))
+        for (a, ha), (b, hb) in zip(mapped.sections, copied.sections):
+            self.assertIsInstance(a, memoryview)
+            self.assertEqual(ha, hb)
+            self.assertEqual(a, b)
+        # The mapped sections are views of the file
+        self.assertEqual(b''.join(x[0] for x in mapped.sections), raw[mapped.section_headers[0][0]:])
+        bh = mapped.book_header
+        self.assertIsInstance(bh.compression_type, bytes)
+        self.assertEqual(bh.title, copied.book_header.title)
+        self.assertEqual(mapped.kf8_type, copied.kf8_type)
+        self.assertEqual(mapped.extract_text(), copied.extract_text())
+        self.assertEqual(mapped.mobi_html, copied.mobi_html)
+        self.assertIsInstance(mapped.mobi_html, bytes)
+
+    def test_trailing_entries(self):
+        mr = self.read(SAMPLE)
+        data = mr.sections[1][0]
+        expected = mr.sizeof_trailing_entries(bytes(data))
+        self.assertEqual(mr.sizeof_trailing_entries(data), expected)
+        self.assertEqual(len(mr.text_section(1)), len(data) - expected)
+
+    def test_close(self):
+        with open(SAMPLE, 'rb') as f:
+            with self.read(f) as mr:
+                section = mr.sections[1][0]
+                mapping = mr._mapping
+                self.assertFalse(mapping.closed)
+            self.assertTrue(mapping.closed)
+            self.assertEqual(mr.sections, [])
+            self.assertRaises(ValueError, len, section)
+            # The stream belongs to the caller
+            self.assertFalse(f.closed)
+        mr = self.read(SAMPLE)
+        stream = mr._stream
+        mr.close()
+        self.assertTrue(stream.closed)
+        mr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+'''Tests for pre-parsing the HTML of a book in worker processes.'''
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+
+from tests.unit import empty_oeb
+
+OPF = '''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>Test</dc:title><dc:identifier id="id">x</dc:identifier></metadata>
+<manifest>{}</manifest><spine>{}</spine></package>'''
+
+HTML = '''<html><head><title>Chapter {0}</title></head>
+<body><p>Paragraph {0} with an <b>unclosed tag<p>and <a href="c{1}.html">a link</a>&nbsp;&copy;</body>'''
+
+
+@unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+class TestPreparse(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(prefix='oeb_reader_test_')
+        names = [f'c{i}.html' for i in range(6)]
+        for i, name in enumerate(names):
+            with open(os.path.join(self.tdir, name), 'w') as f:
+                f.write(HTML.format(i, (i + 1) % len(names)))
+        with open(os.path.join(self.tdir, 'broken.html'), 'wb') as f:
+            f.write(b'')
+        names.append('broken.html')
+        manifest = ''.join(f'<item id="i{i}" href="{name}" media-type="application/xhtml+xml"/>' for i, name in enumerate(names))
+        spine = ''.join(f'<itemref idref="i{i}"/>' for i in range(len(names)))
+        with open(os.path.join(self.tdir, 'content.opf'), 'w') as f:
+            f.write(OPF.format(manifest, spine))
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def read(self, workers):
+        from calibre.ebooks.oeb.reader import OEBReader
+        oeb = empty_oeb()
+        oeb.html_parse_workers = workers
+        OEBReader()(oeb, os.path.join(self.tdir, 'content.opf'))
+        return {item.href: etree.tostring(item.data) for item in oeb.spine}
+
+    def test_same_documents(self):
+        expected = self.read(1)
+        self.assertEqual(len(expected), 7)
+        self.assertEqual(self.read(3), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+'''Tests for snapshots of the data of manifest items.'''
+import unittest
+
+from lxml import etree
+
+from tests.unit import empty_oeb
+
+HTML = '''<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Snapshot</title></head>
+<body><p class="x">Some <b>text</b> with a tail &#169; and 日本語</p><!-- a comment --><img src="a.png"/></body></html>'''
+
+CSS = '''p.x { color: red; -webkit-writing-mode: vertical-rl }
+@font-face { font-family: "A"; src: url(a.ttf) }'''
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        from calibre.ebooks.oeb.base import CSS_MIME, XHTML_MIME
+        self.oeb = empty_oeb()
+        self.html = self.oeb.manifest.add('html', 'index.html', XHTML_MIME, data=HTML)
+        self.css = self.oeb.manifest.add('css', 'style.css', CSS_MIME, data=CSS)
+        self.image = self.oeb.manifest.add('img', 'a.png', 'image/png', data=b'\x89PNG')
+
+    def test_restore(self):
+        expected = etree.tostring(self.html.data)
+        snapshot = self.html.snapshot()
+        root = self.html.data
+        root.set('lang', 'ja')
+        for p in root.iter('{*}p'):
+            p.set('aid', '1')
+            p.getparent().remove(p)
+        self.assertNotEqual(etree.tostring(self.html.data), expected)
+        snapshot.restore()
+        # The root element is kept, so references to it stay valid
+        self.assertIs(self.html.data, root)
+        self.assertEqual(etree.tostring(self.html.data), expected)
+
+        sheet = self.css.data
+        snapshot = self.css.snapshot()
+        sheet.cssRules[0].style.color = 'blue'
+        snapshot.restore()
+        self.assertIs(self.css.data, sheet)
+        self.assertIn(b'red', self.css.data.cssText)
+        self.assertNotIn(b'blue', self.css.data.cssText)
+
+    def test_materialize(self):
+        snapshot = self.html.snapshot()
+        copy = snapshot.materialize()
+        self.assertIsNot(copy, self.html.data)
+        self.assertEqual(etree.tostring(copy), etree.tostring(self.html.data))
+        copy.set('lang', 'ja')
+        self.assertIsNone(self.html.data.get('lang'))
+        self.assertIsNone(snapshot.materialize().get('lang'))
+
+        sheet = self.css.snapshot().materialize()
+        self.assertIsNot(sheet, self.css.data)
+        self.assertEqual(sheet.cssText, self.css.data.cssText)
+        sheet.cssRules[0].style.color = 'blue'
+        self.assertIn(b'red', self.css.data.cssText)
+
+        snapshot = self.image.snapshot()
+        self.image.data = b'changed'
+        snapshot.restore()
+        self.assertEqual(self.image.data, b'\x89PNG')
+
+
+if __name__ == '__main__':
+    unittest.main()
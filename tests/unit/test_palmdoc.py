@@ -34,6 +34,57 @@ class TestPalmDoc(unittest.TestCase):
         test_data = b'0123456789asd0123456789asd|yyzzxxffhhjjkk'
         self.assertEqual(py_compress_doc(test_data), compress_doc(test_data))
 
+    def test_hash_chain_matches_reference(self):
+        '''The hash chain compressor must produce the same output as the rindex() one.'''
+        import random
+
+        from calibre.ebooks.compression.palmdoc import decompress_doc, py_compress_doc, reference_compress_doc
+        rng = random.Random(42)
+        alphabet = b'ab c@A\x00\x01\x08\x80\xff<p>'
+        test_cases = [
+            b'a' * 5000,
+            bytes(range(256)) * 20,
+            b'<p class="calibre1">Some text</p>\n' * 150,
+            b'x' * 2040 + b'0123456789abc' + b'y' * 2100 + b'0123456789abc',
+        ] + [bytes(rng.choice(alphabet) for _ in range(rng.randint(0, 600))) for _ in range(200)]
+        for data in test_cases:
+            compressed = py_compress_doc(data)
+            self.assertEqual(compressed, reference_compress_doc(data))
+            self.assertEqual(decompress_doc(compressed), data)
+
+    def test_decompress_overlapping_run(self):
+        from calibre.ebooks.compression.palmdoc import decompress_doc
+        # 'ab' followed by a back-reference of length 7 at distance 2
+        code = 0x8000 + (2 << 3) + (7 - 3)
+        self.assertEqual(decompress_doc(b'ab' + code.to_bytes(2, 'big')), b'ababababa')
+
+    def test_decompress_reference_before_start(self):
+        from calibre.ebooks.compression.palmdoc import decompress_doc
+        code = 0x8000 + (4 << 3) + (3 - 3)
+        self.assertEqual(decompress_doc(b'ab' + code.to_bytes(2, 'big')), b'ab\x00\x00a')
+
+    def test_decompress_records(self):
+        from calibre.ebooks.compression.palmdoc import compress_doc, decompress_doc, decompress_doc_records
+        code = 0x8000 + (4 << 3) + (3 - 3)
+        records = [
+            compress_doc(b'<p class="calibre1">Some text</p>\n' * 150),
+            b'ab' + code.to_bytes(2, 'big'),
+            b'',
+            compress_doc(bytes(range(256)) * 20),
+        ]
+        self.assertEqual(decompress_doc_records(records), b''.join(map(decompress_doc, records)))
+        self.assertEqual(decompress_doc_records([]), b'')
+
+    def test_compress_records_parallel(self):
+        '''Parallel compression must return the same records in the same order.'''
+        from calibre.ebooks.compression.palmdoc import MIN_RECORDS_PER_WORKER, compress_doc, compress_doc_records
+        records = [(b'<p id="%d">Record text</p>' % i) * 100 for i in range(2 * MIN_RECORDS_PER_WORKER + 3)]
+        expected = [compress_doc(r) for r in records]
+        self.assertEqual(compress_doc_records(records, workers=2), expected)
+        self.assertEqual(compress_doc_records(records, workers=1), expected)
+        self.assertEqual(compress_doc_records(records[:3], workers=4), expected[:3])
+        self.assertEqual(compress_doc_records([]), [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+'''Tests for the compiled rule sets of the HTML preprocessor.'''
+import json
+import random
+import re
+import unittest
+from types import SimpleNamespace
+
+from tests.unit import quiet_log
+
+
+def apply_one_by_one(rules, html):
+    for pattern, replacement in rules:
+        html = pattern.sub(replacement, html)
+    return html
+
+
+class TestRuleSet(unittest.TestCase):
+
+    def test_literals(self):
+        from calibre.ebooks.conversion.preprocess import RuleSet
+        rand = random.Random(0)
+        for i in range(3000):
+            rules = []
+            for j in range(rand.randint(2, 5)):
+                text = ''.join(rand.choice('ab<>xy') for k in range(rand.randint(1, 3)))
+                replacement = ''.join(rand.choice('abxyz') for k in range(rand.randint(0, 3)))
+                rules.append((re.compile(text), replacement))
+            html = ''.join(rand.choice('ab<>xyz') for k in range(60))
+            rule_set = RuleSet(rules)
+            self.assertEqual(len(rule_set.passes), 1)
+            stats = {}
+            self.assertEqual(rule_set(html, stats=stats), apply_one_by_one(rules, html), rules)
+            counts, raw = {}, html
+            for pattern, replacement in rules:
+                raw, n = pattern.subn(replacement, raw)
+                counts[pattern.pattern] = counts.get(pattern.pattern, 0) + n
+            self.assertEqual({k: v[1] for k, v in stats.items()}, counts)
+            self.assertEqual(rule_set(html[:5]), apply_one_by_one(rules, html[:5]), rules)
+
+    def test_passes(self):
+        from calibre.ebooks.conversion.preprocess import RuleSet
+        rules = [(re.compile(r'Chapter'), '<h2>'), (re.compile(r'Page 1'), '<hr/>'), (re.compile(r'\s+'), ' '),
+                 (re.compile(r'foo'), ''), (re.compile(r'bar'), 'baz'), (re.compile(r'x', re.I), 'y'), (re.compile(r'y'), 'w'),
+                 (re.compile(r'a.b'), r'\n')]
+        rule_set = RuleSet(rules)
+        self.assertEqual([p[2] for p in rule_set.passes], [
+            ('Chapter', 'Page 1'), (r'\s+',), ('foo', 'bar'), ('x',), ('y',), ('a.b',)])
+        html = 'Chapter  one Page 1 fobaroo xXy'
+        self.assertEqual(rule_set(html + 'a.b'), apply_one_by_one(rules, html + 'a.b'))
+        stats = {}
+        self.assertEqual(rule_set(html, stats=stats), apply_one_by_one(rules, html))
+        self.assertEqual(stats['Chapter'][1:], [1, 1, 2])
+        self.assertEqual(stats['Page 1'][1:], [1, 1, 2])
+        self.assertEqual(stats[r'\s+'][1:], [4, 1, 1])
+        self.assertEqual(stats['y'][1:], [3, 1, 1])
+
+        rules = [(re.compile(f'<p>{i}'), '') for i in range(4)] + [(re.compile(r'<p>1'), '<p>2')]
+        rule_set = RuleSet(rules)
+        self.assertIsNotNone(rule_set.passes[0][0])
+        for html in ('<p>0 <p>1 <p>1', 'No matches', '1'):
+            self.assertEqual(rule_set(html), apply_one_by_one(rules, html))
+
+
+class TestHTMLPreProcessor(unittest.TestCase):
+
+    def preprocessor(self, **opts):
+        from calibre.ebooks.conversion.preprocess import HTMLPreProcessor
+        log = quiet_log()
+        return HTMLPreProcessor(log, SimpleNamespace(**opts))
+
+    def test_user_rules(self):
+        from calibre.ebooks.conversion.preprocess import format_rule_stats, pdftohtml_rules
+        opts = {'sr1_search': 'Header', 'sr1_replace': '', 'sr2_search': '(', 'sr2_replace': 'x', 'sr3_search': r'\d+',
+            'sr3_replace': '#', 'search_replace': json.dumps([['Page', 'Leaf'], ['Leaf', 'P']]), 'keep_ligatures': True}
+        html = "<!-- created by calibre's pdftohtml --><html><body>Header Page 12<br>Leaf 3</body></html>"
+        before = list(pdftohtml_rules())
+        pp = self.preprocessor(**opts)
+        # search_replace is run first, in order, then sr3, sr2 and sr1
+        self.assertIn('P #', pp(html))
+        self.assertNotIn('Header', pp(html))
+        self.assertEqual(pdftohtml_rules(), before)
+        self.assertIsNone(pp.rule_stats)
+
+        pp = self.preprocessor(debug_pipeline='/tmp', **opts)
+        for i in range(2):
+            pp(html)
+        self.assertEqual(pp.rule_stats['Page'][1:3], [2, 2])
+        self.assertEqual(pp.rule_stats['Leaf'][1:3], [4, 2])
+        self.assertEqual(pp.rule_stats[r'\d+'][1:3], [4, 2])
+        self.assertNotIn('(', pp.rule_stats)
+        report = format_rule_stats(pp.rule_stats)
+        self.assertIn('Header', report)
+        stats = {k: list(v) for k, v in pp.rule_stats.items()}
+        pp.add_rule_stats(stats)
+        self.assertEqual(pp.rule_stats['Page'][1:3], [4, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
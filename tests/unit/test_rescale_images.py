@@ -0,0 +1,79 @@
+'''Tests for rescaling the images of a book in worker threads.'''
+import io
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+
+def image_data(size, mode='RGB', fmt='JPEG', seed=0):
+    from PIL import Image
+    bands = 1 if mode == 'P' else len(mode)
+    img = Image.frombytes(mode, size, bytes((i * (seed + 3) // 7) % 256 for i in range(size[0] * size[1] * bands)))
+    buf = io.BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+
+def make_oeb(stream):
+    from calibre.ebooks.oeb.base import OEBBook
+    from calibre.utils.logging import Log, Stream
+    log = Log(level=Log.DEBUG)
+    log.outputs = [Stream(stream)]
+    oeb = OEBBook(log, None)
+    for i in range(12):
+        oeb.manifest.add(f'j{i}', f'j{i}.jpg', 'image/jpeg', data=image_data((200 + i, 150), seed=i))
+    oeb.manifest.add('cmyk', 'cmyk.jpg', 'image/jpeg', data=image_data((300, 100), 'CMYK'))
+    oeb.manifest.add('small', 'small.png', 'image/png', data=image_data((50, 40), fmt='PNG'))
+    oeb.manifest.add('gif', 'anim.gif', 'image/gif', data=image_data((400, 90), 'P', 'GIF'))
+    oeb.manifest.add('webp', 'pic.webp', 'image/webp', data=image_data((150, 150), fmt='WEBP'))
+    oeb.manifest.add('broken', 'broken.jpg', 'image/jpeg', data=b'not an image')
+    oeb.manifest.add('empty', 'empty.png', 'image/png', data=b'')
+    return oeb
+
+
+def rescale(workers):
+    from calibre.ebooks.oeb.transforms.rescale import RescaleImages
+    stream = io.StringIO()
+    oeb = make_oeb(stream)
+    opts = SimpleNamespace(dest=SimpleNamespace(width=100, height=100, dpi=72),
+        margin_left=0, margin_right=0, margin_top=0, margin_bottom=0)
+    RescaleImages(check_colorspaces=True, workers=workers)(oeb, opts, max_size='120x80')
+    # The manifest is not ordered, so neither are the messages
+    return {item.href: item.data for item in oeb.manifest}, sorted(stream.getvalue().splitlines())
+
+
+# Without the image cache, so that the images are processed every time
+@patch('calibre.utils.image_cache._image_cache', False)
+class TestRescaleImages(unittest.TestCase):
+
+    def test_same_output(self):
+        from PIL import Image
+        expected, log = rescale(1)
+        self.assertEqual(Image.open(io.BytesIO(expected['j0.jpg'])).size, (106, 80))
+        self.assertEqual(Image.open(io.BytesIO(expected['pic.webp'])).format, 'JPEG')
+        self.assertEqual(Image.open(io.BytesIO(expected['cmyk.jpg'])).mode, 'RGB')
+        self.assertEqual(expected['small.png'], image_data((50, 40), fmt='PNG'))
+        self.assertIn('cmyk.jpg is in the CMYK colorspace', '\n'.join(log))
+        for workers in (0, 2, 5):
+            self.assertEqual(rescale(workers), (expected, log))
+
+    def test_unchanged_images_not_opened(self):
+        from calibre.ebooks.oeb.transforms import rescale as module
+        opened = []
+
+        def rescale_image(raw, *args):
+            opened.append(raw)
+            return original(raw, *args)
+
+        original = module.rescale_image
+        with patch.object(module, 'rescale_image', rescale_image):
+            result = rescale(1)
+        self.assertEqual(result, rescale(1))
+        # Only the small PNG fits the page, all the others need work or cannot
+        # be read from their headers
+        self.assertNotIn(image_data((50, 40), fmt='PNG'), opened)
+        self.assertEqual(len(opened), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
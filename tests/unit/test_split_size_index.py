@@ -0,0 +1,128 @@
+'''Tests for the serialized size index used to split large XHTML files.'''
+import random
+import unittest
+from unittest.mock import patch
+
+from tests.unit import quiet_log
+
+WORDS = ('split', 'point', 'größe', 'a&amp;b', '&lt;tag&gt;', '"quoted"', 'ünïcödé', '日本語', 'x', '\xa0', 'end')
+
+
+def synthetic_html(size, seed=0, contents=0):
+    '''
+    A single XHTML file of roughly size bytes, with the structures the splitter
+    has to deal with. With contents, it is a single chapter, without headings
+    except for a list of contents of that many headings at the start.
+    '''
+    rand = random.Random(seed)
+
+    def text(n=None):
+        return ' '.join(rand.choice(WORDS) for i in range(n or rand.randint(1, 40)))
+
+    def block(depth):
+        r = rand.random()
+        if depth < 3 and r < 0.15:
+            style = rand.choice(('', ' class="c"', ' style="font-weight:bold"'))
+            lead = rand.choice(('', '\n  ', text(3)))
+            return f'<div{style}>{lead}' + ''.join(block(depth + 1) for i in range(rand.randint(1, 6))) + '</div>\n'
+        if r < 0.25 and not contents:
+            level = rand.randint(1, 6)
+            return f'<h{level} id="h{rand.randint(0, 10**6)}">{text(4)}</h{level}>\n'
+        if r < 0.3:
+            return rand.choice(('<hr/>', '<br/>', '<!-- a comment -->', '<?pi data?>')) + rand.choice(('', '\n', text(2)))
+        if r < 0.33:
+            return rand.choice(('<img src="a.png" alt="a"/>', '<img src="b.png" style="display:none"/>',
+                '<svg xmlns="http://www.w3.org/2000/svg" width="10"><rect width="5"/></svg>'))
+        if r < 0.36:
+            return f'<pre>{text()}\n\n{text()}</pre>'
+        if r < 0.4:
+            return '<ul>' + ''.join(f'<li>{text(5)}</li>' for i in range(rand.randint(1, 5))) + '</ul>'
+        return f'<p>{text()}<i>{text(3)}</i>{text(2)}<br/>{text(5)}</p>' + rand.choice(('', '\n', ' tail '))
+
+    parts = [f'<h3>Chapter {i}</h3>\n' for i in range(contents)]
+    total = 0
+    while total < size:
+        parts.append(block(0))
+        total += len(parts[-1].encode('utf-8'))
+    lead = rand.choice(('', '\n', text(2)))
+    return ('<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Test</title></head>'
+            f'<body>{lead}' + ''.join(parts) + '</body>\n</html>')
+
+
+def flow_splitter(max_flow_size):
+    ' A FlowSplitter that only splits to size, without an OEBBook '
+    from calibre.ebooks.oeb.transforms.split import FlowSplitter
+    fs = FlowSplitter.__new__(FlowSplitter)
+    fs.log = quiet_log()
+    fs.max_flow_size, fs.split_trees = max_flow_size, []
+    fs.item = type('Item', (), {'href': 'index.html'})
+    return fs
+
+
+def split_to_size(html, max_flow_size, use_index=True):
+    from lxml import etree
+
+    from calibre.ebooks.oeb.transforms import split
+    fs = flow_splitter(max_flow_size)
+    tree = etree.fromstring(html).getroottree()
+    if use_index:
+        fs.split_to_size(tree)
+    else:
+        with patch.object(split.SizeIndex, '__init__', side_effect=ValueError('disabled')):
+            fs.split_to_size(tree)
+    return [etree.tostring(t.getroot(), encoding='utf-8') for t in fs.split_trees]
+
+
+class TestSizeIndex(unittest.TestCase):
+
+    def test_split_sizes(self):
+        from lxml import etree
+
+        from calibre.ebooks.oeb.polish.split import adjust_split_point, do_split
+        from calibre.ebooks.oeb.transforms.split import SPLIT_POINT_ATTR, SizeIndex, tostring
+        fs = flow_splitter(0)
+        predicted = 0
+        for seed in range(6):
+            root = etree.fromstring(synthetic_html(6000, seed))
+            if seed % 2:
+                root[1].text = None
+            index = SizeIndex(root)
+            self.assertEqual(index.size, len(tostring(root)))
+            rand = random.Random(seed)
+            for elem in root[1].iterdescendants(etree.Element):
+                if rand.random() < 0.3:
+                    index.set(elem, SPLIT_POINT_ATTR, rand.choice('01'))
+                    self.assertEqual(index.size, len(tostring(root)))
+                split_point = adjust_split_point(elem, fs.log)
+                ans = index.split_sizes(split_point)
+                if ans is None:
+                    self.assertIs(split_point, root[1][0])
+                    continue
+                predicted += 1
+                trees = do_split(split_point, fs.log)
+                self.assertEqual(ans, (tuple(len(tostring(t.getroot())) for t in trees),
+                                       tuple(fs.is_page_empty(t.getroot()) for t in trees)), root.getroottree().getpath(elem))
+        self.assertGreater(predicted, 100)
+
+    def test_not_indexed(self):
+        from lxml import etree
+
+        from calibre.ebooks.oeb.transforms.split import SizeIndex
+        for html in ('<html xmlns="http://www.w3.org/1999/xhtml"><head/></html>',
+                     '<!DOCTYPE html [<!ENTITY e "x">]><html xmlns="http://www.w3.org/1999/xhtml"><body>&e;</body></html>'):
+            parser = etree.XMLParser(resolve_entities=False)
+            with self.assertRaises(ValueError):
+                SizeIndex(etree.fromstring(html, parser=parser))
+
+    def test_same_split(self):
+        # The headings of the contents are too close to the start to split on,
+        # so the sizes of the trees for most split points come from the index
+        for seed, size, max_flow_size, contents in ((0, 200000, 20000, 0), (1, 100000, 12000, 100), (2, 200000, 40000, 60)):
+            html = synthetic_html(size, seed, contents)
+            expected = split_to_size(html, max_flow_size, use_index=False)
+            self.assertGreater(len(expected), 2)
+            self.assertEqual(split_to_size(html, max_flow_size), expected, f'seed {seed}')
+
+
+if __name__ == '__main__':
+    unittest.main()
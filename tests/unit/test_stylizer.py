@@ -0,0 +1,119 @@
+'''Tests for the rule index used by the Stylizer.'''
+import unittest
+from types import SimpleNamespace
+
+from lxml import etree
+
+from tests.unit import empty_oeb
+
+CSS = '''
+p { text-indent: 2em }
+P.A { color: red }
+.b { font-weight: bold }
+#X { font-style: italic }
+div > p { margin-left: 1em }
+div p:first-child { margin-top: 3px }
+li:nth-child(2n+1) { color: blue }
+*:not(.b) { letter-spacing: 1px }
+p:root { font-size: 20px }
+:root { color: green }
+[title] { text-align: center }
+h1 + p { text-indent: 0 }
+span:unsupported { color: yellow }
+table td { color: purple }
+.missing { color: orange }
+a:hover, a:first-letter { text-decoration: none }
+'''
+
+HTML = '''<html xmlns="http://www.w3.org/1999/xhtml"><head><link rel="stylesheet" href="style.css"/>
+<style>ol li.B { font-variant: small-caps }</style></head><body>
+<h1 title="t">Title</h1><p class="a b" id="x">One</p>
+<div><p>Two</p><p class="A">Three</p></div>
+<ol><li>1</li><li class="b">2</li><li>3</li></ol><a href="#x">link</a>
+</body></html>'''
+
+
+def make_oeb(num_docs=1):
+    from calibre.customize.ui import output_profiles
+    from calibre.ebooks.oeb.base import CSS_MIME, XHTML_MIME
+    oeb = empty_oeb()
+    oeb.manifest.add('css', 'style.css', CSS_MIME, data=CSS)
+    items = [oeb.manifest.add(f'c{i}', f'c{i}.xhtml', XHTML_MIME, data=etree.fromstring(HTML)) for i in range(num_docs)]
+    profile = next(p for p in output_profiles() if p.short_name == 'default')
+    return oeb, items, SimpleNamespace(output_profile=profile, change_justification='original')
+
+
+class TestRuleIndex(unittest.TestCase):
+
+    def make_oeb(self):
+        oeb, items, opts = make_oeb()
+        return oeb, items[0], opts
+
+    def styles(self, engine):
+        from calibre.ebooks.oeb.stylizer import Stylizer
+        oeb, item, opts = self.make_oeb()
+        orig = Stylizer.rule_engine
+        Stylizer.rule_engine = engine
+        try:
+            stylizer = Stylizer(item.data, item.href, oeb, opts)
+        finally:
+            Stylizer.rule_engine = orig
+        return [(list(stylizer.style(e)._style.items()), stylizer.style(e)._pseudo_classes) for e in item.data.iter('*')]
+
+    def test_engines_match(self):
+        self.assertEqual(self.styles('indexed'), self.styles('select'))
+
+    def test_rule_keys(self):
+        from calibre.ebooks.oeb.stylizer import RuleIndex, StylizerRules
+        oeb, item, opts = self.make_oeb()
+        rules = StylizerRules(opts, opts.output_profile, [oeb.manifest.hrefs['style.css'].data]).rules
+        index = RuleIndex(rules)
+        keys = {}
+        for kind in ('ids', 'classes', 'tags'):
+            for key, indices in getattr(index, kind).items():
+                for i in indices:
+                    keys[rules[i][3]] = kind, key
+        for i in index.universal:
+            keys[rules[i][3]] = None
+        self.assertEqual(keys['p'], ('tags', 'p'))
+        self.assertEqual(keys['P.A'], ('classes', 'a'))
+        self.assertEqual(keys['#X'], ('ids', 'x'))
+        self.assertEqual(keys['div > p'], ('tags', 'p'))
+        self.assertEqual(keys['li:nth-child(2n+1)'], ('tags', 'li'))
+        self.assertEqual(keys['.missing'], ('classes', 'missing'))
+        self.assertIsNone(keys['*:not(.b)'])
+        self.assertIsNone(keys['p:root'])
+        self.assertIsNone(keys['span:unsupported'])
+        self.assertTrue(index.has_first_letter)
+
+
+class TestStyleCache(unittest.TestCase):
+
+    def test_inline_sheets_shared(self):
+        from calibre.ebooks.oeb.stylizer import Stylizer, style_cache
+        oeb, items, opts = make_oeb(3)
+        stylizers = [Stylizer(item.data, item.href, oeb, opts, user_css='p { color: red }') for item in items]
+        cache = style_cache(oeb)
+        self.assertEqual((cache.sheets.hits, cache.sheets.misses), (4, 2))
+        self.assertGreater(cache.styles.hits, 0)
+        rules = oeb.stylizer_rules
+        self.assertTrue(all(s.rules is rules.rules for s in stylizers))
+        for item, stylizer in zip(items, stylizers):
+            p = item.data.find('.//{http://www.w3.org/1999/xhtml}p')
+            self.assertEqual(stylizer.style(p)._style['color'], 'red')
+            self.assertEqual(stylizer.style(p)._style['font-weight'], 'bold')
+
+    def test_bounded_cache(self):
+        from calibre.ebooks.oeb.stylizer import BoundedCache
+        cache = BoundedCache(2)
+        cache.store('a', 1)
+        cache.store('b', 2)
+        self.assertEqual(cache.lookup('a'), 1)
+        cache.store('c', 3)
+        self.assertIsNone(cache.lookup('b'))
+        self.assertEqual(list(cache), ['a', 'c'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
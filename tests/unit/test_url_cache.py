@@ -0,0 +1,46 @@
+'''Tests for the memoised URL functions of the OEB data model.'''
+import unittest
+
+HREFS = ('a.html', 'a b.html#x y', '../images/c%20d.png', '#frag', '', 'sub/./e.html', 'http://example.com/f g.html',
+         'file:///g.html', 'ünïcödé.html', 'a\\b.html', '../../h.css')
+BASES = ('index.html', 'text/one.html', 'text/sub/two.html', 'OEBPS/../x.html')
+
+
+class TestURLCache(unittest.TestCase):
+
+    def test_same_results(self):
+        from calibre.ebooks.oeb.base import abs_href, clear_url_caches, rel_href, urlnormalize, urlquote
+        for i in range(2):
+            for href in HREFS:
+                self.assertEqual(urlquote(href), urlquote.__wrapped__(href))
+                self.assertEqual(urlnormalize(href), urlnormalize.__wrapped__(href))
+                for base in BASES:
+                    self.assertEqual(abs_href(base, href), abs_href.__wrapped__(base, href))
+                    self.assertEqual(rel_href(base, href), rel_href.__wrapped__(base, href))
+            clear_url_caches()
+        self.assertEqual(urlquote('a b'), 'a%20b')
+        self.assertEqual(abs_href('text/one.html', '../images/a.png#x'), 'images/a.png#x')
+        self.assertRaises(ValueError, urlnormalize, 'http://[x')
+
+    def test_stats(self):
+        from calibre.ebooks.oeb.base import URL_CACHE_MAX_LENGTH, clear_url_caches, format_url_cache_stats, reset_url_cache_stats, url_cache_stats, urlnormalize
+        clear_url_caches()
+        urlnormalize('x y.html')
+        reset_url_cache_stats()
+        self.assertEqual(url_cache_stats()['urlnormalize'], (0, 0))
+        # The cache is kept
+        urlnormalize('x y.html')
+        self.assertEqual(url_cache_stats()['urlnormalize'], (1, 1))
+        clear_url_caches()
+        before = url_cache_stats()['urlnormalize']
+        for i in range(4):
+            urlnormalize('x y.html')
+        long_url = 'data:image/png;base64,' + 'A' * URL_CACHE_MAX_LENGTH
+        urlnormalize(long_url)
+        urlnormalize(long_url)
+        calls, hits = url_cache_stats()['urlnormalize']
+        self.assertEqual((calls - before[0], hits - before[1]), (6, 3))
+        self.assertNotIn((long_url,), urlnormalize.cache)
+        self.assertIn('urlnormalize:', format_url_cache_stats(url_cache_stats()))
+        clear_url_caches()
+        self.assertEqual(len(urlnormalize.cache), 0)
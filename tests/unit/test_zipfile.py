@@ -0,0 +1,132 @@
+'''Tests for writing archives with calibre.utils.zipfile.'''
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+def make_tree(root):
+    rnd = random.Random(42)
+    words = [bytes(rnd.choice(b'abcdefghij ') for _ in range(rnd.randint(2, 9))) for _ in range(500)]
+    sizes = {'a.txt': 0, 'b.txt': 10, 'sub/c.html': 300000, 'sub/deeper/d.css': 5000, 'e.bin': 2 * 1024 * 1024}
+    for name, size in sizes.items():
+        path = os.path.join(root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if name.endswith('.bin'):
+            data = rnd.randbytes(size)
+        else:
+            data = b' '.join(rnd.choice(words) for _ in range(size // 5))[:size]
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (1e9, 1e9))
+    return sorted(sizes)
+
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(prefix='zipfile_test_')
+        self.src = os.path.join(self.tdir, 'src')
+        self.names = make_tree(self.src)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def build(self, **kw):
+        from calibre.utils.zipfile import ZIP_STORED, ZipFile, ZipInfo
+        buf = io.BytesIO()
+        # add_dir() timestamps the entries for folders with the current time
+        with patch('time.time', return_value=1e9), ZipFile(buf, 'w', **kw) as zf:
+            zinfo = ZipInfo('mimetype', (2000, 1, 1, 0, 0, 0))
+            zinfo.compress_type = ZIP_STORED
+            zf.writestr(zinfo, b'application/epub+zip')
+            for i in range(20):
+                zinfo = ZipInfo(f'gen/{i}.txt', (2000, 1, 1, 0, 0, 0))
+                zinfo.compress_type = 8
+                zf.writestr(zinfo, b'generated text %d ' % i * (i * 1000))
+            zf.add_dir(self.src)
+        return buf.getvalue()
+
+    def test_identical_output(self):
+        from calibre.utils.zipfile import ZipFile
+        expected = self.build()
+        self.assertEqual(self.build(workers=4), expected)
+        # A tiny memory limit forces files through temporary files and
+        # writes them out as soon as possible
+        self.assertEqual(self.build(workers=3, memory_limit=1024), expected)
+        with ZipFile(io.BytesIO(expected)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist()[0], 'mimetype')
+            for name in self.names:
+                with open(os.path.join(self.src, *name.split('/')), 'rb') as f:
+                    self.assertEqual(zf.read(name), f.read())
+
+    def append(self, workers):
+        from calibre.utils.zipfile import ZipFile
+        buf = io.BytesIO()
+        with ZipFile(buf, 'w') as zf:
+            zf.writestr('one', b'1' * 100000)
+            zf.writestr('two', b'2' * 100000)
+        with ZipFile(buf, 'a', workers=workers) as zf:
+            zf.delete('one')
+            zf.writestr('three', b'3' * 100000)
+            self.assertEqual(zf.namelist(), ['two', 'three'])
+            zf.writestr('four', b'4')
+            self.assertEqual(zf.getinfo('four').file_size, 1)
+        return buf.getvalue()
+
+    def test_interleaved_reads(self):
+        from calibre.utils.zipfile import ZipFile
+        expected = self.append(1)
+        self.assertEqual(self.append(2), expected)
+        with ZipFile(io.BytesIO(expected)) as zf:
+            self.assertIsNone(zf.testzip())
+
+    def test_store_incompressible(self):
+        from calibre.utils.zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+        members = {
+            'font.WOFF2': b'x' * 10000, 'noise.dat': random.Random(1).randbytes(10000), 'text.html': b'<p>text</p>' * 1000,
+            # Images are only stored when they do not deflate
+            'flat.png': b'x' * 10000, 'photo.jpg': random.Random(2).randbytes(10000)}
+        results = []
+        for workers in (1, 2):
+            buf = io.BytesIO()
+            with patch('time.time', return_value=1e9), ZipFile(buf, 'w', workers=workers, store_incompressible=True) as zf:
+                for name, data in members.items():
+                    zf.writestr(name, data)
+                zf.add_dir(self.src, prefix='dir')
+            results.append(buf.getvalue())
+            types = {zi.filename: zi.compress_type for zi in zf.infolist()}
+            self.assertEqual(types['font.WOFF2'], ZIP_STORED)
+            self.assertEqual(types['flat.png'], ZIP_DEFLATED)
+            self.assertEqual(types['photo.jpg'], ZIP_STORED)
+            self.assertEqual(types['noise.dat'], ZIP_STORED)
+            self.assertEqual(types['dir/e.bin'], ZIP_STORED)
+            self.assertEqual(types['text.html'], ZIP_DEFLATED)
+            self.assertEqual(types['dir/sub/c.html'], ZIP_DEFLATED)
+            self.assertGreater(zf.getinfo('text.html').compress_time, 0)
+        self.assertEqual(results[0], results[1])
+        with ZipFile(io.BytesIO(results[0])) as zf:
+            self.assertIsNone(zf.testzip())
+            for name, data in members.items():
+                self.assertEqual(zf.read(name), data)
+
+    def test_compresslevel(self):
+        from calibre.utils.zipfile import ZIP_STORED, ZipFile
+        sizes = []
+        for level in (0, 1, 9):
+            buf = io.BytesIO()
+            with ZipFile(buf, 'w', compresslevel=level) as zf:
+                zf.add_dir(self.src)
+            sizes.append(len(buf.getvalue()))
+            if level == 0:
+                self.assertEqual({zi.compress_type for zi in zf.infolist()}, {ZIP_STORED})
+        self.assertGreater(sizes[0], sizes[1])
+        self.assertGreater(sizes[1], sizes[2])
+
+
+if __name__ == '__main__':
+    unittest.main()